@@ -1,3 +1,5 @@
+import os
+
 # urls
 BROKER_URL = 'PLAINTEXT://localhost:9092'
 DB_URL = 'jdbc:postgresql://postgres:5432/cta'  # 'jdbc:postgresql://localhost:5432/cta'
@@ -8,10 +10,84 @@ REST_PROXY_URL = 'http://localhost:8082'  # 'http://rest-proxy:8082'
 KAFKA_CONNECT_URL = "http://localhost:8083"
 KSQL_URL = "http://localhost:8088"
 
-# topic names
-TOPIC_NAME_ARRIVAL = 'com.udacity.arrival'
-TOPIC_NAME_STATIONS = 'com.udacity.stations'
-TOPIC_NAME_TRANS_STATIONS = 'com.udacity.trans_stations'
-TOPIC_NAME_TURNSTILE = 'com.udacity.turnstile'
-TOPIC_NAME_TURNSTILE_SUMMARY = 'com.udacity.turnstile_summary'
-TOPIC_NAME_WEATHER = 'com.udacity.weather'
+# topic names: every network of the simulation has its own namespace (see `Topics`); the default
+# one can be changed with the CTA_TOPIC_PREFIX environment variable, e.g. to run the Faust, KSQL
+# and connector setup of another network
+DEFAULT_TOPIC_PREFIX = 'com.udacity'
+TOPIC_PREFIX = os.environ.get('CTA_TOPIC_PREFIX', DEFAULT_TOPIC_PREFIX)
+
+
+class Topics:
+    """The topic names of one network, all below `prefix`"""
+
+    def __init__(self, prefix=TOPIC_PREFIX):
+        self.prefix = prefix
+        self.arrival = f'{prefix}.arrival'
+        self.stations = f'{prefix}.stations'
+        self.trans_stations = f'{prefix}.trans_stations'
+        self.turnstile = f'{prefix}.turnstile'
+        self.turnstile_summary = f'{prefix}.turnstile_summary'
+        self.weather = f'{prefix}.weather'
+        self.dashboard_state = f'{prefix}.dashboard_state'
+
+    def __repr__(self):
+        return f'Topics({self.prefix!r})'
+
+
+DEFAULT_TOPICS = Topics()
+TOPIC_NAME_ARRIVAL = DEFAULT_TOPICS.arrival
+TOPIC_NAME_STATIONS = DEFAULT_TOPICS.stations
+TOPIC_NAME_TRANS_STATIONS = DEFAULT_TOPICS.trans_stations
+TOPIC_NAME_TURNSTILE = DEFAULT_TOPICS.turnstile
+TOPIC_NAME_TURNSTILE_SUMMARY = DEFAULT_TOPICS.turnstile_summary
+TOPIC_NAME_WEATHER = DEFAULT_TOPICS.weather
+TOPIC_NAME_DASHBOARD_STATE = DEFAULT_TOPICS.dashboard_state
+
+# consumer groups of the server in scale-out mode: ingest workers share one group per input
+# topic, web front-ends (and the station catalogue) get a group per instance
+INGEST_GROUP_ID = 'cta-dashboard-ingest'
+STATE_PUBLISH_INTERVAL_MS = 1000
+
+# librdkafka statistics (0 = disabled). The producers of the simulation share a single client
+# whose stats are off by default; the handful of dashboard consumers report lag through them.
+PRODUCER_STATISTICS_INTERVAL_MS = 0
+CONSUMER_STATISTICS_INTERVAL_MS = 10000
+
+# a producer with this many messages waiting for delivery waits before enqueuing more; the
+# turnstile entries of a tick are produced in chunks, spread over this fraction of its interval
+PRODUCER_MAX_QUEUED = 20000
+# while it waits, it warns every PRODUCER_BACKPRESSURE_WARN_SECS and gives up (BufferError) after
+# PRODUCER_BACKPRESSURE_TIMEOUT_SECS, e.g. when the brokers are unreachable
+PRODUCER_BACKPRESSURE_WARN_SECS = 10.0
+PRODUCER_BACKPRESSURE_TIMEOUT_SECS = 120.0
+TURNSTILE_CHUNK_SIZE = 200
+TURNSTILE_PACING_FRACTION = 0.8
+
+# with --watch-ridership, seconds between checks of the ridership files for changes
+RIDERSHIP_CHECK_INTERVAL_SECS = 5.0
+
+# consumer offsets are committed after this many handled messages, or after this many seconds
+CONSUMER_COMMIT_BATCH = 1000
+CONSUMER_COMMIT_INTERVAL_SECS = 5.0
+
+# adaptive polling: a topic of priority p is fetched in batches of up to p * CONSUMER_BATCH_SIZE
+# messages and aims at a latency of CONSUMER_LATENCY_TARGET_SECS / p while idle; priorities are
+# per kind of topic (the last part of its name), in every network
+CONSUMER_LATENCY_TARGET_SECS = 2.0
+CONSUMER_BATCH_SIZE = 100
+CONSUMER_PRIORITIES = {
+    'arrival': 4,
+    'dashboard_state': 4,
+    'turnstile_summary': 2,
+    'trans_stations': 1,
+    'weather': 1,
+}
+
+# messages that cannot be decoded or handled go to this topic, or to a local file of JSON lines
+# if DEAD_LETTER_FILE is set; a topic is paused after CIRCUIT_BREAKER_THRESHOLD failures in a row
+TOPIC_NAME_DEAD_LETTER = f'{TOPIC_PREFIX}.dead_letter'
+DEAD_LETTER_FILE = None
+# seconds to wait for the dead letters still in flight when a consumer closes
+DEAD_LETTER_FLUSH_TIMEOUT_SECS = 10.0
+CIRCUIT_BREAKER_THRESHOLD = 50
+CIRCUIT_BREAKER_COOLDOWN_SECS = 5.0
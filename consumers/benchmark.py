@@ -0,0 +1,109 @@
+"""Measures the memory footprint and per-message cost of the dashboard models at scale
+
+Builds a synthetic network of `--stations` stations, then feeds it arrival and turnstile summary
+messages as the consumers would receive them, without Kafka:
+
+    python -m consumers.benchmark --stations 10000 --messages 200000
+"""
+import argparse
+import json
+import logging
+import random
+import time
+import tracemalloc
+
+import config
+from consumers.consumer import LocalMessage
+from consumers.models import Lines
+
+
+logger = logging.getLogger(__name__)
+
+
+LINES = ("red", "blue", "green")
+STATUSES = ("in_service", "out_of_service", "broken_down")
+
+
+def load_stations(lines, num_stations):
+    """Adds `num_stations` synthetic stations, spread over the lines in order"""
+    for station_id in range(num_stations):
+        station = {
+            "station_id": station_id,
+            "station_name": f"Station {station_id}",
+            "order": station_id,
+            "line": LINES[station_id % len(LINES)],
+        }
+        lines.process_message(
+            LocalMessage(config.TOPIC_NAME_TRANS_STATIONS, json.dumps(station), key=str(station_id))
+        )
+
+
+def make_messages(num_stations, num_messages, seed=0):
+    """Returns arrival and turnstile summary messages in a 2:1 ratio, one simulated second apart"""
+    rng = random.Random(seed)
+    counts = [0] * num_stations
+    start_ms = 1577836800000
+    messages = []
+    for i in range(num_messages):
+        timestamp_ms = start_ms + i * 1000
+        station_id = rng.randrange(num_stations)
+        if i % 3 == 2:
+            counts[station_id] += rng.randint(1, 20)
+            summary = json.dumps({"STATION_ID": station_id, "COUNT": counts[station_id]})
+            messages.append(LocalMessage(config.TOPIC_NAME_TURNSTILE_SUMMARY, summary, timestamp_ms=timestamp_ms))
+            continue
+        line = LINES[station_id % len(LINES)]
+        prev_station_id = station_id - len(LINES) if station_id >= len(LINES) else None
+        value = {
+            "station_id": station_id,
+            "train_id": f"{line[0].upper()}L{rng.randrange(100):03}",
+            "direction": "a",
+            "line": line,
+            "train_status": rng.choice(STATUSES),
+            "prev_station_id": prev_station_id,
+            "prev_direction": "a" if prev_station_id is not None else None,
+        }
+        messages.append(
+            LocalMessage(config.TOPIC_NAME_ARRIVAL, value, key={"timestamp": timestamp_ms}, timestamp_ms=timestamp_ms)
+        )
+    return messages
+
+
+def run_benchmark(num_stations, num_messages):
+    """Returns the model memory in bytes before and after the messages, and the time per message"""
+    tracemalloc.start()
+    lines = Lines()
+    load_stations(lines, num_stations)
+    loaded_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    messages = make_messages(num_stations, num_messages)
+    tracemalloc.start()
+    start = time.perf_counter()
+    for message in messages:
+        lines.process_message(message)
+    elapsed = time.perf_counter() - start
+    growth_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # The traced run is slower, time a second, untraced pass over the same messages
+    start = time.perf_counter()
+    for message in messages:
+        lines.process_message(message)
+    elapsed = min(elapsed, time.perf_counter() - start)
+    return loaded_bytes, growth_bytes, elapsed / max(num_messages, 1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Benchmarks the dashboard models with synthetic stations")
+    parser.add_argument("--stations", type=int, default=10000, help="number of stations (default: 10000)")
+    parser.add_argument("--messages", type=int, default=200000, help="number of messages (default: 200000)")
+    args = parser.parse_args()
+
+    loaded_bytes, growth_bytes, secs_per_message = run_benchmark(args.stations, args.messages)
+    logger.info(
+        "%s stations: %.1f MiB (%.0f bytes per station), +%.1f MiB after %s messages, %.2f us per message",
+        args.stations, loaded_bytes / 2 ** 20, loaded_bytes / max(args.stations, 1),
+        growth_bytes / 2 ** 20, args.messages, secs_per_message * 1e6,
+    )
@@ -1,19 +1,66 @@
 """Defines core consumer functionality"""
 import logging
 import socket
+import time
 from typing import List
 
-from confluent_kafka import Consumer, TopicPartition, OFFSET_BEGINNING
-from confluent_kafka.avro import AvroConsumer
-from confluent_kafka.avro.serializer import SerializerError
+from confluent_kafka import (
+    Consumer,
+    KafkaError,
+    KafkaException,
+    TopicPartition,
+    OFFSET_BEGINNING,
+    TIMESTAMP_CREATE_TIME,
+    TIMESTAMP_NOT_AVAILABLE,
+)
 from tornado import gen
 
 import config
+from consumers.errors import CircuitBreaker, RateLimitedLogger, dead_letter_queue
+from consumers.scheduler import PollScheduler
+from metrics import registry
 
 
 logger = logging.getLogger(__name__)
 
 
+class LocalMessage:
+    """Stand-in for a decoded `confluent_kafka.Message`, used to feed the models without Kafka"""
+
+    __slots__ = ("_topic", "_key", "_value", "_timestamp", "_partition", "_offset")
+
+    def __init__(self, topic, value, key=None, timestamp_ms=None, partition=0, offset=-1):
+        self._topic = topic
+        self._value = value
+        self._key = key
+        self._timestamp = timestamp_ms
+        self._partition = partition
+        self._offset = offset
+
+    def topic(self):
+        return self._topic
+
+    def value(self):
+        return self._value
+
+    def key(self):
+        return self._key
+
+    def timestamp(self):
+        if self._timestamp is None:
+            return TIMESTAMP_NOT_AVAILABLE, -1
+        return TIMESTAMP_CREATE_TIME, self._timestamp
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def error(self):
+        return None
+
+
 class KafkaConsumer:
     """Defines the base kafka consumer class"""
 
@@ -23,76 +70,319 @@ class KafkaConsumer:
         message_handler,
         is_avro=True,
         offset_earliest=False,
-        sleep_secs=1.0,
-        consume_timeout=0.1,
+        latency_target=None,
+        batch_size=None,
+        start_offsets=None,
+        group_id=None,
+        resume=False,
     ):
-        """Creates a consumer object for asynchronous use"""
+        """Creates a consumer object for asynchronous use
+
+        `start_offsets` maps partition numbers to the offsets to start from, e.g. the end offsets
+        returned by `read_to_end` or those of a snapshot; it takes precedence over everything
+        else. With `resume`, the other partitions continue from the group's committed offsets
+        (`offset_earliest` then only applies to partitions without any), otherwise
+        `offset_earliest` replays them from the beginning. Without a `group_id`, the group is
+        derived from the topic name.
+
+        Polling adapts to the traffic (see `consumers/scheduler.py`); `latency_target` (seconds)
+        and `batch_size` default to values derived from the topic's priority.
+
+        Offsets are committed explicitly, only for messages whose handler has returned: in
+        batches of `config.CONSUMER_COMMIT_BATCH` messages or every
+        `config.CONSUMER_COMMIT_INTERVAL_SECS`, asynchronously, and synchronously when
+        partitions are revoked or the consumer is closed. Offsets past dead-lettered messages
+        wait until those dead letters are written.
+        """
 
         self.topic_name_pattern = topic_name_pattern
         self.message_handler = message_handler
-        self.sleep_secs = sleep_secs
-        self.consume_timeout = consume_timeout
+        self.scheduler = PollScheduler.for_topic(topic_name_pattern, latency_target, batch_size)
         self.offset_earliest = offset_earliest
+        self.start_offsets = start_offsets or {}
+        self.resume = resume
+        # partition -> offset of the next message to handle, i.e. the offset to commit
+        self.positions = dict(self.start_offsets)
+        self.uncommitted = {}
+        self.num_uncommitted = 0
+        # (offsets, dead letter mark) of a commit waiting for its dead letters to be written
+        self.waiting_commit = None
+        self.last_commit = time.monotonic()
 
         self.broker_properties = {
             'bootstrap.servers': config.BROKER_URL,
-            'group.id': 'consumer-group-' + self.topic_name_pattern.replace('^', ''),
+            'group.id': group_id or 'consumer-group-' + self.topic_name_pattern.replace('^', ''),
             'client.id': 'consumer-' + socket.gethostname(),
-            'compression.type': "none",
-            'enable.idempotence': "true",
+            'enable.auto.commit': False,
             'auto.offset.reset': "earliest" if self.offset_earliest else "latest",
+            'on_commit': self._on_commit,
             # 'max.poll.interval.ms': '3600000'  # todo 1 hour?
         }
+        if config.CONSUMER_STATISTICS_INTERVAL_MS > 0:
+            self.broker_properties['statistics.interval.ms'] = config.CONSUMER_STATISTICS_INTERVAL_MS
+            self.broker_properties['stats_cb'] = self._on_stats
 
-        # Create the Consumer, using the appropriate type.
+        # Avro payloads are decoded here rather than inside `AvroConsumer.poll`,
+        # so that poll and decode time can be measured separately
+        self.serializer = None
+        self.serializer_error = None
         if is_avro is True:
-            self.broker_properties["schema.registry.url"] = config.SCHEMA_REGISTRY_URL
-            self.consumer = AvroConsumer(self.broker_properties)
-        else:
-            self.consumer = Consumer(self.broker_properties)
+            # The Avro stack is imported by the first Avro consumer, not by importing this module
+            from confluent_kafka.avro import CachedSchemaRegistryClient
+            from confluent_kafka.avro.serializer import SerializerError
+            from confluent_kafka.avro.serializer.message_serializer import MessageSerializer
+
+            self.serializer = MessageSerializer(CachedSchemaRegistryClient({"url": config.SCHEMA_REGISTRY_URL}))
+            self.serializer_error = SerializerError
+        self.consumer = Consumer(self.broker_properties)
+
+        metric_prefix = "consumer." + self.topic_name_pattern.replace('^', '')
+        self.poll_latency = registry.histogram(metric_prefix + ".poll_latency")
+        self.poll_delay = registry.histogram(metric_prefix + ".poll_delay")
+        self.decode_latency = registry.histogram(metric_prefix + ".decode_latency")
+        self.handle_latency = registry.histogram(metric_prefix + ".handle_latency")
+        self.consumed = registry.meter(metric_prefix + ".messages")
+        self.commits = registry.counter(metric_prefix + ".commits")
+        self.commit_errors = registry.counter(metric_prefix + ".commit_errors")
+        self.kafka_errors = registry.counter(metric_prefix + ".kafka_errors")
+        self.decode_errors = registry.counter(metric_prefix + ".decode_errors")
+        self.handler_errors = registry.counter(metric_prefix + ".handler_errors")
+        self.circuit_opened = registry.counter(metric_prefix + ".circuit_opened")
+
+        self.error_log = RateLimitedLogger(logger)
+        self.breaker = CircuitBreaker(config.CIRCUIT_BREAKER_THRESHOLD, config.CIRCUIT_BREAKER_COOLDOWN_SECS)
 
         # Configure the AvroConsumer and subscribe to the topics.
-        self.consumer.subscribe(topics=[self.topic_name_pattern], on_assign=self.on_assign)
+        self.consumer.subscribe(topics=[self.topic_name_pattern], on_assign=self.on_assign, on_revoke=self.on_revoke)
 
     def on_assign(self, consumer, partitions: List[TopicPartition]):
         """Callback for when topic assignment takes place"""
 
         for partition in partitions:
+            if partition.partition in self.start_offsets:
+                partition.offset = self.start_offsets[partition.partition]
+            # When resuming, the committed offset (or else `auto.offset.reset`) applies
+            elif self.resume:
+                continue
             # If the topic is configured to use `offset_earliest`, set the partition offset to the beginning or earliest
-            if self.offset_earliest:
+            elif self.offset_earliest:
                 partition.offset = OFFSET_BEGINNING
 
         logger.info("Partitions assigned for %s", self.topic_name_pattern)
         consumer.assign(partitions)
 
+    def on_revoke(self, consumer, partitions: List[TopicPartition]):
+        """Callback for when partitions are taken away: commits what has been handled so far"""
+        self.commit_all()
+        # Offsets whose dead letters are not written yet are left to the partitions' next owner
+        self.waiting_commit = None
+        self.uncommitted = {}
+        self.num_uncommitted = 0
+        for partition in partitions:
+            self.positions.pop(partition.partition, None)
+        logger.info("Partitions revoked for %s", self.topic_name_pattern)
+
+    def commit(self, asynchronous=True, timeout=0):
+        """Commits the offsets of all handled messages not committed yet
+
+        Offsets are only committed once the dead letters added before them have been written,
+        waiting up to `timeout` seconds for them; until then they are kept and retried by the
+        next commit. Returns whether no offsets are left waiting.
+        """
+        dead_letters = dead_letter_queue()
+        if self.waiting_commit is None:
+            if not self.uncommitted:
+                return True
+            self.waiting_commit = (self.uncommitted, dead_letters.mark())
+            self.uncommitted = {}
+            self.num_uncommitted = 0
+        self.last_commit = time.monotonic()
+        uncommitted, mark = self.waiting_commit
+        if not dead_letters.written_through(mark, timeout):
+            return False
+        self.waiting_commit = None
+        offsets = [
+            TopicPartition(self.topic_name_pattern, partition, offset)
+            for partition, offset in uncommitted.items()
+        ]
+        try:
+            self.consumer.commit(offsets=offsets, asynchronous=asynchronous)
+        except KafkaException as e:
+            self.commit_errors.inc()
+            logger.warning("Unable to commit offsets of %s: %s", self.topic_name_pattern, e)
+        return True
+
+    def commit_all(self, timeout=0):
+        """Commits synchronously, including the offsets handled while an earlier commit waited"""
+        if self.commit(asynchronous=False, timeout=timeout):
+            self.commit(asynchronous=False, timeout=timeout)
+
+    def _on_commit(self, err, partitions):
+        if err is not None:
+            self.commit_errors.inc()
+            logger.warning("Commit failed for %s: %s", self.topic_name_pattern, err)
+        else:
+            self.commits.inc()
+
+    def _on_stats(self, stats_json):
+        """librdkafka `stats_cb`: records the statistics and passes the consumer lag to the scheduler"""
+        summary = registry.stats_callback(stats_json)
+        lag = summary.get("consumer_lag")
+        if lag:
+            self.scheduler.set_lag(sum(lag.values()))
+
     async def consume(self):
         """Asynchronously consumes data from kafka topic"""
         while True:
-            num_results = 1
-            while num_results > 0:
-                num_results = self._consume()
-            await gen.sleep(self.sleep_secs)
+            num_results = self._consume()
+            if self.breaker.try_close():
+                logger.info("Resuming %s after a pause for failing messages", self.topic_name_pattern)
+                self.consumer.resume(self.consumer.assignment())
+            if time.monotonic() - self.last_commit >= config.CONSUMER_COMMIT_INTERVAL_SECS:
+                self.commit()
+            delay = self.scheduler.next_delay(num_results)
+            self.poll_delay.observe(delay)
+            # Even without a delay, yield so that the other consumers and the web handlers get their turn
+            await gen.sleep(delay)
 
     def _consume(self):
-        """Polls Kafka for messages. Returns 1 if a message was received, 0 otherwise"""
+        """Fetches and handles the messages available without blocking. Returns their number"""
+        start = time.perf_counter()
+        messages = self.consumer.consume(num_messages=self.scheduler.batch_size, timeout=0)
+        self.poll_latency.observe(time.perf_counter() - start)
+        for msg in messages:
+            self._process(msg)
+        return len(messages)
 
+    def _process(self, msg):
+        """Decodes and handles a single message"""
+        start = time.perf_counter()
+        if msg.error() is not None:
+            self.kafka_errors.inc()
+            self.error_log.error("kafka", "Consumer error on %s: %s", self.topic_name_pattern, msg.error())
+            return
+
+        raw_key, raw_value = msg.key(), msg.value()
+        if self.serializer is not None:
+            try:
+                self._decode(msg)
+            except self.serializer_error as e:
+                self.decode_errors.inc()
+                self._failed(msg, "decode", e, raw_key, raw_value)
+                return
+            decoded = time.perf_counter()
+            self.decode_latency.observe(decoded - start)
+            start = decoded
         try:
-            msg = self.consumer.poll(timeout=self.consume_timeout)  # in sec
-        except SerializerError as e:
-            logger.error(e)
-            msg = None
-
-        if msg is None:
-            pass
-        elif msg.error() is not None:
-            logger.error(msg.error())
-        else:
             self.message_handler(msg)
-            return 1
-        return 0
+        except Exception as e:
+            self.handler_errors.inc()
+            self._failed(msg, "handler", e, raw_key, raw_value)
+            return
+        self.handle_latency.observe(time.perf_counter() - start)
+        self.consumed.mark()
+        self.breaker.success()
+        self._handled(msg)
+
+    def _failed(self, msg, reason, error, raw_key, raw_value):
+        """Sets a message that failed aside as a dead letter, and pauses the topic if failures go on"""
+        dead_letter_queue().add(msg, reason, error, raw_key, raw_value)
+        self.error_log.warning(
+            reason, "Dead-lettered %s message of %s [%s] at offset %s: %s",
+            reason, msg.topic(), msg.partition(), msg.offset(), error,
+        )
+        self._handled(msg)
+        if self.breaker.failure():
+            self.circuit_opened.inc()
+            logger.warning(
+                "Pausing %s for %.0fs after %s failing messages in a row",
+                self.topic_name_pattern, self.breaker.current_cooldown, self.breaker.failures,
+            )
+            self.consumer.pause(self.consumer.assignment())
+
+    def _handled(self, msg):
+        """Marks the message as handled, committing once a batch is complete or the interval is over"""
+        self.positions[msg.partition()] = self.uncommitted[msg.partition()] = msg.offset() + 1
+        self.num_uncommitted += 1
+        if (
+            self.num_uncommitted >= config.CONSUMER_COMMIT_BATCH
+            or time.monotonic() - self.last_commit >= config.CONSUMER_COMMIT_INTERVAL_SECS
+        ):
+            self.commit()
+
+    def _decode(self, msg):
+        """Decodes the Avro key and value of the message in place"""
+        if msg.value() is not None:
+            msg.set_value(self.serializer.decode_message(msg.value(), is_key=False))
+        if msg.key() is not None:
+            msg.set_key(self.serializer.decode_message(msg.key(), is_key=True))
 
     def close(self):
         """Cleans up any open kafka consumers"""
+        self.commit_all(config.DEAD_LETTER_FLUSH_TIMEOUT_SECS)
         self.consumer.unassign()
         self.consumer.unsubscribe()
         self.consumer.close()
+
+
+def read_to_end(topic_name, message_handler, timeout=30.0, batch_size=500):
+    """Reads all partitions of a (JSON) topic from the beginning up to their current high watermarks
+
+    Meant for loading compacted topics completely before serving. Returns the offsets per
+    partition to continue from with a regular `KafkaConsumer`: the high watermark of every
+    partition read to its end and, if the timeout hits first, the offset after the last message
+    handled (or the start) of the others, so that the regular consumer reads the rest.
+    """
+    consumer = Consumer({
+        'bootstrap.servers': config.BROKER_URL,
+        'group.id': 'consumer-bootstrap-' + socket.gethostname(),
+        'enable.auto.commit': False,
+        'enable.partition.eof': True,
+    })
+    deadline = time.monotonic() + timeout
+    try:
+        metadata = consumer.list_topics(topic_name, timeout=timeout)
+        end_offsets = {}
+        # partition -> offset after the last handled message
+        next_offsets = {}
+        assignment = []
+        for partition in metadata.topics[topic_name].partitions:
+            tp = TopicPartition(topic_name, partition)
+            low, high = consumer.get_watermark_offsets(tp, timeout=timeout)
+            end_offsets[partition] = next_offsets[partition] = high
+            if high > low:
+                next_offsets[partition] = low
+                tp.offset = low
+                assignment.append(tp)
+
+        pending = {tp.partition for tp in assignment}
+        num_messages = 0
+        if assignment:
+            consumer.assign(assignment)
+        while pending and time.monotonic() < deadline:
+            for msg in consumer.consume(num_messages=batch_size, timeout=0.5):
+                if msg.error() is not None:
+                    if msg.error().code() == KafkaError._PARTITION_EOF:
+                        pending.discard(msg.partition())
+                    else:
+                        logger.error(msg.error())
+                    continue
+                message_handler(msg)
+                num_messages += 1
+                next_offsets[msg.partition()] = msg.offset() + 1
+                if msg.offset() + 1 >= end_offsets[msg.partition()]:
+                    pending.discard(msg.partition())
+
+        offsets = {
+            partition: next_offsets[partition] if partition in pending else end_offsets[partition]
+            for partition in end_offsets
+        }
+        if pending:
+            logger.warning(
+                "Timed out after %.0fs reading %s to its end, continuing partitions %s from %s",
+                timeout, topic_name, sorted(pending), {p: offsets[p] for p in sorted(pending)},
+            )
+        logger.info("Read %s messages from %s up to offsets %s", num_messages, topic_name, offsets)
+        return offsets
+    finally:
+        consumer.close()
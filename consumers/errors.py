@@ -0,0 +1,233 @@
+"""Handling of bad messages: dead letters, rate-limited logging and per-topic circuit breakers
+
+A burst of bad records (e.g. after a schema change) must not turn into a log flood, nor stop the
+consumers. Failing messages are set aside to a dead-letter topic or file in batches, logged at
+most once per interval and kind, and a topic that fails continuously is paused for a while.
+"""
+import base64
+import functools
+import json
+import logging
+import time
+
+import config
+from metrics import registry
+from topic_admin import ensure_topic
+
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitedLogger:
+    """Logs at most one message per key and interval, and reports how many it suppressed"""
+
+    def __init__(self, logger, interval=10.0):
+        self.logger = logger
+        self.interval = interval
+        # key -> (time of the last logged message, number suppressed since)
+        self.state = {}
+
+    def log(self, level, key, msg, *args):
+        now = time.monotonic()
+        last, suppressed = self.state.get(key, (None, 0))
+        if last is not None and now - last < self.interval:
+            self.state[key] = (last, suppressed + 1)
+            return
+        if suppressed:
+            msg += " (%s similar messages suppressed)"
+            args += (suppressed,)
+        self.logger.log(level, msg, *args)
+        self.state[key] = (now, 0)
+
+    def warning(self, key, msg, *args):
+        self.log(logging.WARNING, key, msg, *args)
+
+    def error(self, key, msg, *args):
+        self.log(logging.ERROR, key, msg, *args)
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures, for a cooldown that doubles while they go on
+
+    After the cooldown the circuit is half-open: a success closes it, a single failure opens it
+    again.
+    """
+
+    def __init__(self, threshold, cooldown, max_cooldown=300.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.current_cooldown = cooldown
+        self.failures = 0
+        self.open_until = None
+
+    def success(self):
+        self.failures = 0
+        self.current_cooldown = self.cooldown
+
+    def failure(self):
+        """Records a failure, returns True if the circuit opens because of it"""
+        self.failures += 1
+        if self.open_until is not None or self.failures < self.threshold:
+            return False
+        self.open_until = time.monotonic() + self.current_cooldown
+        return True
+
+    def is_open(self):
+        return self.open_until is not None
+
+    def try_close(self):
+        """Half-opens the circuit once the cooldown is over, returns True if it did"""
+        if self.open_until is None or time.monotonic() < self.open_until:
+            return False
+        self.open_until = None
+        self.failures = self.threshold - 1
+        self.current_cooldown = min(self.current_cooldown * 2, self.max_cooldown)
+        return True
+
+
+def _to_bytes(payload):
+    if payload is None or isinstance(payload, bytes):
+        return payload
+    if isinstance(payload, str):
+        return payload.encode("utf-8")
+    return json.dumps(payload, default=str).encode("utf-8")
+
+
+class DeadLetterQueue:
+    """Collects failing messages and writes them in batches to a topic or a file of JSON lines
+
+    Records keep the original key and value bytes; the topic, partition, offset, reason and
+    error travel in the headers (topic) or alongside (file, base64-encoded payloads).
+
+    Dead letters are numbered as they are added. Writing to the topic never waits for the
+    broker: a record counts as written once its delivery report arrives, and records that fail
+    are queued again. `written_through` tells whether every dead letter up to a number has been
+    written, so that consumers only commit offsets past messages whose dead letters are safe.
+    """
+
+    def __init__(self, topic_name=config.TOPIC_NAME_DEAD_LETTER, path=None, batch_size=100):
+        self.topic_name = topic_name
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = []
+        # Number of the latest dead letter added
+        self.sequence = 0
+        # number -> record, produced but not yet acknowledged by the broker
+        self.in_flight = {}
+        self.producer = None
+        self.written = registry.counter("dead_letters.written")
+        self.errors = registry.counter("dead_letters.errors")
+        self.error_log = RateLimitedLogger(logger)
+
+    def add(self, msg, reason, error, raw_key=None, raw_value=None):
+        timestamp_type, timestamp = msg.timestamp()
+        self.sequence += 1
+        self.pending.append({
+            "sequence": self.sequence,
+            "topic": msg.topic(),
+            "partition": msg.partition(),
+            "offset": msg.offset(),
+            "timestamp": timestamp if timestamp_type != 0 else None,
+            "reason": reason,
+            "error": str(error)[:1000],
+            "key": _to_bytes(raw_key if raw_key is not None else msg.key()),
+            "value": _to_bytes(raw_value if raw_value is not None else msg.value()),
+        })
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def mark(self):
+        """Returns the number of the latest dead letter, for `written_through`"""
+        return self.sequence
+
+    def written_through(self, mark, timeout=0):
+        """Writes the pending dead letters, returns whether all of them up to `mark` are written"""
+        self.flush(timeout)
+        unwritten = [record["sequence"] for record in self.pending]
+        unwritten.extend(self.in_flight)
+        return not unwritten or min(unwritten) > mark
+
+    def flush(self, timeout=0):
+        """Writes the pending dead letters, waiting up to `timeout` seconds for their delivery
+
+        Returns whether every dead letter added so far has been written.
+        """
+        if self.pending:
+            batch, self.pending = self.pending, []
+            try:
+                if self.path is not None:
+                    self._write_file(batch)
+                    self.written.inc(len(batch))
+                else:
+                    self._write_topic(batch)
+            except Exception as e:
+                # Kept, in order, for the next attempt
+                self.pending = [record for record in batch if record["sequence"] not in self.in_flight] + self.pending
+                self.errors.inc()
+                self.error_log.error("write", "Unable to write %s dead letters: %s", len(self.pending), e)
+        if self.producer is not None and self.in_flight:
+            if timeout > 0:
+                self.producer.flush(timeout)
+            else:
+                self.producer.poll(0)
+        return not self.pending and not self.in_flight
+
+    def _write_file(self, batch):
+        with open(self.path, "a") as f:
+            for record in batch:
+                f.write(json.dumps(dict(
+                    record,
+                    key=base64.b64encode(record["key"]).decode("ascii") if record["key"] is not None else None,
+                    value=base64.b64encode(record["value"]).decode("ascii") if record["value"] is not None else None,
+                )) + "\n")
+
+    def prepare(self):
+        """Creates the dead-letter topic and its producer, unless dead letters go to a file"""
+        if self.path is not None or self.producer is not None:
+            return
+        from confluent_kafka import Producer as KafkaProducer
+
+        ensure_topic(self.topic_name)
+        self.producer = KafkaProducer({
+            "bootstrap.servers": config.BROKER_URL,
+            "client.id": "dead-letters",
+            "linger.ms": 100,
+        })
+
+    def _write_topic(self, batch):
+        self.prepare()
+        for record in batch:
+            headers = [
+                (f"dlq.{name}", str(record[name]).encode("utf-8"))
+                for name in ("topic", "partition", "offset", "timestamp", "reason", "error")
+            ]
+            self.producer.produce(
+                self.topic_name, record["value"], record["key"], headers=headers,
+                on_delivery=functools.partial(self._on_delivery, record),
+            )
+            self.in_flight[record["sequence"]] = record
+
+    def _on_delivery(self, record, err, msg):
+        self.in_flight.pop(record["sequence"], None)
+        if err is None:
+            self.written.inc()
+            return
+        self.errors.inc()
+        self.error_log.error("delivery", "Unable to deliver a dead letter of %s, retrying: %s", record["topic"], err)
+        self.pending.append(record)
+
+    def close(self, timeout=config.DEAD_LETTER_FLUSH_TIMEOUT_SECS):
+        if not self.flush(timeout):
+            logger.error("%s dead letters could not be written", len(self.pending) + len(self.in_flight))
+
+
+_dead_letter_queue = None
+
+
+def dead_letter_queue():
+    """Returns the dead-letter queue shared by all consumers of the process, created on first use"""
+    global _dead_letter_queue
+    if _dead_letter_queue is None:
+        _dead_letter_queue = DeadLetterQueue(path=config.DEAD_LETTER_FILE)
+    return _dead_letter_queue
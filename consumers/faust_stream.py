@@ -33,13 +33,24 @@ class TransformedStation(faust.Record):
 
 # Define a Faust Stream that ingests data from the Kafka Connect stations topic and
 #   places it into a new topic with only the necessary information.
-app = faust.App("stations-stream", broker="kafka://localhost:9092", store="memory://")
+#   Networks of other topic prefixes (see `config.Topics`) run an app of their own.
+app_id = "stations-stream"
+if config.TOPIC_PREFIX != config.DEFAULT_TOPIC_PREFIX:
+    app_id = f"stations-stream.{config.TOPIC_PREFIX}"
+app = faust.App(app_id, broker="kafka://localhost:9092", store="memory://")
 
 # Define the input Kafka Topic = output topic of Kafka Connect
 topic = app.topic(config.TOPIC_NAME_STATIONS, value_type=Station)
 
-# Define the output Kafka Topic
-out_topic = app.topic(config.TOPIC_NAME_TRANS_STATIONS, value_type=TransformedStation, partitions=1)
+# Define the output Kafka Topic: a compacted table changelog keyed by station_id, so that
+# consumers can load the complete catalogue by reading it to the end
+out_topic = app.topic(
+    config.TOPIC_NAME_TRANS_STATIONS,
+    key_type=int,
+    value_type=TransformedStation,
+    partitions=1,
+    compacting=True,
+)
 
 # Define a Faust Table
 table = app.Table(
@@ -10,10 +10,15 @@ from consumers.topic_check import Checker
 logger = logging.getLogger(__name__)
 
 
+# The raw turnstile table of networks of other topic prefixes (see `config.Topics`) is named after the prefix
+TURNSTILE_TABLE = "turnstile"
+if config.TOPIC_PREFIX != config.DEFAULT_TOPIC_PREFIX:
+    TURNSTILE_TABLE = "turnstile_" + config.TOPIC_PREFIX.replace(".", "_").replace("-", "_")
+
 # First statement creates a `turnstile` table from the turnstile topic, using 'avro' datatype!
 # Second statement creates a `turnstile_summary` table by selecting from the turnstile table and grouping on station_id.
 KSQL_STATEMENT = f"""
-CREATE TABLE turnstile (
+CREATE TABLE {TURNSTILE_TABLE} (
     station_id INTEGER,
     station_name VARCHAR,
     line INTEGER
@@ -28,7 +33,7 @@ WITH (
     KAFKA_TOPIC='{config.TOPIC_NAME_TURNSTILE_SUMMARY}',
     VALUE_FORMAT='JSON'
 ) AS
-    SELECT station_id, count(*) as count FROM turnstile GROUP BY station_id;
+    SELECT station_id, count(*) as count FROM {TURNSTILE_TABLE} GROUP BY station_id;
 """
 
 
@@ -0,0 +1,160 @@
+"""Load generator for the dashboard HTTP path, without any external service
+
+Serves the dashboard from models fed by a recorded event log (see `producers.replay`) instead
+of Kafka, on a free local port, and drives concurrent HTTP clients against it while the log is
+ingested at a target rate on the same IOLoop, as the consumers would. Reports throughput and
+p50/p99 latency per path, and the ingest rate and lag behind the target rate (also served as
+`loadgen.*` metrics on `/metrics`):
+
+    python -m consumers.loadgen events.log --clients 50 --duration 30 --rate 2000
+"""
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import time
+
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+import tornado.ioloop
+from tornado.testing import bind_unused_port
+
+from consumers.server import make_app
+from metrics import registry
+from producers.event_log import EventLogReader
+from producers.replay import DirectReplayer
+
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of sorted values, None if there are none"""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+class LoadGenerator:
+    """Ingests an event log into a local server while concurrent clients query it"""
+
+    def __init__(self, event_log, paths, num_clients=10, duration=30.0, rate=1000, chunk_size=100):
+        self.reader = EventLogReader(event_log)
+        self.replayer = DirectReplayer(self.reader)
+        self.paths = paths
+        self.num_clients = num_clients
+        self.duration = duration
+        self.rate = rate
+        self.chunk_size = chunk_size
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.done = False
+        self.ingested = registry.meter("loadgen.ingested")
+        self.ingest_lag = registry.gauge("loadgen.ingest_lag_secs")
+        self.max_ingest_lag = 0.0
+        self.num_ingested = 0
+
+    async def _ingest(self):
+        """Applies the log to the models at the target rate, yielding to the clients between chunks"""
+        start = time.monotonic()
+        for topic, timestamp_ms, value in self.reader.events():
+            if self.done:
+                break
+            self.replayer.handle(topic, timestamp_ms, value)
+            self.num_ingested += 1
+            if self.num_ingested % self.chunk_size:
+                continue
+            self.ingested.mark(self.chunk_size)
+            delay = start + self.num_ingested / self.rate - time.monotonic() if self.rate else 0.0
+            self.ingest_lag.set(max(-delay, 0.0))
+            self.max_ingest_lag = max(self.max_ingest_lag, -delay)
+            await gen.sleep(max(delay, 0.0))
+        logger.info("Ingest stopped after %s events", self.num_ingested)
+
+    async def _client(self, client, base_url, index, deadline):
+        num_requests = index
+        while time.monotonic() < deadline:
+            path = self.paths[num_requests % len(self.paths)]
+            num_requests += 1
+            start = time.perf_counter()
+            try:
+                await client.fetch(base_url + path, request_timeout=60)
+            except Exception as e:
+                self.errors[path] += 1
+                logger.debug("Request to %s failed: %s", path, e)
+                continue
+            self.latencies[path].append(time.perf_counter() - start)
+
+    async def run(self):
+        """Runs the load test, returns the report"""
+        self.replayer.load_stations()
+        application = make_app("all", self.replayer.weather, self.replayer.lines, self.replayer.turnstiles)
+        sock, port = bind_unused_port()
+        server = HTTPServer(application)
+        server.add_sockets([sock])
+        base_url = f"http://127.0.0.1:{port}"
+        logger.info("Serving on %s, %s clients for %.0fs", base_url, self.num_clients, self.duration)
+
+        AsyncHTTPClient.configure(None, max_clients=self.num_clients)
+        client = AsyncHTTPClient()
+        ingest = asyncio.ensure_future(self._ingest())
+        started = time.monotonic()
+        await gen.multi([
+            self._client(client, base_url, i, started + self.duration) for i in range(self.num_clients)
+        ])
+        elapsed = time.monotonic() - started
+        self.done = True
+        await ingest
+
+        # Read back what the server itself reports
+        metrics = json.loads((await client.fetch(base_url + "/metrics")).body)
+        server.stop()
+        self.reader.close()
+        return self._report(elapsed, metrics)
+
+    def _report(self, elapsed, metrics):
+        paths = {}
+        for path in self.paths:
+            latencies = sorted(self.latencies[path])
+            paths[path] = {
+                "requests": len(latencies),
+                "errors": self.errors[path],
+                "requests_per_sec": round(len(latencies) / elapsed, 1),
+                "p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+                "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+            }
+        return {
+            "clients": self.num_clients,
+            "duration_secs": round(elapsed, 2),
+            "requests_per_sec": round(sum(len(v) for v in self.latencies.values()) / elapsed, 1),
+            "paths": paths,
+            "ingest": {
+                "target_rate": self.rate,
+                "events": self.num_ingested,
+                "events_per_sec": round(self.num_ingested / elapsed, 1),
+                "lag_secs": metrics["metrics"].get("loadgen.ingest_lag_secs"),
+                "max_lag_secs": round(self.max_ingest_lag, 3),
+            },
+        }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load-tests the dashboard while it ingests an event log")
+    parser.add_argument("event_log", help="event log recorded with `producers.simulation --record`")
+    parser.add_argument("--clients", type=int, default=10, help="concurrent HTTP clients (default: 10)")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load (default: 30)")
+    parser.add_argument("--rate", type=float, default=1000,
+                        help="target events ingested per second (default: 1000, 0 = unthrottled)")
+    parser.add_argument("--paths", nargs="+",
+                        default=["/", "/api/eta", "/api/turnstiles?window=1h", "/api/stations/40380/history"],
+                        help="paths requested in turn by every client")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    generator = LoadGenerator(args.event_log, args.paths, args.clients, args.duration, args.rate)
+    report = tornado.ioloop.IOLoop.current().run_sync(generator.run)
+    print(json.dumps(report, indent=2))
@@ -1,4 +1,6 @@
 from .station import Station
 from .line import Line
+from .headways import ArrivalAnalytics
 from .lines import Lines
 from .weather import Weather
+from .turnstiles import TurnstileIndex
@@ -0,0 +1,226 @@
+"""Incremental travel-time, headway and ETA statistics derived from the arrival stream"""
+import bisect
+import logging
+import sys
+
+
+logger = logging.getLogger(__name__)
+
+
+class P2Quantile:
+    """Streaming quantile estimate in constant memory (the P-square algorithm of Jain & Chlamtac)"""
+
+    __slots__ = ("p", "heights", "positions", "desired", "increments")
+
+    def __init__(self, p):
+        self.p = p
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        q = self.heights
+        if len(q) < 5:
+            bisect.insort(q, x)
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = bisect.bisect_right(q, x) - 1
+
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers towards their desired positions
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def value(self):
+        q = self.heights
+        if not q:
+            return None
+        if len(q) < 5:
+            return q[int(round(self.p * (len(q) - 1)))]
+        return q[2]
+
+
+class StreamingStats:
+    """Count, mean, standard deviation, min/max and median/p90 estimates, updated in O(1)"""
+
+    __slots__ = ("count", "mean", "m2", "min", "max", "median", "p90")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.median = P2Quantile(0.5)
+        self.p90 = P2Quantile(0.9)
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+        self.median.add(x)
+        self.p90.add(x)
+
+    def stddev(self):
+        return (self.m2 / (self.count - 1)) ** 0.5 if self.count > 1 else 0.0
+
+    def to_dict(self, scale=1.0):
+        """Returns the statistics as a dict, with all values multiplied by `scale`"""
+        if self.count == 0:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": round(self.mean * scale, 3),
+            "stddev": round(self.stddev() * scale, 3),
+            "min": round(self.min * scale, 3),
+            "max": round(self.max * scale, 3),
+            "median": round(self.median.value() * scale, 3),
+            "p90": round(self.p90.value() * scale, 3),
+        }
+
+
+class ArrivalAnalytics:
+    """Per-segment travel times, per-station headways and next-arrival ETAs
+
+    Stations are identified by (line, station_id, direction) nodes; the topology of each line is
+    learnt from the `prev_station_id`/`prev_direction` fields of the arrivals. Every arrival costs
+    a fixed number of dict lookups and two stats updates; ETAs are only computed when queried.
+    """
+
+    # Upper bound on the stations an ETA is projected ahead of a train
+    max_hops = 30
+
+    def __init__(self):
+        # (prev node, node) -> StreamingStats of travel times in ms
+        self.segments = {}
+        # node -> StreamingStats of headways in ms
+        self.headways = {}
+        # node -> event time of its latest arrival
+        self.last_arrival = {}
+        # node -> next node, as observed
+        self.next_node = {}
+        # Canonical instance of every node, so that the per-train state shares them
+        self.nodes = {}
+        # train_id -> (node, event time, train status)
+        self.trains = {}
+        # Latest event time seen, the reference point of relative ETAs
+        self.clock = None
+
+    def _node(self, line, station_id, direction):
+        node = (line, station_id, direction)
+        canonical = self.nodes.get(node)
+        if canonical is None:
+            canonical = self.nodes[node] = (sys.intern(line), station_id, sys.intern(direction))
+        return canonical
+
+    def handle_arrival(self, value, timestamp_ms):
+        """Updates all statistics with a single arrival event"""
+        node = self._node(value["line"], value["station_id"], value["direction"])
+        train_id = sys.intern(value["train_id"])
+        if self.clock is None or timestamp_ms > self.clock:
+            self.clock = timestamp_ms
+
+        prev_node = None
+        if value.get("prev_station_id") is not None and value.get("prev_direction") is not None:
+            prev_node = self._node(value["line"], value["prev_station_id"], value["prev_direction"])
+            self.next_node[prev_node] = node
+
+        # Travel time, if this train's previous arrival was at the previous station
+        previous = self.trains.get(train_id)
+        if previous is not None and prev_node is not None and previous[0] == prev_node:
+            travel_time = timestamp_ms - previous[1]
+            if travel_time >= 0:
+                segment = self.segments.get((prev_node, node))
+                if segment is None:
+                    segment = self.segments[(prev_node, node)] = StreamingStats()
+                segment.add(travel_time)
+        self.trains[train_id] = (node, timestamp_ms, value.get("train_status"))
+
+        last = self.last_arrival.get(node)
+        if last is not None and timestamp_ms >= last:
+            headway = self.headways.get(node)
+            if headway is None:
+                headway = self.headways[node] = StreamingStats()
+            headway.add(timestamp_ms - last)
+        self.last_arrival[node] = timestamp_ms
+
+    def _projected_etas(self):
+        """Projects every train down the line, returns node -> (eta in ms, train_id)"""
+        etas = {}
+        for train_id, (node, timestamp_ms, _) in self.trains.items():
+            eta = timestamp_ms
+            for _ in range(ArrivalAnalytics.max_hops):
+                next_node = self.next_node.get(node)
+                segment = self.segments.get((node, next_node))
+                if next_node is None or segment is None:
+                    break
+                eta += segment.mean
+                best = etas.get(next_node)
+                if best is None or eta < best[0]:
+                    etas[next_node] = (eta, train_id)
+                node = next_node
+        return etas
+
+    def _node_eta(self, node, projected):
+        """ETA of a node, from projected trains or else from its last arrival plus mean headway"""
+        entry = {"line": node[0], "station_id": node[1], "direction": node[2]}
+        if node in projected:
+            eta, train_id = projected[node]
+            entry.update(eta_ms=int(eta), train_id=train_id, source="train")
+        elif node in self.last_arrival and node in self.headways:
+            entry.update(eta_ms=int(self.last_arrival[node] + self.headways[node].mean), source="headway")
+        else:
+            return None
+        entry["eta_secs"] = round((entry["eta_ms"] - self.clock) / 1000, 1)
+        headway = self.headways.get(node)
+        entry["headway_secs"] = headway.to_dict(scale=0.001) if headway is not None else None
+        return entry
+
+    def etas(self, station_id=None):
+        """Returns the next-arrival ETAs of all stations (or of one station), both directions"""
+        projected = self._projected_etas()
+        nodes = set(self.last_arrival) | set(projected)
+        if station_id is not None:
+            nodes = {node for node in nodes if node[1] == station_id}
+        return {
+            "clock_ms": self.clock,
+            "etas": [
+                entry for entry in (self._node_eta(node, projected) for node in sorted(nodes))
+                if entry is not None
+            ],
+        }
+
+    def segment_stats(self):
+        """Returns the travel-time statistics of all observed segments, in seconds"""
+        return [
+            {"from": list(prev_node), "to": list(node), "travel_secs": stats.to_dict(scale=0.001)}
+            for (prev_node, node), stats in sorted(self.segments.items())
+        ]
@@ -3,18 +3,23 @@ import json
 import logging
 
 import config
+from consumers.errors import RateLimitedLogger
 from consumers.models import Station
+from consumers.models.timeseries import message_time_ms
+from metrics import registry
 
 
 logger = logging.getLogger(__name__)
+error_log = RateLimitedLogger(logger)
 
 
 class Line:
     """Defines the Line Model"""
 
-    def __init__(self, color):
-        """Creates a line"""
+    def __init__(self, color, topics=None):
+        """Creates a line, for the `topics` of a network (default: `config.DEFAULT_TOPICS`)"""
         self.color = color
+        self.topics = topics if topics is not None else config.DEFAULT_TOPICS
         self.color_code = "0xFFFFFF"
         if self.color == "blue":
             self.color_code = "#1E90FF"
@@ -28,7 +33,12 @@ class Line:
         """Adds the station to this Line's data model"""
         if value["line"] != self.color:
             return
-        self.stations[value["station_id"]] = Station.from_message(value)
+        station = self.stations.get(value["station_id"])
+        if station is None:
+            self.stations[value["station_id"]] = Station.from_message(value)
+        else:
+            # Re-reading the catalogue (e.g. over a restored snapshot) keeps the station's state
+            station.update(value)
         logger.debug('Line: %s, stations found: %s', self.color, len(self.stations))
 
     def _handle_arrival(self, message):
@@ -51,26 +61,27 @@ class Line:
             logger.debug("Unable to handle current station due to missing station")
             return
         station.handle_arrival(
-            value.get("direction"), value.get("train_id"), value.get("train_status")
+            value.get("direction"), value.get("train_id"), value.get("train_status"), message_time_ms(message)
         )
 
     def process_message(self, message):
         """Given a kafka message, extract data based on its topic"""
-        if message.topic() == config.TOPIC_NAME_TRANS_STATIONS:
+        if message.topic() == self.topics.trans_stations:
             try:
                 value = json.loads(message.value())
                 self._handle_station(value)  # only here is a new station appended
             except Exception as e:
-                logger.fatal("Bad station? %s, %s", value, e)
-        elif message.topic() == config.TOPIC_NAME_ARRIVAL:
+                registry.counter("lines.bad_stations").inc()
+                error_log.warning("station", "Skipping bad station %s: %s", message.value(), e)
+        elif message.topic() == self.topics.arrival:
             self._handle_arrival(message)
-        elif message.topic() == config.TOPIC_NAME_TURNSTILE_SUMMARY:
+        elif message.topic() == self.topics.turnstile_summary:
             json_data = json.loads(message.value())
             station_id = json_data.get("STATION_ID")
             station = self.stations.get(station_id)
             if station is None:
                 logger.debug("Unable to handle message due to missing station (turnstile summary)")
                 return
-            station.process_message(json_data)
+            station.process_message(json_data, message_time_ms(message))
         else:
             logger.info("Unable to find handler for message from topic %s", message.topic())
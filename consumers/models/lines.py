@@ -3,7 +3,8 @@ import json
 import logging
 
 import config
-from consumers.models import Line
+from consumers.models import ArrivalAnalytics, Line
+from consumers.models.timeseries import message_time_ms
 
 
 logger = logging.getLogger(__name__)
@@ -12,18 +13,23 @@ logger = logging.getLogger(__name__)
 class Lines:
     """Contains all train lines"""
 
-    def __init__(self):
-        """Creates the Lines object"""
-        self.red_line = Line("red")
-        self.green_line = Line("green")
-        self.blue_line = Line("blue")
+    def __init__(self, topics=None):
+        """Creates the Lines object, for the `topics` of a network (default: `config.DEFAULT_TOPICS`)"""
+        self.topics = topics if topics is not None else config.DEFAULT_TOPICS
+        self.red_line = Line("red", self.topics)
+        self.green_line = Line("green", self.topics)
+        self.blue_line = Line("blue", self.topics)
+        self.arrivals = ArrivalAnalytics()
 
     def process_message(self, message):
         """Processes a station message"""
-        if message.topic() == config.TOPIC_NAME_TRANS_STATIONS or message.topic() == config.TOPIC_NAME_ARRIVAL:
+        topics = self.topics
+        if message.topic() == topics.trans_stations or message.topic() == topics.arrival:
             value = message.value()
-            if message.topic() == config.TOPIC_NAME_TRANS_STATIONS:
+            if message.topic() == topics.trans_stations:
                 value = json.loads(value)
+            else:
+                self.arrivals.handle_arrival(value, message_time_ms(message))
             if value["line"] == "green":
                 self.green_line.process_message(message)
             elif value["line"] == "red":
@@ -32,9 +38,17 @@ class Lines:
                 self.blue_line.process_message(message)
             else:
                 logger.debug("Discarding unknown line %s, msg %s", value["line"], value)
-        elif message.topic() == config.TOPIC_NAME_TURNSTILE_SUMMARY:
+        elif message.topic() == topics.turnstile_summary:
             self.green_line.process_message(message)
             self.red_line.process_message(message)
             self.blue_line.process_message(message)
         else:
             logger.info("Ignoring non-lines message %s", message.topic())
+
+    def get_station(self, station_id):
+        """Returns the station with the given id on any line, or None"""
+        for line in (self.red_line, self.green_line, self.blue_line):
+            station = line.stations.get(station_id)
+            if station is not None:
+                return station
+        return None
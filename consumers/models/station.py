@@ -1,43 +1,113 @@
 """Contains functionality related to Stations"""
 import json
 import logging
+import sys
+
+from consumers.models.timeseries import MultiResolutionSeries, RingBuffer
 
 
 logger = logging.getLogger(__name__)
 
 
+# Display labels of the train statuses, so that no string is built per arrival
+STATUS_LABELS = {
+    status: sys.intern(status.replace("_", " "))
+    for status in ("out_of_service", "in_service", "broken_down")
+}
+
+
 class Station:
-    """Defines the Station Model"""
+    """Defines the Station Model
+
+    All per-station state is allocated up front; handling a message only rebinds slots to the
+    (interned) decoded values and updates the preallocated series.
+    """
+
+    __slots__ = (
+        "station_id",
+        "station_name",
+        "order",
+        "dir_a_train",
+        "dir_a_status",
+        "dir_b_train",
+        "dir_b_status",
+        "num_turnstile_entries",
+        "turnstile_series",
+        "arrivals_a",
+        "arrivals_b",
+    )
+
+    # Number of arrival timestamps kept per direction
+    arrival_history = 64
 
     def __init__(self, station_id, station_name, order):
         """Creates a Station Model"""
         self.station_id = station_id
-        self.station_name = station_name
+        self.station_name = sys.intern(station_name)
         self.order = order
-        self.dir_a = None
-        self.dir_b = None
+        # Train id and status label of the train currently at the station, per direction
+        self.dir_a_train = None
+        self.dir_a_status = None
+        self.dir_b_train = None
+        self.dir_b_status = None
         self.num_turnstile_entries = 0
+        # Bounded history: turnstile entries per interval and recent arrival times per direction
+        self.turnstile_series = MultiResolutionSeries()
+        self.arrivals_a = RingBuffer(Station.arrival_history)
+        self.arrivals_b = RingBuffer(Station.arrival_history)
 
     @classmethod
     def from_message(cls, value):
         """Given a Kafka Station message, creates and returns a station"""
         return Station(value["station_id"], value["station_name"], value["order"])
 
+    def update(self, value):
+        """Updates the station's name and order from a Kafka Station message"""
+        self.station_name = sys.intern(value["station_name"])
+        self.order = value["order"]
+
     def handle_departure(self, direction):
         """Removes a train from the station"""
         if direction == "a":
-            self.dir_a = None
+            self.dir_a_train = None
+            self.dir_a_status = None
         else:
-            self.dir_b = None
+            self.dir_b_train = None
+            self.dir_b_status = None
 
-    def handle_arrival(self, direction, train_id, train_status):
+    def handle_arrival(self, direction, train_id, train_status, timestamp_ms=None):
         """Unpacks arrival data"""
-        status_dict = {"train_id": train_id, "status": train_status.replace("_", " ")}
+        train_id = sys.intern(train_id)
+        status = STATUS_LABELS.get(train_status)
+        if status is None:
+            status = train_status.replace("_", " ")
         if direction == "a":
-            self.dir_a = status_dict
+            self.dir_a_train = train_id
+            self.dir_a_status = status
+            if timestamp_ms is not None:
+                self.arrivals_a.append(timestamp_ms)
         else:
-            self.dir_b = status_dict
+            self.dir_b_train = train_id
+            self.dir_b_status = status
+            if timestamp_ms is not None:
+                self.arrivals_b.append(timestamp_ms)
 
-    def process_message(self, json_data):
+    def process_message(self, json_data, timestamp_ms=None):
         """Handles arrival and turnstile messages"""
-        self.num_turnstile_entries = json_data["COUNT"]
+        count = json_data["COUNT"]
+        # The summary holds running totals, the series record the increments
+        if timestamp_ms is not None and count > self.num_turnstile_entries:
+            self.turnstile_series.add(timestamp_ms, count - self.num_turnstile_entries)
+        self.num_turnstile_entries = count
+
+    def history(self, resolution="10m", num_points=None):
+        """Returns the station's sparkline data and trends as a JSON-serializable dict"""
+        return {
+            "station_id": self.station_id,
+            "station_name": self.station_name,
+            "num_turnstile_entries": self.num_turnstile_entries,
+            "turnstile_entries": self.turnstile_series.points(resolution, num_points),
+            "resolution": resolution,
+            "trend": self.turnstile_series.trend(),
+            "arrivals": {"a": self.arrivals_a.to_list(), "b": self.arrivals_b.to_list()},
+        }
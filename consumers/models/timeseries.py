@@ -0,0 +1,114 @@
+"""Fixed-size, array-backed time series kept per station"""
+from array import array
+import time
+
+
+def message_time_ms(message):
+    """Returns the event time of a message: its key timestamp if it has one, else its record timestamp"""
+    key = message.key()
+    if isinstance(key, dict) and key.get("timestamp") is not None:
+        return key["timestamp"]
+    timestamp_type, timestamp = message.timestamp()
+    # 0 is TIMESTAMP_NOT_AVAILABLE
+    if timestamp_type != 0 and timestamp >= 0:
+        return timestamp
+    return int(time.time() * 1000)
+
+
+class RingBuffer:
+    """Keeps the last `capacity` values"""
+
+    __slots__ = ("values", "capacity", "count")
+
+    def __init__(self, capacity, typecode="q"):
+        self.values = array(typecode, bytes(array(typecode).itemsize * capacity))
+        self.capacity = capacity
+        self.count = 0
+
+    def append(self, value):
+        self.values[self.count % self.capacity] = value
+        self.count += 1
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def to_list(self):
+        """Returns the values from oldest to newest"""
+        if self.count <= self.capacity:
+            return self.values[:self.count].tolist()
+        head = self.count % self.capacity
+        return self.values[head:].tolist() + self.values[:head].tolist()
+
+
+class BucketSeries:
+    """Sums values into fixed-width time buckets, keeping the last `capacity` buckets"""
+
+    __slots__ = ("width_ms", "capacity", "counts", "head")
+
+    def __init__(self, width_ms, capacity, typecode="I"):
+        self.width_ms = width_ms
+        self.capacity = capacity
+        self.counts = array(typecode, bytes(array(typecode).itemsize * capacity))
+        # Absolute number of the newest bucket (timestamp // width), -1 while empty
+        self.head = -1
+
+    def add(self, timestamp_ms, value):
+        bucket = timestamp_ms // self.width_ms
+        if bucket > self.head:
+            # Clear the buckets that are skipped over and now hold expired data
+            for expired in range(max(self.head + 1, bucket - self.capacity + 1), bucket + 1):
+                self.counts[expired % self.capacity] = 0
+            self.head = bucket
+        elif bucket <= self.head - self.capacity:
+            return
+        self.counts[bucket % self.capacity] += value
+
+    def points(self, num_points=None, until_ms=None):
+        """Returns [bucket start, value] pairs from oldest to newest, ending at `until_ms` (default: newest)"""
+        if self.head < 0:
+            return []
+        last = self.head if until_ms is None else until_ms // self.width_ms
+        num_points = self.capacity if num_points is None else min(num_points, self.capacity)
+        points = []
+        for bucket in range(last - num_points + 1, last + 1):
+            retained = self.head - self.capacity < bucket <= self.head
+            points.append([bucket * self.width_ms, self.counts[bucket % self.capacity] if retained else 0])
+        return points
+
+
+class MultiResolutionSeries:
+    """The same series at several resolutions, all updated on every add"""
+
+    __slots__ = ("levels",)
+
+    # name -> (bucket width in ms, number of buckets)
+    resolutions = {
+        "1m": (60 * 1000, 120),
+        "10m": (10 * 60 * 1000, 144),
+        "1h": (60 * 60 * 1000, 168),
+    }
+    level_index = {name: i for i, name in enumerate(resolutions)}
+
+    def __init__(self):
+        self.levels = tuple(
+            BucketSeries(width_ms, capacity)
+            for width_ms, capacity in MultiResolutionSeries.resolutions.values()
+        )
+
+    def add(self, timestamp_ms, value):
+        for series in self.levels:
+            series.add(timestamp_ms, value)
+
+    def points(self, resolution, num_points=None):
+        return self.levels[MultiResolutionSeries.level_index[resolution]].points(num_points)
+
+    def trend(self, resolution="10m", window=6):
+        """Compares the sum of the last `window` buckets with the `window` before, None if undefined"""
+        points = self.levels[MultiResolutionSeries.level_index[resolution]].points(2 * window)
+        if len(points) < 2 * window:
+            return None
+        previous = sum(count for _, count in points[:window])
+        current = sum(count for _, count in points[window:])
+        if previous == 0:
+            return None
+        return round((current - previous) / previous, 3)
@@ -0,0 +1,134 @@
+"""Windowed turnstile entry counts per station and line, from the raw turnstile events"""
+import collections
+import heapq
+import logging
+from operator import itemgetter
+
+from consumers.models.timeseries import message_time_ms
+
+
+logger = logging.getLogger(__name__)
+
+
+# Turnstile events carry the line as its number (the producers' `Line.colors`)
+LINE_NAMES = ("blue", "green", "red")
+
+
+class TurnstileIndex:
+    """Entries per station in time buckets, with running sums over sliding windows
+
+    Buckets are kept for the longest window only and the window sums are updated as entries
+    come in and as buckets slide out of each window, so every query reads precomputed totals.
+    Windows end at the newest event time seen, so replays and simulations are indexed in their
+    own time.
+    """
+
+    bucket_ms = 5 * 60 * 1000
+    # name -> length in buckets
+    windows = {"1h": 12, "1d": 288}
+
+    def __init__(self):
+        self.num_buckets = max(TurnstileIndex.windows.values())
+        # (bucket number, {station_id: entries}), oldest first
+        self.buckets = collections.deque()
+        self.head = -1
+        # window -> {station_id: entries}, window -> {line: entries}
+        self.station_totals = {window: collections.Counter() for window in TurnstileIndex.windows}
+        self.line_totals = {window: collections.Counter() for window in TurnstileIndex.windows}
+        self.station_lines = {}
+        self.station_names = {}
+        self.num_late = 0
+
+    def process_message(self, message):
+        """Counts one raw turnstile event"""
+        value = message.value()
+        timestamp_ms = message_time_ms(message)
+        station_id = value["station_id"]
+        if station_id not in self.station_lines:
+            line = value["line"]
+            self.station_lines[station_id] = LINE_NAMES[line] if 0 <= line < len(LINE_NAMES) else str(line)
+            self.station_names[station_id] = value["station_name"]
+        self.add(station_id, timestamp_ms)
+
+    def add(self, station_id, timestamp_ms, entries=1):
+        bucket = timestamp_ms // TurnstileIndex.bucket_ms
+        if bucket > self.head:
+            self._advance(bucket)
+        elif bucket <= self.head - self.num_buckets:
+            self.num_late += 1
+            return
+
+        counts = self._bucket(bucket)
+        counts[station_id] = counts.get(station_id, 0) + entries
+        line = self.station_lines.get(station_id)
+        for window, length in TurnstileIndex.windows.items():
+            if bucket > self.head - length:
+                self.station_totals[window][station_id] += entries
+                if line is not None:
+                    self.line_totals[window][line] += entries
+
+    def _bucket(self, bucket):
+        """The counts of a retained bucket, created as needed"""
+        buckets = self.buckets
+        if buckets and buckets[-1][0] == bucket:
+            return buckets[-1][1]
+        for number, counts in buckets:
+            if number == bucket:
+                return counts
+        counts = {}
+        # Late buckets are rare: keep the deque sorted by inserting in place
+        index = len(buckets)
+        while index > 0 and buckets[index - 1][0] > bucket:
+            index -= 1
+        buckets.insert(index, (bucket, counts))
+        return counts
+
+    def _advance(self, bucket):
+        """Moves the newest bucket forward, subtracts the buckets leaving each window"""
+        for window, length in TurnstileIndex.windows.items():
+            station_totals = self.station_totals[window]
+            line_totals = self.line_totals[window]
+            for number, counts in self.buckets:
+                if number > bucket - length:
+                    break
+                if number <= self.head - length:
+                    continue
+                for station_id, entries in counts.items():
+                    station_totals[station_id] -= entries
+                    if not station_totals[station_id]:
+                        del station_totals[station_id]
+                    line = self.station_lines.get(station_id)
+                    if line is not None:
+                        line_totals[line] -= entries
+        self.head = bucket
+        # Expire the buckets outside of the longest window
+        while self.buckets and self.buckets[0][0] <= bucket - self.num_buckets:
+            self.buckets.popleft()
+
+    def entries(self, window, station_id=None, line=None):
+        """Entries within the window, of a station, of a line, or of the whole network"""
+        if station_id is not None:
+            return self.station_totals[window].get(station_id, 0)
+        if line is not None:
+            return self.line_totals[window].get(line, 0)
+        return sum(self.line_totals[window].values())
+
+    def top(self, window, num_stations=10, line=None):
+        """The busiest stations within the window, as [station_id, name, line, entries]"""
+        totals = self.station_totals[window].items()
+        if line is not None:
+            totals = [item for item in totals if self.station_lines.get(item[0]) == line]
+        return [
+            [station_id, self.station_names.get(station_id), self.station_lines.get(station_id), entries]
+            for station_id, entries in heapq.nlargest(num_stations, totals, key=itemgetter(1))
+        ]
+
+    def summary(self, window, num_stations=10, line=None):
+        """JSON-ready answer of the turnstile endpoint"""
+        return {
+            "window": window,
+            "until": (self.head + 1) * TurnstileIndex.bucket_ms if self.head >= 0 else None,
+            "entries": self.entries(window, line=line),
+            "lines": dict(self.line_totals[window]) if line is None else {line: self.entries(window, line=line)},
+            "top": self.top(window, num_stations, line),
+        }
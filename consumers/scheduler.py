@@ -0,0 +1,57 @@
+"""Adaptive poll scheduling for the dashboard consumers
+
+Every consumer fetches the messages available without blocking, then waits before its next
+fetch. The wait follows the observed message rate: long enough for batches to build up, never
+longer than the topic's latency target, and none at all while the consumer is behind (a full
+batch, or lag reported by the librdkafka statistics). Busy topics are therefore polled often and
+idle ones rarely, and a message arriving after an idle period waits at most the latency target.
+"""
+import time
+
+import config
+
+
+def priority_of(topic_name):
+    return config.CONSUMER_PRIORITIES.get(topic_name.rsplit(".", 1)[-1], 1)
+
+
+class PollScheduler:
+    """Chooses the delay before a consumer's next fetch"""
+
+    def __init__(self, latency_target, batch_size, min_delay=0.005, alpha=0.2):
+        self.latency_target = latency_target
+        self.batch_size = batch_size
+        self.min_delay = min(min_delay, latency_target)
+        self.alpha = alpha
+        # Messages per second (EWMA over fetches) and the latest known lag, in messages
+        self.rate = 0.0
+        self.lag = 0
+        self.last = time.monotonic()
+
+    @classmethod
+    def for_topic(cls, topic_name, latency_target=None, batch_size=None):
+        """Scheduler with the topic's priority: a shorter latency target and larger batches"""
+        priority = priority_of(topic_name)
+        if latency_target is None:
+            latency_target = config.CONSUMER_LATENCY_TARGET_SECS / priority
+        if batch_size is None:
+            batch_size = config.CONSUMER_BATCH_SIZE * priority
+        return cls(latency_target, batch_size)
+
+    def set_lag(self, lag):
+        self.lag = lag
+
+    def next_delay(self, num_messages):
+        """Updates the rate with the messages of the last fetch, returns the seconds to wait"""
+        now = time.monotonic()
+        elapsed = max(now - self.last, 1e-6)
+        self.last = now
+        self.rate += self.alpha * (num_messages / elapsed - self.rate)
+        self.lag = max(self.lag - num_messages, 0)
+
+        if num_messages >= self.batch_size or self.lag > 0:
+            return 0.0
+        if self.rate * self.latency_target <= self.batch_size / 2:
+            return self.latency_target
+        # Wake up before the next batch fills up
+        return max(self.batch_size / (2 * self.rate), self.min_delay)
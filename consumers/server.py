@@ -1,7 +1,14 @@
 """Defines a Tornado Server that consumes Kafka Event data for display"""
+import argparse
 import logging
 import logging.config as logging_config
 from pathlib import Path
+import re
+import socket
+import time
+
+# Reference point of the startup measurements, taken before the heavier imports
+STARTED = time.monotonic()
 
 import tornado.ioloop
 import tornado.template
@@ -12,15 +19,49 @@ import tornado.web
 logging_config.fileConfig(f"{Path(__file__).parents[0]}/logging.ini")
 
 import config
-from consumers.consumer import KafkaConsumer
-from consumers.models import Lines, Weather
+from consumers.consumer import KafkaConsumer, read_to_end
+from consumers.errors import dead_letter_queue
+from consumers.models import Lines, TurnstileIndex, Weather
+from consumers.models.timeseries import MultiResolutionSeries
+from consumers.snapshot import Snapshotter, load_snapshot
+from consumers.state import StatePublisher, StateView
 from consumers.topic_check import Checker
+from metrics import registry
+from profiling import profiler_from_env
 
 
 logger = logging.getLogger(__name__)
 checker = Checker()
 
 
+# Functions whose cost is reported after a profiling window
+PROFILED_FUNCTIONS = (
+    ("consumers/consumer.py", "_process"),
+    ("consumers/models/lines.py", "process_message"),
+    ("consumers/models/line.py", "process_message"),
+    ("consumers/models/station.py", "process_message"),
+    ("consumers/models/headways.py", "handle_arrival"),
+    ("consumers/models/turnstiles.py", "process_message"),
+    ("consumers/models/weather.py", "process_message"),
+    ("confluent_kafka/avro/serializer/message_serializer.py", "decode_message"),
+    ("consumers/server.py", "get"),
+)
+
+
+def int_argument(handler, name, default=None, minimum=None):
+    """Returns an integer query argument, raising a 400 error if it is not one or below `minimum`"""
+    value = handler.get_argument(name, None)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise tornado.web.HTTPError(400, "%s must be an integer" % name)
+    if minimum is not None and value < minimum:
+        raise tornado.web.HTTPError(400, "%s must be at least %s" % (name, minimum))
+    return value
+
+
 class MainHandler(tornado.web.RequestHandler):
     """Defines a web request handler class"""
 
@@ -32,67 +73,357 @@ class MainHandler(tornado.web.RequestHandler):
         self.weather = weather
         self.lines = lines
 
+    render_latency = registry.histogram("server.render_latency")
+
     def get(self):
         """Responds to get requests"""
         logger.debug("Rendering and writing handler template")
-        self.write(MainHandler.template.generate(weather=self.weather, lines=self.lines))
+        start = time.perf_counter()
+        page = MainHandler.template.generate(weather=self.weather, lines=self.lines)
+        MainHandler.render_latency.observe(time.perf_counter() - start)
+        self.write(page)
+
+
+class StationHistoryHandler(tornado.web.RequestHandler):
+    """Serves a station's bounded history (turnstile sparkline, trend, recent arrivals) as JSON"""
+
+    def initialize(self, lines):
+        """Initializes the handler with required configuration"""
+        self.lines = lines
+
+    def get(self, station_id):
+        """Responds to get requests, optional arguments: `resolution` (1m, 10m, 1h) and `points`"""
+        station = self.lines.get_station(int(station_id))
+        if station is None:
+            raise tornado.web.HTTPError(404)
+        resolution = self.get_argument("resolution", "10m")
+        if resolution not in MultiResolutionSeries.resolutions:
+            raise tornado.web.HTTPError(400, "Unknown resolution %s" % resolution)
+        self.write(station.history(resolution, int_argument(self, "points", minimum=1)))
+
+
+class EtaHandler(tornado.web.RequestHandler):
+    """Serves next-arrival ETAs (all stations, or one) and segment travel times as JSON"""
+
+    def initialize(self, lines):
+        """Initializes the handler with required configuration"""
+        self.lines = lines
+
+    def get(self, station_id=None):
+        """Responds to get requests"""
+        result = self.lines.arrivals.etas(int(station_id) if station_id is not None else None)
+        if station_id is None and self.get_argument("segments", None) is not None:
+            result["segments"] = self.lines.arrivals.segment_stats()
+        self.write(result)
+
+
+class TurnstileHandler(tornado.web.RequestHandler):
+    """Serves windowed turnstile entries (network, lines, busiest stations, or one station) as JSON"""
+
+    query_latency = registry.histogram("server.turnstile_query_latency")
+
+    def initialize(self, turnstiles):
+        """Initializes the handler with required configuration"""
+        self.turnstiles = turnstiles
+
+    def get(self, station_id=None):
+        """Responds to get requests, optional arguments: `window` (1h, 1d), `line` and `top`"""
+        window = self.get_argument("window", "1h")
+        if window not in TurnstileIndex.windows:
+            raise tornado.web.HTTPError(400, "Unknown window %s" % window)
+        start = time.perf_counter()
+        if station_id is not None:
+            result = {
+                "window": window,
+                "station_id": int(station_id),
+                "entries": self.turnstiles.entries(window, station_id=int(station_id)),
+            }
+        else:
+            result = self.turnstiles.summary(
+                window, int_argument(self, "top", 10, minimum=0), self.get_argument("line", None)
+            )
+        TurnstileHandler.query_latency.observe(time.perf_counter() - start)
+        self.write(result)
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Serves the metrics registry as JSON"""
 
+    def get(self):
+        """Responds to get requests"""
+        self.write(registry.snapshot())
 
-def run_server():
-    """Runs the Tornado Server and begins Kafka consumption"""
-    if checker.topic_exists(config.TOPIC_NAME_TURNSTILE_SUMMARY) is False:
-        logger.fatal("Ensure that the KSQL Command has run successfully before running the web server!")
+
+def _routes(path_prefix, weather_model, lines, turnstiles):
+    return [
+        (path_prefix + r"/", MainHandler, {"weather": weather_model, "lines": lines}),
+        (path_prefix + r"/api/stations/(\d+)/history", StationHistoryHandler, {"lines": lines}),
+        (path_prefix + r"/api/eta", EtaHandler, {"lines": lines}),
+        (path_prefix + r"/api/eta/(\d+)", EtaHandler, {"lines": lines}),
+        (path_prefix + r"/api/turnstiles", TurnstileHandler, {"turnstiles": turnstiles}),
+        (path_prefix + r"/api/turnstiles/(\d+)", TurnstileHandler, {"turnstiles": turnstiles}),
+    ]
+
+
+def make_app(role, weather_model, lines, turnstiles, networks=None):
+    """Returns the application serving the given models; ingest workers only serve `/metrics`
+
+    The models of further `networks` ({topic prefix: (weather, lines, turnstiles)}) are served
+    with the same paths below `/networks/<topic prefix>`.
+    """
+    if role == "ingest":
+        return tornado.web.Application([(r"/metrics", MetricsHandler)])
+    routes = _routes("", weather_model, lines, turnstiles)
+    for prefix, models in (networks or {}).items():
+        routes += _routes(f"/networks/{re.escape(prefix)}", *models)
+    return tornado.web.Application(routes + [(r"/metrics", MetricsHandler)])
+
+
+def _check_topics(topics, role, existing_topics):
+    """Exits unless the topics the server depends on have been created"""
+    if topics.turnstile_summary not in existing_topics:
+        logger.fatal("Ensure that the KSQL Command has run successfully for %s before running the web server!",
+                     topics.prefix)
+        exit(1)
+    if topics.trans_stations not in existing_topics:
+        logger.fatal("Ensure that Faust Streaming is running successfully for %s before running the web server!",
+                     topics.prefix)
         exit(1)
-    if checker.topic_exists(config.TOPIC_NAME_TRANS_STATIONS) is False:
-        logger.fatal("Ensure that Faust Streaming is running successfully before running the web server!")
+    if role == "web" and topics.dashboard_state not in existing_topics:
+        logger.fatal("Ensure that an ingest worker is running before running a web front-end!")
         exit(1)
 
-    weather_model = Weather()
-    lines = Lines()
 
-    application = tornado.web.Application(
-        [(r"/", MainHandler, {"weather": weather_model, "lines": lines})]
-    )
-    application.listen(8888)
+def _network_consumers(topics, models, role, resume, snapshot_offsets, instance_group):
+    """Returns the consumers feeding the models of a network, and the state publisher of an ingest worker"""
+    lines, weather_model, turnstiles = models["lines"], models["weather"], models["turnstiles"]
 
-    # Build kafka consumers
+    # Load the complete station catalogue before serving, instead of trickling it in via polling
+    station_offsets = read_to_end(topics.trans_stations, lines.process_message)
     consumers = [
         KafkaConsumer(
-            config.TOPIC_NAME_WEATHER,
-            weather_model.process_message,
+            topics.trans_stations,
+            lines.process_message,
             offset_earliest=True,
+            is_avro=False,
+            start_offsets=station_offsets,
+            group_id=None if role == "all" else f"{instance_group}.{topics.trans_stations}",
         ),
+    ]
+
+    publisher = None
+    if role == "web":
+        state_view = models["state_view"] = models.get("state_view") or StateView(lines, weather_model, topics)
+        state_offsets = read_to_end(topics.dashboard_state, state_view.process_message)
+        consumers.append(
+            KafkaConsumer(
+                topics.dashboard_state,
+                state_view.process_message,
+                offset_earliest=True,
+                is_avro=False,
+                start_offsets=state_offsets,
+                group_id=f"{instance_group}.{topics.dashboard_state}",
+            )
+        )
+        return consumers, publisher
+
+    handler = lambda process_message: process_message
+    group_ids = {}
+    if role == "ingest":
+        publisher = StatePublisher(topics)
+        handler = publisher.wrap
+        group_ids = {
+            topic: f"{config.INGEST_GROUP_ID}.{topic}"
+            for topic in (topics.weather, topics.arrival, topics.turnstile_summary)
+        }
+    consumers += [
         KafkaConsumer(
-            config.TOPIC_NAME_TRANS_STATIONS,
-            lines.process_message,
+            topics.weather,
+            handler(weather_model.process_message),
             offset_earliest=True,
-            is_avro=False,
+            group_id=group_ids.get(topics.weather),
+            resume=resume,
+            start_offsets=snapshot_offsets.get(topics.weather),
         ),
         KafkaConsumer(
-            config.TOPIC_NAME_ARRIVAL,
-            lines.process_message,
+            topics.arrival,
+            handler(lines.process_message),
             offset_earliest=True,
+            group_id=group_ids.get(topics.arrival),
+            resume=resume,
+            start_offsets=snapshot_offsets.get(topics.arrival),
         ),
         KafkaConsumer(
-            config.TOPIC_NAME_TURNSTILE_SUMMARY,
-            lines.process_message,
+            topics.turnstile_summary,
+            handler(lines.process_message),
             offset_earliest=True,
             is_avro=False,
+            group_id=group_ids.get(topics.turnstile_summary),
+            resume=resume,
+            start_offsets=snapshot_offsets.get(topics.turnstile_summary),
         ),
     ]
+    if role == "all":
+        # The windowed index reads the raw entries; front-ends of a scaled-out setup do without it
+        consumers.append(
+            KafkaConsumer(
+                topics.turnstile,
+                turnstiles.process_message,
+                offset_earliest=True,
+                resume=resume,
+                start_offsets=snapshot_offsets.get(topics.turnstile),
+            )
+        )
+    return consumers, publisher
+
+
+def run_server(
+    role="all", port=8888, resume=False, snapshot_path=None, snapshot_interval=60.0, profiler=None, prefixes=None,
+    instance_id=None,
+):
+    """Runs the Tornado Server and begins Kafka consumption
+
+    With `role` "all" one process consumes every topic and serves the dashboard. For scale-out,
+    "ingest" workers split the input topics' partitions within shared consumer groups and
+    publish the resulting state (see `consumers/state.py`), serving only `/metrics`, while
+    "web" front-ends serve the complete network from that state.
+
+    With `resume`, the input topics continue from the committed offsets instead of being
+    replayed. With a `snapshot_path`, the models are restored from and periodically saved to
+    that file together with their offsets (see `consumers/snapshot.py`). A `profiler` (see
+    `profiling.py`) gets a step per consumed message.
+
+    With several topic `prefixes` (role "all" only), every network gets models of its own: the
+    first one is served at the root, all of them below `/networks/<prefix>` (see `make_app`).
+
+    The `instance_id` (default: host name and port) names the consumer groups of this instance,
+    so that a restarted instance reuses its groups rather than leaving new ones behind.
+    """
+    prefixes = prefixes or [config.DEFAULT_TOPICS.prefix]
+    if len(prefixes) > 1 and role != "all":
+        logger.fatal("Serving several networks requires role 'all', scale out one network per CTA_TOPIC_PREFIX")
+        exit(1)
+    networks = {
+        prefix: config.DEFAULT_TOPICS if prefix == config.DEFAULT_TOPICS.prefix else config.Topics(prefix)
+        for prefix in prefixes
+    }
+    existing_topics = set(checker.get_topics())
+    for topics in networks.values():
+        _check_topics(topics, role, existing_topics)
+
+    # prefix -> {"weather", "lines", "turnstiles" and, on a front-end, "state_view"}
+    models = {
+        prefix: {"weather": Weather(), "lines": Lines(topics), "turnstiles": TurnstileIndex()}
+        for prefix, topics in networks.items()
+    }
+    snapshot_offsets = {}
+    restored = load_snapshot(snapshot_path) if snapshot_path is not None else None
+    if restored is not None:
+        restored_models, snapshot_offsets = restored
+        models.update((prefix, restored_models[prefix]) for prefix in networks if prefix in restored_models)
+    # Every instance needs all stations (and a front-end all of the state): groups of their own
+    instance_id = instance_id or f"{socket.gethostname()}-{port}"
+    instance_group = f"consumer-group-{role}-{instance_id}"
+
+    # Created before serving, so that writing dead letters never waits for the topic
+    dead_letter_queue().prepare()
+    consumers = []
+    publisher = None
+    for prefix, topics in networks.items():
+        network_consumers, publisher = _network_consumers(
+            topics, models[prefix], role, resume, snapshot_offsets, instance_group
+        )
+        consumers += network_consumers
+
+    if profiler is not None:
+        for consumer in consumers:
+            consumer.message_handler = profiler.wrap(consumer.message_handler)
+
+    first = models[prefixes[0]]
+    application = make_app(
+        role, first["weather"], first["lines"], first["turnstiles"],
+        networks={
+            prefix: (network["weather"], network["lines"], network["turnstiles"])
+            for prefix, network in models.items()
+        } if len(prefixes) > 1 else None,
+    )
+    application.listen(port)
+    time_to_listen = time.monotonic() - STARTED
+    registry.gauge("server.startup.listen_secs").set(time_to_listen)
+    logger.info("Listening on port %s after %.3fs (role: %s, networks: %s)", port, time_to_listen, role,
+                ", ".join(prefixes))
 
     try:
-        logger.info("Open a web browser to http://localhost:8888 to see the Transit Status Page")
+        if role != "ingest":
+            logger.info("Open a web browser to http://localhost:%s to see the Transit Status Page", port)
         for consumer in consumers:
             tornado.ioloop.IOLoop.current().spawn_callback(consumer.consume)
+        if publisher is not None:
+            tornado.ioloop.PeriodicCallback(publisher.flush, config.STATE_PUBLISH_INTERVAL_MS).start()
+        snapshotter = None
+        if snapshot_path is not None:
+            # The catalogues are re-read at every start, their offsets are not part of the snapshot
+            catalogues = {topics.trans_stations for topics in networks.values()}
+            snapshotter = Snapshotter(
+                snapshot_path,
+                models,
+                [c for c in consumers if c.topic_name_pattern not in catalogues],
+            )
+            tornado.ioloop.PeriodicCallback(snapshotter.save, snapshot_interval * 1000).start()
 
         tornado.ioloop.IOLoop.current().start()
     except KeyboardInterrupt:
         logger.info("Shutting down server")
         tornado.ioloop.IOLoop.current().stop()
+        if snapshotter is not None:
+            # The consumers still commit and close without a final snapshot
+            try:
+                snapshotter.save(config.DEAD_LETTER_FLUSH_TIMEOUT_SECS)
+            except Exception as e:
+                logger.error("Unable to save the final snapshot to %s: %s", snapshot_path, e)
         for consumer in consumers:
             consumer.close()
+        dead_letter_queue().close()
+        if profiler is not None:
+            profiler.stop()
+        if publisher is not None:
+            publisher.close()
 
 
 if __name__ == "__main__":
-    run_server()
+    parser = argparse.ArgumentParser(description="Runs the Transit Status Page server")
+    parser.add_argument("--role", choices=("all", "ingest", "web"), default="all",
+                        help="all: single process (default); ingest: consume and publish the state; "
+                             "web: serve the state published by the ingest workers")
+    parser.add_argument("--port", type=int, default=8888, help="HTTP port (default: 8888)")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the input topics from the committed offsets instead of replaying them")
+    parser.add_argument("--snapshot", default=None,
+                        help="restore the models from, and periodically save them to, this snapshot file")
+    parser.add_argument("--snapshot-interval", type=float, default=60.0,
+                        help="seconds between snapshots (default: 60)")
+    parser.add_argument("--networks", nargs="+", default=None, metavar="TOPIC_PREFIX",
+                        help="serve the networks of these topic prefixes, the first one at the root "
+                             "(default: the CTA_TOPIC_PREFIX network)")
+    parser.add_argument("--instance-id", default=None,
+                        help="stable name of this instance's consumer groups (default: <host name>-<port>)")
+    parser.add_argument("--profile", default=None,
+                        help="profile a window of consumed messages, writing <PROFILE>.pstats and "
+                             "<PROFILE>.folded (also enabled by the PROFILE environment variable)")
+    parser.add_argument("--profile-skip", type=int, default=None,
+                        help="messages to consume before profiling (default: $PROFILE_SKIP or 0)")
+    parser.add_argument("--profile-window", type=int, default=None,
+                        help="messages to profile (default: $PROFILE_WINDOW or 10000)")
+    args = parser.parse_args()
+    run_server(
+        role=args.role,
+        port=args.port,
+        resume=args.resume,
+        snapshot_path=args.snapshot,
+        snapshot_interval=args.snapshot_interval,
+        profiler=profiler_from_env(
+            args.profile, args.profile_skip, args.profile_window, PROFILED_FUNCTIONS, default_window=10000
+        ),
+        prefixes=args.networks,
+        instance_id=args.instance_id,
+    )
@@ -0,0 +1,88 @@
+"""Snapshots of the dashboard models together with the consumer offsets they reflect
+
+Message handlers and snapshots both run on the IOLoop thread, so a snapshot holds the models
+after exactly the messages before its offsets. Restoring the models and continuing every
+partition from the saved offsets applies each message to them once, without replaying the
+topics. Snapshots are written to a temporary file and renamed over the previous one, so a crash
+never leaves a partial snapshot behind.
+
+The positions of a snapshot are past the messages that were dead-lettered, so a snapshot is
+only taken once all dead letters so far are written; otherwise it waits for the next interval.
+"""
+import logging
+import os
+import pickle
+import tempfile
+import time
+
+from consumers.errors import dead_letter_queue
+from metrics import registry
+
+
+logger = logging.getLogger(__name__)
+
+
+SNAPSHOT_VERSION = 2
+
+
+def save_snapshot(path, models, offsets):
+    """Atomically writes the models (a dict of picklable objects) and offsets ({topic: {partition: offset}})"""
+    data = {"version": SNAPSHOT_VERSION, "created": time.time(), "models": models, "offsets": offsets}
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".snapshot-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_snapshot(path):
+    """Returns the (models, offsets) of a snapshot, or None if there is no usable snapshot"""
+    try:
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+        logger.warning("Ignoring unreadable snapshot %s: %s", path, e)
+        return None
+    if data.get("version") != SNAPSHOT_VERSION:
+        logger.warning("Ignoring snapshot %s of version %s", path, data.get("version"))
+        return None
+    logger.info("Restored snapshot %s taken %.0fs ago", path, time.time() - data["created"])
+    return data["models"], data["offsets"]
+
+
+class Snapshotter:
+    """Periodically saves the models with the positions of the consumers feeding them"""
+
+    def __init__(self, path, models, consumers):
+        self.path = path
+        self.models = models
+        self.consumers = consumers
+        self.save_latency = registry.histogram("snapshot.save_latency")
+        self.deferred = registry.counter("snapshot.deferred")
+
+    def save(self, timeout=0):
+        """Saves a snapshot, unless dead letters are still in flight after `timeout` seconds
+
+        Returns whether the snapshot was saved.
+        """
+        dead_letters = dead_letter_queue()
+        if not dead_letters.written_through(dead_letters.mark(), timeout):
+            self.deferred.inc()
+            logger.info("Snapshot deferred until the dead letters in flight are written")
+            return False
+        start = time.perf_counter()
+        offsets = {}
+        for consumer in self.consumers:
+            if consumer.positions:
+                offsets.setdefault(consumer.topic_name_pattern, {}).update(consumer.positions)
+        save_snapshot(self.path, self.models, offsets)
+        self.save_latency.observe(time.perf_counter() - start)
+        logger.debug("Snapshot saved to %s", self.path)
+        return True
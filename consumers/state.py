@@ -0,0 +1,151 @@
+"""Shared dashboard state for running several server instances
+
+Ingest workers consume the input topics within one consumer group, so every partition is
+handled by exactly one of them. After updating its own models, a worker publishes the latest
+state of every station it touched (last arrival per direction, turnstile count) and of the
+weather to a compacted state topic, keyed by station. Web front-ends read the whole state
+topic, each with a group of its own, and apply the snapshots to their models through the same
+handlers the input topics use. Any number of front-ends therefore serve the complete network.
+
+Arrivals of one station should all be on one partition of the arrival topic (e.g. produced
+keyed or partitioned by station), otherwise the snapshots of two workers may overwrite each
+other until the station's next arrival.
+"""
+import json
+import logging
+
+from confluent_kafka import Producer as KafkaProducer
+
+import config
+from consumers.consumer import LocalMessage
+from consumers.models.timeseries import message_time_ms
+from metrics import registry
+from topic_admin import ensure_topic
+
+
+logger = logging.getLogger(__name__)
+
+
+class StatePublisher:
+    """Collects model updates of an ingest worker and publishes them as snapshots"""
+
+    def __init__(self, topics=None):
+        """Creates the publisher of a network's `topics` (default: `config.DEFAULT_TOPICS`)"""
+        self.topics = topics if topics is not None else config.DEFAULT_TOPICS
+        self.topic_name = self.topics.dashboard_state
+        ensure_topic(self.topic_name, {"cleanup.policy": "compact"})
+        self.producer = KafkaProducer({
+            "bootstrap.servers": config.BROKER_URL,
+            "client.id": "dashboard-state",
+            "linger.ms": 50,
+        })
+        # station_id -> {"a": arrival, "b": arrival, "turnstile": count}; only the dirty ones are published
+        self.stations = {}
+        self.dirty = set()
+        self.weather = None
+        self.published = registry.meter("state.published")
+
+    def wrap(self, handler):
+        """Returns a message handler that calls `handler`, then records the update for publishing"""
+        def handle(message):
+            handler(message)
+            self.record(message)
+        return handle
+
+    def record(self, message):
+        topic = message.topic()
+        topics = self.topics
+        if topic == topics.arrival:
+            value = message.value()
+            # The train has left its previous station, which must not show it any more
+            prev = self.stations.get(value.get("prev_station_id"))
+            prev_direction = value.get("prev_direction")
+            if prev is not None and prev_direction in ("a", "b") and prev[prev_direction] is not None \
+                    and prev[prev_direction]["train_id"] == value["train_id"]:
+                prev[prev_direction] = None
+                self.dirty.add(prev["station_id"])
+            station = self._station(value["station_id"])
+            station[value["direction"]] = dict(value, timestamp=message_time_ms(message))
+            self.dirty.add(value["station_id"])
+        elif topic == topics.turnstile_summary:
+            value = json.loads(message.value())
+            station = self._station(value["STATION_ID"])
+            station["turnstile"] = {"count": value["COUNT"], "timestamp": message_time_ms(message)}
+            self.dirty.add(value["STATION_ID"])
+        elif topic == topics.weather:
+            self.weather = dict(message.value())
+
+    def _station(self, station_id):
+        station = self.stations.get(station_id)
+        if station is None:
+            station = self.stations[station_id] = {"station_id": station_id, "a": None, "b": None, "turnstile": None}
+        return station
+
+    def flush(self):
+        """Publishes the snapshots of all stations (and the weather) changed since the last flush"""
+        for station_id in self.dirty:
+            self.producer.produce(self.topic_name, json.dumps(self.stations[station_id]), f"station:{station_id}")
+        num_published = len(self.dirty)
+        self.dirty.clear()
+        if self.weather is not None:
+            self.producer.produce(self.topic_name, json.dumps(self.weather), "weather")
+            self.weather = None
+            num_published += 1
+        self.producer.poll(0)
+        self.published.mark(num_published)
+
+    def close(self):
+        self.flush()
+        self.producer.flush(10)
+
+
+class StateView:
+    """Applies the snapshots of the state topic to the models of a web front-end"""
+
+    # A class attribute, so that a view restored from a snapshot still reports to the registry
+    applied = registry.meter("state.applied")
+
+    def __init__(self, lines, weather, topics=None):
+        """Creates the view feeding the models of a network's `topics` (default: `config.DEFAULT_TOPICS`)"""
+        self.topics = topics if topics is not None else config.DEFAULT_TOPICS
+        self.lines = lines
+        self.weather = weather
+        # (station_id, direction) -> timestamp of the last applied arrival, station_id -> count
+        self.arrival_times = {}
+        self.counts = {}
+
+    def process_message(self, message):
+        key = message.key()
+        if isinstance(key, bytes):
+            key = key.decode("utf-8")
+        value = json.loads(message.value())
+        if key == "weather":
+            self.weather.process_message(LocalMessage(self.topics.weather, value))
+        else:
+            self._apply_station(value)
+        StateView.applied.mark()
+
+    def _apply_station(self, snapshot):
+        station_id = snapshot["station_id"]
+        for direction in ("a", "b"):
+            arrival = snapshot.get(direction)
+            if arrival is None:
+                continue
+            timestamp_ms = arrival.pop("timestamp")
+            # Snapshots are republished on every change, only newer arrivals are applied
+            if timestamp_ms <= self.arrival_times.get((station_id, direction), -1):
+                continue
+            self.arrival_times[(station_id, direction)] = timestamp_ms
+            self.lines.process_message(LocalMessage(
+                self.topics.arrival, arrival, key={"timestamp": timestamp_ms}, timestamp_ms=timestamp_ms
+            ))
+
+        turnstile = snapshot.get("turnstile")
+        if turnstile is not None and turnstile["count"] != self.counts.get(station_id):
+            self.counts[station_id] = turnstile["count"]
+            self.lines.process_message(LocalMessage(
+                self.topics.turnstile_summary,
+                json.dumps({"STATION_ID": station_id, "COUNT": turnstile["count"]}),
+                timestamp_ms=turnstile["timestamp"],
+            ))
+
@@ -9,7 +9,14 @@ import config
 
 class Checker:
     def __init__(self):
-        self.client = AdminClient({"bootstrap.servers": config.BROKER_URL})
+        self._client = None
+
+    @property
+    def client(self):
+        """Admin client, connected on first use"""
+        if self._client is None:
+            self._client = AdminClient({"bootstrap.servers": config.BROKER_URL})
+        return self._client
 
     def topic_exists(self, topic):
         """Checks if the given topic exists in Kafka"""
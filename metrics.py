@@ -0,0 +1,226 @@
+"""Lightweight in-process metrics shared by the producers and the consumers
+
+Instruments are plain objects that hot paths look up once and then update with a couple of
+integer/float operations, so recording a sample costs well under a microsecond. Each instrument
+guards its updates with a lock of its own, so that threads sharing it (e.g. the line threads of
+`--async`) never lose an update. All rate and quantile maths happens when a snapshot is taken
+(e.g. by the `/metrics` endpoint).
+"""
+import bisect
+import json
+import math
+import threading
+import time
+
+
+# Latency bucket upper bounds in seconds: 4 log-spaced buckets per decade, 10us .. 10s
+LATENCY_BUCKETS = tuple(10 ** (e / 4) for e in range(-20, 5))
+
+
+class _Guarded:
+    """Base of the instruments updated under a lock of their own
+
+    The lock is left out of pickles and recreated on load, so that objects holding instruments
+    can still be snapshotted.
+    """
+
+    __slots__ = ("_lock",)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {
+            name: getattr(self, name)
+            for cls in type(self).__mro__ for name in getattr(cls, "__slots__", ()) if name != "_lock"
+        }
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._lock = threading.Lock()
+
+
+class Counter(_Guarded):
+    """Monotonically increasing count"""
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        super().__init__()
+        self.value = 0
+
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    """Last observed value"""
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+
+class Meter(_Guarded):
+    """Counts events and derives a one-minute exponentially weighted rate on read"""
+
+    __slots__ = ("count", "_uncounted", "_rate", "_last_tick")
+
+    tick_interval = 5.0
+    alpha = 1 - math.exp(-tick_interval / 60.0)
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+        self._uncounted = 0
+        self._rate = None
+        self._last_tick = time.monotonic()
+
+    def mark(self, n=1):
+        with self._lock:
+            self.count += n
+            self._uncounted += n
+
+    def rate(self):
+        """Returns the 1-minute moving average in events per second"""
+        now = time.monotonic()
+        with self._lock:
+            ticks = int((now - self._last_tick) / Meter.tick_interval)
+            for _ in range(min(ticks, 60)):
+                instant = self._uncounted / Meter.tick_interval
+                self._uncounted = 0
+                if self._rate is None:
+                    self._rate = instant
+                else:
+                    self._rate += Meter.alpha * (instant - self._rate)
+            self._last_tick += ticks * Meter.tick_interval
+            return self._rate or 0.0
+
+    def snapshot(self):
+        return {"count": self.count, "rate_1m": round(self.rate(), 3)}
+
+
+class Histogram(_Guarded):
+    """Fixed-bucket histogram, quantiles are estimated from bucket upper bounds"""
+
+    __slots__ = ("bounds", "counts", "count", "sum", "max")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        super().__init__()
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        bucket = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, q):
+        """Returns the upper bound of the bucket holding the q-th quantile"""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, num in enumerate(self.counts):
+            seen += num
+            if seen >= rank and num > 0:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "count": self.count,
+                "mean": self.sum / self.count if self.count else None,
+                "p50": self.quantile(0.5),
+                "p90": self.quantile(0.9),
+                "p99": self.quantile(0.99),
+                "max": self.max,
+            }
+
+
+class Registry:
+    """Holds named instruments and librdkafka client statistics"""
+
+    def __init__(self):
+        self.started = time.time()
+        self._instruments = {}
+        self._client_stats = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name, cls):
+        instrument = self._instruments.get(name)
+        if instrument is None:
+            with self._lock:
+                instrument = self._instruments.setdefault(name, cls())
+        return instrument
+
+    def counter(self, name):
+        return self._get(name, Counter)
+
+    def gauge(self, name):
+        return self._get(name, Gauge)
+
+    def meter(self, name):
+        return self._get(name, Meter)
+
+    def histogram(self, name):
+        return self._get(name, Histogram)
+
+    def stats_callback(self, stats_json):
+        """librdkafka `stats_cb`: keeps a trimmed copy of the latest statistics per client, and returns it"""
+        stats = json.loads(stats_json)
+        summary = {
+            key: stats.get(key)
+            for key in ("type", "msg_cnt", "msg_size", "replyq", "tx", "txmsgs", "rx", "rxmsgs")
+        }
+        summary["brokers"] = {
+            name: {"rtt_avg_us": broker.get("rtt", {}).get("avg"), "outbuf_cnt": broker.get("outbuf_cnt")}
+            for name, broker in stats.get("brokers", {}).items()
+        }
+        lag = {}
+        for topic, topic_stats in stats.get("topics", {}).items():
+            for partition, partition_stats in topic_stats.get("partitions", {}).items():
+                if partition == "-1" or partition_stats.get("consumer_lag", -1) < 0:
+                    continue
+                lag[f"{topic}[{partition}]"] = partition_stats["consumer_lag"]
+        if lag:
+            summary["consumer_lag"] = lag
+        self._client_stats[stats.get("name")] = summary
+        return summary
+
+    def snapshot(self):
+        """Returns all instruments as a JSON-serializable dict"""
+        return {
+            "uptime_secs": round(time.time() - self.started, 3),
+            "metrics": {name: inst.snapshot() for name, inst in sorted(self._instruments.items())},
+            "librdkafka": dict(self._client_stats),
+        }
+
+    def dump(self, path):
+        """Writes a snapshot to the given file"""
+        with open(path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2, sort_keys=True)
+
+
+# Process-wide default registry
+registry = Registry()
@@ -0,0 +1,93 @@
+"""Bulk-loads the station table into Kafka without waiting for Kafka Connect
+
+Publishes every row of `cta_stations.csv` in one batch, either as raw rows into the stations
+topic (as the JDBC connector would) or already transformed into the trans_stations topic (as the
+Faust table would). Records are keyed by station_id, so running it again is idempotent.
+"""
+import argparse
+import json
+import logging
+
+from confluent_kafka import Producer as KafkaProducer
+
+import config
+from producers.stations import STATIONS_CSV, read_station_rows, transformed_stations
+from topic_admin import ensure_topic
+
+
+logger = logging.getLogger(__name__)
+
+
+# Namespace of the Faust record, needed for Faust to read the table changelog back
+FAUST_NAMESPACE = "consumers.faust_stream.TransformedStation"
+
+
+def station_key(station_id):
+    """Serializes a station key as Faust does for the `key_type=int` changelog (JSON): 40380 -> b"40380"
+
+    The JDBC connector's JSON key converter writes the extracted `station_id` the same way, so
+    records of the bootstrap and of Faust or Kafka Connect share keys and compact together.
+    """
+    return json.dumps(int(station_id)).encode("utf-8")
+
+
+def _station_records(path):
+    """Raw rows as the JDBC source connector publishes them (JSON, no schemas)"""
+    for row in read_station_rows(path):
+        yield station_key(row["station_id"]), row
+
+
+def _trans_station_records(path):
+    """Transformed stations as the Faust table publishes them to its changelog"""
+    for station_id, station in transformed_stations(path).items():
+        yield station_key(station_id), dict(station, __faust={"ns": FAUST_NAMESPACE})
+
+
+def bootstrap_stations(
+    target=config.TOPIC_NAME_STATIONS, timeout=30.0, topics=config.DEFAULT_TOPICS, path=STATIONS_CSV
+):
+    """Publishes all stations of `path` to a stations topic of `topics` in one batch, returns the number of records"""
+    if target == topics.trans_stations:
+        ensure_topic(target, {"cleanup.policy": "compact"})
+        records = _trans_station_records(path)
+    elif target == topics.stations:
+        ensure_topic(target)
+        records = _station_records(path)
+    else:
+        raise ValueError(f"Unable to bootstrap stations into {target}")
+
+    producer = KafkaProducer({
+        "bootstrap.servers": config.BROKER_URL,
+        "client.id": "stations-bootstrap",
+        "enable.idempotence": True,
+        "linger.ms": 100,
+    })
+    errors = []
+    num_records = 0
+    for key, value in records:
+        producer.produce(
+            target,
+            json.dumps(value),
+            key,
+            on_delivery=lambda err, msg: errors.append(err) if err is not None else None,
+        )
+        num_records += 1
+
+    remaining = producer.flush(timeout)
+    if remaining > 0 or errors:
+        raise RuntimeError(
+            f"Station bootstrap into {target} failed: {remaining} undelivered, errors: {errors[:5]}"
+        )
+    logger.info("Bootstrapped %s station records into %s", num_records, target)
+    return num_records
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Bulk-loads the CTA stations into Kafka")
+    parser.add_argument("--target", choices=("stations", "trans_stations"), default="stations",
+                        help="raw stations topic (transformed by Faust) or the transformed topic itself")
+    args = parser.parse_args()
+    bootstrap_stations(
+        config.TOPIC_NAME_TRANS_STATIONS if args.target == "trans_stations" else config.TOPIC_NAME_STATIONS
+    )
@@ -0,0 +1,140 @@
+"""Columnar export of the produced events, for offline analysis
+
+`ParquetSink` is an event sink (see `Producer.event_sinks`) that writes every topic to Parquet
+files, partitioned Hive-style by date and line:
+
+    <root>/<topic>/date=<YYYY-MM-DD>/line=<line>/part-<run>-<n>.parquet
+
+(without the line level for the weather). Each file holds the event timestamp and the value
+fields but the partition column. Rows are buffered per partition and written once a partition
+has `rows_per_file` rows, or once all buffers together exceed `max_buffered_rows` (the largest
+one first), so memory stays bounded however many days and lines are exported. The files can be read with any Arrow-based tool, e.g.
+`pyarrow.dataset.dataset(f"{root}/{topic}", partitioning="hive")`.
+"""
+import collections
+import datetime
+import logging
+import os
+import threading
+import uuid
+
+from metrics import registry
+from producers.models import Line
+
+
+logger = logging.getLogger(__name__)
+
+
+MS_PER_DAY = 24 * 60 * 60 * 1000
+# Turnstile events carry the line as its number
+LINE_NAMES = {color.value: color.name for color in Line.colors}
+
+
+def _arrow_type(pa, schema):
+    """Arrow type of a (primitive, enum or nullable) Avro schema"""
+    if schema.type == "union":
+        schema = next(branch for branch in schema.schemas if branch.type != "null")
+    return {
+        "boolean": pa.bool_(),
+        "int": pa.int32(),
+        "long": pa.int64(),
+        "float": pa.float32(),
+        "double": pa.float64(),
+        "string": pa.string(),
+        "enum": pa.string(),
+    }[schema.type]
+
+
+class ParquetSink:
+    """Buffers events per topic, date and line, and writes them as Parquet files"""
+
+    def __init__(self, root, rows_per_file=100_000, max_buffered_rows=500_000):
+        # Only needed when exporting
+        import pyarrow
+        import pyarrow.parquet
+
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.root = root
+        self.rows_per_file = rows_per_file
+        self.max_buffered_rows = max_buffered_rows
+        self.run_id = uuid.uuid4().hex[:8]
+        # topic -> (arrow schema, value field names but the partition one)
+        self.schemas = {}
+        # (topic, date, line) -> {column: [values]}
+        self.buffers = collections.defaultdict(lambda: collections.defaultdict(list))
+        self.buffer_rows = collections.Counter()
+        self.num_buffered = 0
+        self.num_files = 0
+        # day number -> "YYYY-MM-DD"
+        self.dates = {}
+        self.lock = threading.Lock()
+        self.rows_written = registry.counter("parquet.rows_written")
+        self.files_written = registry.counter("parquet.files_written")
+
+    def _schema(self, topic, value_schema):
+        schema = self.schemas.get(topic)
+        if schema is None:
+            fields = [field for field in value_schema.fields if field.name != "line"]
+            arrow_schema = self.pa.schema(
+                [self.pa.field("timestamp", self.pa.timestamp("ms"), nullable=False)]
+                + [self.pa.field(field.name, _arrow_type(self.pa, field.type)) for field in fields]
+            )
+            schema = self.schemas[topic] = (arrow_schema, [field.name for field in fields])
+        return schema
+
+    def _date(self, timestamp_ms):
+        day = timestamp_ms // MS_PER_DAY
+        date = self.dates.get(day)
+        if date is None:
+            date = self.dates[day] = datetime.datetime.utcfromtimestamp(day * MS_PER_DAY / 1000).date().isoformat()
+        return date
+
+    def write(self, topic, timestamp_ms, key_schema, value_schema, value):
+        """Buffers a single event"""
+        line = value.get("line")
+        line = LINE_NAMES.get(line, line)
+        with self.lock:
+            _, names = self._schema(topic, value_schema)
+            partition = (topic, self._date(timestamp_ms), line)
+            columns = self.buffers[partition]
+            columns["timestamp"].append(timestamp_ms)
+            for name in names:
+                columns[name].append(value.get(name))
+            self.buffer_rows[partition] += 1
+            self.num_buffered += 1
+
+            if self.buffer_rows[partition] >= self.rows_per_file:
+                self._write(partition)
+            elif self.num_buffered > self.max_buffered_rows:
+                self._write(self.buffer_rows.most_common(1)[0][0])
+
+    def _write(self, partition):
+        """Writes the buffer of a partition to a new file"""
+        topic, date, line = partition
+        columns = self.buffers.pop(partition)
+        num_rows = self.buffer_rows.pop(partition)
+        self.num_buffered -= num_rows
+
+        arrow_schema, _ = self.schemas[topic]
+        table = self.pa.Table.from_pydict(dict(columns), schema=arrow_schema)
+        directory = os.path.join(self.root, topic, f"date={date}")
+        if line is not None:
+            directory = os.path.join(directory, f"line={line}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{self.run_id}-{self.num_files:05d}.parquet")
+        self.pq.write_table(table, path)
+        self.num_files += 1
+        self.rows_written.inc(num_rows)
+        self.files_written.inc()
+        logger.debug("Wrote %s rows to %s", num_rows, path)
+
+    def flush(self):
+        """Writes all buffered events"""
+        with self.lock:
+            for partition in list(self.buffers):
+                self._write(partition)
+
+    def close(self):
+        self.flush()
+        logger.info("Parquet export closed: %s files written to %s", self.num_files, self.root)
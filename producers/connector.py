@@ -18,11 +18,17 @@ TOPIC_NAME_PREFIX = TOPIC_NAME[:TOPIC_NAME.index(TOPIC_NAME_SHORT)]
 assert TOPIC_NAME_SHORT == 'stations', 'Topic should be called as the DB table!'
 
 
-def configure_connector():
-    """Starts and configures the Kafka Connect connector"""
+def configure_connector(topics=config.DEFAULT_TOPICS):
+    """Starts and configures the Kafka Connect connector of a network's stations topic"""
     logger.info("Creating or updating kafka connect connector...")
+    # Every other network gets a connector of its own, publishing below its topic prefix
+    connector_name = CONNECTOR_NAME
+    topic_prefix = TOPIC_NAME_PREFIX
+    if topics.prefix != config.DEFAULT_TOPIC_PREFIX:
+        connector_name = f"{CONNECTOR_NAME}_{topics.prefix}"
+        topic_prefix = f"{topics.prefix}."
 
-    resp = requests.get(f"{KAFKA_CONNECT_URL_FULL}/{CONNECTOR_NAME}")
+    resp = requests.get(f"{KAFKA_CONNECT_URL_FULL}/{connector_name}")
     if resp.status_code == 200:
         logger.info("Connector already created skipping recreation")
         return
@@ -36,7 +42,7 @@ def configure_connector():
         KAFKA_CONNECT_URL_FULL,
         headers={"Content-Type": "application/json"},
         data=json.dumps({
-            "name": CONNECTOR_NAME,
+            "name": connector_name,
             "config": {
                 "connector.class": "io.confluent.connect.jdbc.JdbcSourceConnector",
                 "key.converter": "org.apache.kafka.connect.json.JsonConverter",
@@ -50,7 +56,7 @@ def configure_connector():
                 "table.whitelist": TOPIC_NAME_SHORT,
                 "mode": "incrementing",  # "bulk",
                 "incrementing.column.name": "stop_id",
-                "topic.prefix": TOPIC_NAME_PREFIX,
+                "topic.prefix": topic_prefix,
                 "poll.interval.ms": "3600000",  # = 1 hour
                 "transforms": "createKey,extractInt",
                 "transforms.createKey.type": "org.apache.kafka.connect.transforms.ValueToKey",
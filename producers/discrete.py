@@ -0,0 +1,157 @@
+"""Discrete-event engine for the time simulation
+
+The engine keeps one heap of timestamped events and jumps straight to the next one:
+
+- a step every `time_step` (the resolution of the simulation): the weather when the step starts
+  on the hour and, paced, the turnstile entries of every station for the step, as in the
+  fixed-step loop;
+- accelerated, a turnstile batch at the first step of every hour instead: the entries of every
+  station for the steps of that hour, drawn in one go, the steps without entries skipped;
+- the next train event of every line (a move or a dispatch, see `Line`), as soon as it is due.
+
+The entries of a station's hour come from a generator of their own (see
+`TurnstileHardware.hour_entries`), whichever steps were drawn before, so all modes produce the
+same events (with the same seed, in a different order).
+
+The engine either paces events like the fixed-step loop (`sleep_seconds` of wall-clock time per
+simulated step) or, accelerated, runs them as fast as they can be produced, without sleeping.
+"""
+import datetime
+import heapq
+import itertools
+import logging
+import time
+
+from metrics import registry
+from producers.models.producer import Producer
+
+
+logger = logging.getLogger(__name__)
+
+
+class EventQueue:
+    """Heap of (time in ms, kind, payload) events; simultaneous events come out in insertion order"""
+
+    def __init__(self):
+        self.heap = []
+        self.sequence = itertools.count()
+
+    def push(self, time_ms, kind, payload=None):
+        heapq.heappush(self.heap, (time_ms, next(self.sequence), kind, payload))
+
+    def pop(self):
+        time_ms, _, kind, payload = heapq.heappop(self.heap)
+        return time_ms, kind, payload
+
+    def next_time_ms(self):
+        return self.heap[0][0] if self.heap else None
+
+    def __len__(self):
+        return len(self.heap)
+
+
+class DiscreteEventEngine:
+    """Runs a `TimeSimulation` event by event"""
+
+    # Kinds of events
+    STEP = 0
+    TRAINS = 1
+    TURNSTILES = 2
+
+    def __init__(self, simulation, num_ticks=None, accelerated=False):
+        self.simulation = simulation
+        self.accelerated = accelerated
+        self.step_ms = int(simulation.time_step.total_seconds() * 1000)
+        self.start_ms = Producer.to_millis(simulation.start_time)
+        self.end_ms = self.start_ms + num_ticks * self.step_ms if num_ticks is not None else None
+        self.queue = EventQueue()
+        self.events = {
+            DiscreteEventEngine.STEP: registry.meter("simulation.discrete.steps"),
+            DiscreteEventEngine.TRAINS: registry.meter("simulation.discrete.train_events"),
+            DiscreteEventEngine.TURNSTILES: registry.meter("simulation.discrete.turnstile_batches"),
+        }
+        self.simulated_days = registry.gauge("simulation.discrete.simulated_days_per_sec")
+
+    def _pace(self, time_ms, wall_start):
+        """Sleeps until the wall-clock time of an event, unless accelerated"""
+        if self.accelerated:
+            return
+        delay = wall_start + (time_ms - self.start_ms) / self.step_ms * self.simulation.sleep_seconds - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _steps_left_in_hour(self, time_ms, step):
+        """The number of steps from `step` (at `time_ms`) to the end of its hour or of the simulation"""
+        curr_time = self.simulation.start_time + step * self.simulation.time_step
+        hour_end = curr_time.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)
+        num_steps = -(-(hour_end - curr_time) // self.simulation.time_step)
+        if self.end_ms is not None:
+            num_steps = min(num_steps, (self.end_ms - time_ms) // self.step_ms)
+        return num_steps
+
+    def _schedule_trains(self, line):
+        due_ms = line.next_event_ms()
+        if due_ms is not None:
+            self.queue.push(due_ms, DiscreteEventEngine.TRAINS, line)
+
+    def run(self):
+        """Processes events until the end of the last step (or forever)"""
+        simulation = self.simulation
+        logger.info("Beginning cta train simulation (discrete-event engine%s)",
+                    ", accelerated" if self.accelerated else "")
+        simulation.setup_stations()
+
+        self.queue.push(self.start_ms, DiscreteEventEngine.STEP, 0)
+        if self.accelerated:
+            self.queue.push(self.start_ms, DiscreteEventEngine.TURNSTILES, 0)
+        for line in simulation.train_lines:
+            self._schedule_trains(line)
+
+        wall_start = last_dump = time.monotonic()
+        while self.queue:
+            time_ms, kind, payload = self.queue.pop()
+            if self.end_ms is not None and time_ms >= self.end_ms:
+                break
+            self._pace(time_ms, wall_start)
+
+            if kind == DiscreteEventEngine.STEP:
+                step = payload
+                curr_time = simulation.start_time + step * simulation.time_step
+                if simulation.profiler is not None:
+                    simulation.profiler.step()
+                if simulation.ridership_watcher is not None and step > 0:
+                    simulation.ridership_watcher.check()
+                # Send weather on the top of the hour
+                if curr_time.minute == 0:
+                    for weather in simulation.weathers:
+                        weather.run(curr_time.month, time_ms)
+                if not self.accelerated:
+                    for line in simulation.train_lines:
+                        line.advance_turnstiles(curr_time, simulation.time_step)
+                self.queue.push(time_ms + self.step_ms, DiscreteEventEngine.STEP, step + 1)
+                if step == 0:
+                    simulation._log_startup()
+            elif kind == DiscreteEventEngine.TURNSTILES:
+                step = payload
+                num_steps = self._steps_left_in_hour(time_ms, step)
+                curr_time = simulation.start_time + step * simulation.time_step
+                for line in simulation.train_lines:
+                    line.advance_turnstile_steps(curr_time, simulation.time_step, num_steps)
+                self.queue.push(time_ms + num_steps * self.step_ms, DiscreteEventEngine.TURNSTILES, step + num_steps)
+            else:
+                line = payload
+                # All of the line's events due at this time, then its next one
+                line.advance_trains(time_ms + 1)
+                self._schedule_trains(line)
+            self.events[kind].mark()
+
+            if simulation.metrics_file is not None and time.monotonic() - last_dump >= simulation.metrics_interval:
+                elapsed = time.monotonic() - wall_start
+                self.simulated_days.set((time_ms - self.start_ms) / 86400000 / elapsed)
+                registry.dump(simulation.metrics_file)
+                last_dump = time.monotonic()
+
+        elapsed = time.monotonic() - wall_start
+        simulated_days = ((self.end_ms or time_ms) - self.start_ms) / 86400000
+        self.simulated_days.set(simulated_days / elapsed if elapsed > 0 else 0.0)
+        logger.info("Simulated %.2f days in %.2fs", simulated_days, elapsed)
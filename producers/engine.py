@@ -0,0 +1,149 @@
+"""Asyncio engine for the time simulation
+
+Every line, the weather source of every network and the station setup (connector or bootstrap) run as independent
+tasks. Their blocking work (producing, HTTP calls, flushing) runs on a thread pool, so a slow
+dependency only delays its own task. The tasks share a `SimulationClock`: tick `n` is due
+`n * sleep_seconds` after the start, so a slow tick does not shift later ones, and a task that is
+still busy when its next tick is due is reported as an overrun.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+
+import config
+from metrics import registry
+from producers.models.producer import Producer
+
+
+logger = logging.getLogger(__name__)
+
+
+class SimulationClock:
+    """Maps tick numbers to simulated times and to wall-clock deadlines"""
+
+    def __init__(self, start_time, time_step, sleep_seconds, num_ticks=None):
+        self.start_time = start_time
+        self.time_step = time_step
+        self.sleep_seconds = sleep_seconds
+        self.num_ticks = num_ticks
+        # Event loop time of tick 0, set by `start`
+        self.started = None
+        self.overruns = registry.counter("simulation.overruns")
+        self.overrun_secs = registry.histogram("simulation.overrun_secs")
+
+    def start(self):
+        self.started = asyncio.get_running_loop().time()
+
+    def running(self, tick):
+        return self.num_ticks is None or tick < self.num_ticks
+
+    def time_of(self, tick):
+        """Simulated time of a tick"""
+        return self.start_time + tick * self.time_step
+
+    async def wait_for(self, tick, task_name):
+        """Sleeps until `tick` is due; reports an overrun if its deadline has already passed"""
+        delay = self.started + tick * self.sleep_seconds - asyncio.get_running_loop().time()
+        if delay >= 0:
+            await asyncio.sleep(delay)
+            return
+        if self.sleep_seconds > 0:
+            self.overruns.inc()
+            self.overrun_secs.observe(-delay)
+            registry.counter(f"simulation.{task_name}.overruns").inc()
+            logger.warning("%s overran tick %s by %.3fs", task_name, tick - 1, -delay)
+        # Still yield, so that a task running behind cannot starve the others
+        await asyncio.sleep(0)
+
+
+class AsyncEngine:
+    """Runs a `TimeSimulation` as concurrent asyncio tasks"""
+
+    def __init__(self, simulation, num_ticks=None):
+        self.simulation = simulation
+        self.clock = SimulationClock(
+            simulation.start_time, simulation.time_step, simulation.sleep_seconds, num_ticks
+        )
+        # One thread per line and weather source, plus the station setup
+        self.executor = ThreadPoolExecutor(
+            max_workers=len(simulation.train_lines) + len(simulation.weathers) + 1, thread_name_prefix="simulation"
+        )
+        self.startup_logged = False
+
+    async def _blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def _setup_stations(self):
+        try:
+            await self._blocking(self.simulation.setup_stations)
+        except Exception:
+            logger.exception("Station setup failed, the simulation continues without it")
+
+    async def _run_line(self, line):
+        name = f"line_{line.color.name}"
+        if line.topics.prefix != config.DEFAULT_TOPICS.prefix:
+            name = f"line_{line.topics.prefix}.{line.color.name}"
+        tick = 0
+        while self.clock.running(tick):
+            await self._blocking(line.run, self.clock.time_of(tick), self.clock.time_step)
+            tick += 1
+            if not self.startup_logged:
+                self.startup_logged = True
+                self.simulation._log_startup()
+            await self.clock.wait_for(tick, name)
+
+    async def _run_weather(self, weather):
+        name = "weather" if weather.topic_name == config.TOPIC_NAME_WEATHER else f"weather_{weather.topic_name}"
+        tick = 0
+        while self.clock.running(tick):
+            curr_time = self.clock.time_of(tick)
+            # Send weather on the top of the hour
+            if curr_time.minute == 0:
+                try:
+                    await self._blocking(weather.run, curr_time.month, Producer.to_millis(curr_time))
+                except Exception:
+                    logger.exception("Unable to send weather for %s", curr_time.isoformat())
+            tick += 1
+            await self.clock.wait_for(tick, name)
+
+    async def _watch_ridership(self):
+        """Checks the ridership files at every tick; lines running their tick see new tables from their next hour"""
+        tick = 0
+        while True:
+            tick += 1
+            await self.clock.wait_for(tick, "ridership")
+            self.simulation.ridership_watcher.check()
+
+    async def _dump_metrics(self):
+        while True:
+            await asyncio.sleep(self.simulation.metrics_interval)
+            registry.dump(self.simulation.metrics_file)
+
+    async def run(self):
+        """Runs all tasks until every line has done its ticks (or forever)"""
+        logger.info("Beginning cta train simulation (asyncio engine)")
+        self.clock.start()
+        setup = asyncio.ensure_future(self._setup_stations())
+        metrics = None
+        if self.simulation.metrics_file is not None:
+            metrics = asyncio.ensure_future(self._dump_metrics())
+        watcher = None
+        if self.simulation.ridership_watcher is not None:
+            watcher = asyncio.ensure_future(self._watch_ridership())
+        try:
+            await asyncio.gather(
+                *(self._run_line(line) for line in self.simulation.train_lines),
+                *(self._run_weather(weather) for weather in self.simulation.weathers),
+            )
+            await setup
+        finally:
+            setup.cancel()
+            if metrics is not None:
+                metrics.cancel()
+            if watcher is not None:
+                watcher.cancel()
+            # Let the blocking calls in flight finish before the producers are closed
+            start = time.monotonic()
+            self.executor.shutdown(wait=True)
+            logger.debug("Executor shut down in %.3fs", time.monotonic() - start)
@@ -0,0 +1,132 @@
+"""Compact on-disk log of produced events
+
+The log is a sequence of length-prefixed frames following a magic header:
+
+    stream id (u8) | timestamp in ms (i64) | payload length (u32) | payload
+
+Payloads are schemaless Avro records. Stream id 255 is reserved for stream definitions, whose
+JSON payload maps a stream id to its topic name and key and value schemas, so a log is
+self-describing. Keys are not stored: every event key is the `{"timestamp": ...}` record.
+"""
+import collections
+import io
+import json
+import logging
+import mmap
+import struct
+import threading
+
+import avro.io
+
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = b"CTAEVT1\n"
+FRAME = struct.Struct(">BqI")
+DEFINITION_STREAM = 255
+
+Stream = collections.namedtuple("Stream", "topic key_schema value_schema")
+
+
+class EventLogWriter:
+    """Appends events to a log file, one stream per topic; safe to use from several threads"""
+
+    def __init__(self, path, buffer_size=1 << 20):
+        self.path = path
+        self.file = open(path, "wb", buffering=buffer_size)
+        self.file.write(MAGIC)
+        self.streams = {}
+        self.num_events = 0
+        self.lock = threading.Lock()
+
+    def _define_stream(self, topic, key_schema, value_schema):
+        stream_id = len(self.streams)
+        if stream_id >= DEFINITION_STREAM:
+            raise ValueError(f"Too many streams in event log {self.path}")
+        payload = json.dumps(
+            {
+                "id": stream_id,
+                "topic": topic,
+                "key_schema": str(key_schema),
+                "value_schema": str(value_schema),
+            }
+        ).encode("utf-8")
+        self.file.write(FRAME.pack(DEFINITION_STREAM, 0, len(payload)))
+        self.file.write(payload)
+        stream = (stream_id, avro.io.DatumWriter(value_schema))
+        self.streams[topic] = stream
+        return stream
+
+    def write(self, topic, timestamp_ms, key_schema, value_schema, value):
+        """Appends a single event"""
+        stream = self.streams.get(topic)
+        if stream is None:
+            with self.lock:
+                stream = self.streams.get(topic) or self._define_stream(topic, key_schema, value_schema)
+        stream_id, writer = stream
+
+        buf = io.BytesIO()
+        writer.write(value, avro.io.BinaryEncoder(buf))
+        payload = buf.getvalue()
+        with self.lock:
+            self.file.write(FRAME.pack(stream_id, timestamp_ms, len(payload)))
+            self.file.write(payload)
+            self.num_events += 1
+
+    def close(self):
+        self.file.close()
+        logger.info("Event log closed: %s events written to %s", self.num_events, self.path)
+
+
+class EventLogReader:
+    """Iterates over a memory-mapped event log"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not an event log: {path}")
+        # stream id -> Stream
+        self.streams = {}
+
+    def frames(self):
+        """Yields (stream id, timestamp_ms, raw Avro payload) for every event"""
+        # Only reading needs the schema parser (and the schema registry client it comes with)
+        from confluent_kafka import avro as confluent_avro
+
+        buffer = self.buffer
+        offset = len(MAGIC)
+        end = len(buffer)
+        while offset < end:
+            stream_id, timestamp_ms, length = FRAME.unpack_from(buffer, offset)
+            offset += FRAME.size
+            payload = buffer[offset:offset + length]
+            offset += length
+            if stream_id == DEFINITION_STREAM:
+                definition = json.loads(payload.decode("utf-8"))
+                self.streams[definition["id"]] = Stream(
+                    definition["topic"],
+                    confluent_avro.loads(definition["key_schema"]),
+                    confluent_avro.loads(definition["value_schema"]),
+                )
+                continue
+            yield stream_id, timestamp_ms, payload
+
+    def events(self):
+        """Yields (topic, timestamp_ms, decoded value) for every event"""
+        readers = {}
+        for stream_id, timestamp_ms, payload in self.frames():
+            reader = readers.get(stream_id)
+            if reader is None:
+                reader = readers[stream_id] = avro.io.DatumReader(self.streams[stream_id].value_schema)
+            yield (
+                self.streams[stream_id].topic,
+                timestamp_ms,
+                reader.read(avro.io.BinaryDecoder(io.BytesIO(payload))),
+            )
+
+    def close(self):
+        self.buffer.close()
+        self.file.close()
@@ -1,9 +1,18 @@
 """Defines functionality relating to train lines"""
 import collections
+import datetime
 from enum import IntEnum
+import heapq
+import itertools
 import logging
+import random
+import time
 
+import config
+from metrics import registry
 from producers.models import Station, Train
+from producers.models.producer import Producer
+from producers.schedule import Schedule
 
 
 logger = logging.getLogger(__name__)
@@ -14,175 +23,249 @@ class Line:
 
     colors = IntEnum("colors", "blue green red", start=0)
     num_directions = 2
-
-    def __init__(self, color, station_data, num_trains=10):
+    # Kinds of train events
+    HOP = 0
+    DISPATCH = 1
+
+    # Time a train takes from one station to the next, stop included
+    hop_time = datetime.timedelta(minutes=2)
+    # Chance that a train breaks down when it reaches a station, the mean time it is held there,
+    # and the chance that it is then taken out of service instead of resuming its trip
+    breakdown_probability = 0.002
+    mean_repair_time = datetime.timedelta(minutes=15)
+    withdraw_probability = 0.25
+
+    def __init__(
+        self, color, station_data, num_trains=None, rng=None, timestamp=None, schedule=None,
+        breakdown_probability=None, topics=None, ridership_seed=None,
+    ):
         self.color = color
-        self.num_trains = num_trains
+        # The network's topics and ridership seed file (defaults: the CTA network's)
+        self.topics = topics if topics is not None else config.DEFAULT_TOPICS
+        self.ridership_seed = ridership_seed
+        self.rng = rng
+        # Breakdowns draw from a generator of their own, so that they do not shift the turnstiles
+        self.train_rng = random.Random(rng.getrandbits(64)) if rng is not None else random
+        self.breakdown_probability = breakdown_probability
+        if breakdown_probability is None:
+            self.breakdown_probability = Line.breakdown_probability
+        self.schedule = schedule if schedule is not None else Schedule()
         self.stations = self._build_line_data(station_data)
         # We must always discount the terminal station at the end of each direction
         self.num_stations = len(self.stations) - 1
-        self.trains = self._build_trains()
-
-    def _build_line_data(self, station_df):
-        """Constructs all stations on the line"""
-        stations = station_df["station_name"].unique()
+        # A round trip runs from the first station to the last in direction b and back in
+        # direction a; trains are dispatched from the first station every headway and leave
+        # service when they are back
+        self.num_positions = 2 * self.num_stations + 1
+        self.hop_ms = int(Line.hop_time.total_seconds() * 1000)
+        self.round_trip_ms = (self.num_positions - 1) * self.hop_ms
+        if num_trains is None:
+            # Enough trains for the busiest hour of the schedule, plus a spare
+            num_trains = -(-self.round_trip_ms // self.schedule.min_headway_ms(color.name)) + 1
+        self.num_trains = num_trains
 
-        station_data = station_df[station_df["station_name"] == stations[0]]
-        line = [
-            Station(station_data["station_id"].unique()[0], stations[0], self.color)
+        # Heap of (due time in ms, sequence number, kind, train): the next move of every train in
+        # service and the next dispatch; the sequence number keeps simultaneous events in order
+        self.events = []
+        self.sequence = itertools.count()
+        self.trains = [
+            Train(f"{self.color.name[0].upper()}L{str(train_id).zfill(3)}", Train.states.out_of_service)
+            for train_id in range(self.num_trains)
         ]
-        prev_station = line[0]
-        for station in stations[1:]:
-            station_data = station_df[station_df["station_name"] == station]
+        self.yard = collections.deque(self.trains)
+        # The train at every position of the round trip, and the trains held behind an occupied
+        # position (by the position they wait for); a station has room for one train per direction
+        self.occupants = [None] * self.num_positions
+        self.waiting = {}
+
+        # Lines of other networks than the default one are told apart by their topic prefix
+        metric = f"simulation.line.{self.color.name}"
+        if self.topics.prefix != config.DEFAULT_TOPICS.prefix:
+            metric = f"simulation.line.{self.topics.prefix}.{self.color.name}"
+        self.tick_latency = registry.histogram(f"{metric}.tick")
+        self.turnstiles_latency = registry.histogram(f"{metric}.turnstiles")
+        self.trains_latency = registry.histogram(f"{metric}.trains")
+        self.train_events = registry.meter(f"{metric}.train_events")
+        self.missed_dispatches = registry.counter(f"{metric}.missed_dispatches")
+        self.breakdowns = registry.counter(f"{metric}.breakdowns")
+        self.withdrawals = registry.counter(f"{metric}.withdrawals")
+        self.holds = registry.counter(f"{metric}.holds")
+
+        self._build_trains(Producer.to_millis(timestamp) if timestamp is not None else Producer.time_millis())
+
+    def _build_line_data(self, station_data):
+        """Constructs all stations on the line from its (station_id, station_name) pairs, in order"""
+        line = []
+        prev_station = None
+        for station_id, station_name in station_data:
             new_station = Station(
-                station_data["station_id"].unique()[0],
-                station,
-                self.color,
-                prev_station,
+                station_id, station_name, self.color, prev_station, rng=self.rng, topics=self.topics,
+                ridership_seed=self.ridership_seed,
             )
-            prev_station.dir_b = new_station
+            if prev_station is not None:
+                prev_station.dir_b = new_station
             prev_station = new_station
             line.append(new_station)
         return line
 
-    def _build_trains(self):
-        """Constructs and assigns train objects to stations"""
-        trains = []
-        curr_loc = 0
-        b_dir = True
-        for train_id in range(self.num_trains):
-            tid = str(train_id).zfill(3)
-            train = Train(
-                f"{self.color.name[0].upper()}L{tid}", Train.states.in_service
-            )
-            trains.append(train)
-
-            if b_dir:
-                self.stations[curr_loc].arrive_b(train, None, None)
-            else:
-                self.stations[curr_loc].arrive_a(train, None, None)
-            curr_loc, b_dir = self._get_next_idx(curr_loc, b_dir)
-
-        return trains
+    def _build_trains(self, timestamp_ms):
+        """Puts the trains dispatched during the last round trip on the line, schedules their moves"""
+        headway_ms = self.schedule.headway_ms(self.color.name, timestamp_ms)
+        elapsed_ms = 0
+        while elapsed_ms < self.round_trip_ms and self.yard:
+            position = elapsed_ms // self.hop_ms
+            if self.occupants[position] is not None:
+                break
+            train = self.yard.popleft()
+            train.status = Train.states.in_service
+            self._arrive(train, position, None, timestamp_ms)
+            self._schedule(timestamp_ms + self.hop_ms - elapsed_ms % self.hop_ms, Line.HOP, train)
+            elapsed_ms += headway_ms
+        self._schedule(timestamp_ms + headway_ms, Line.DISPATCH)
 
     def run(self, timestamp, time_step):
         """Advances trains between stations in the simulation. Runs turnstiles."""
-        self._advance_turnstiles(timestamp, time_step)
-        self._advance_trains()
+        start = time.perf_counter()
+        self.advance_turnstiles(timestamp, time_step)
+        turnstiles_done = time.perf_counter()
+        self.advance_trains(Producer.to_millis(timestamp + time_step))
+        end = time.perf_counter()
+
+        self.turnstiles_latency.observe(turnstiles_done - start)
+        self.trains_latency.observe(end - turnstiles_done)
+        self.tick_latency.observe(end - start)
 
     def close(self):
         """Called to stop the simulation"""
         _ = [station.close() for station in self.stations]
 
-    def _advance_turnstiles(self, timestamp, time_step):
-        """Advances the turnstiles in the simulation"""
-        _ = [station.turnstile.run(timestamp, time_step) for station in self.stations]
-
-    def _advance_trains(self):
-        """Advances trains between stations in the simulation"""
-        # Find the first b train
-        curr_train, curr_index, b_direction = self._next_train()
-        self.stations[curr_index].b_train = None
-
-        trains_advanced = 0
-        while trains_advanced < self.num_trains - 1:
-            # The train departs the current station
-            if b_direction is True:
-                self.stations[curr_index].b_train = None
-            else:
-                self.stations[curr_index].a_train = None
+    def turnstile_entries(self, timestamp, time_step):
+        """Draws the turnstile entries of every station for a time step, as time-ordered streams"""
+        return [station.turnstile.entries(timestamp, time_step) for station in self.stations]
 
-            prev_station = self.stations[curr_index].station_id
-            prev_dir = "b" if b_direction else "a"
+    def run_trains(self, timestamp, time_step):
+        """Advances the trains through a time step, recording its duration"""
+        start = time.perf_counter()
+        self.advance_trains(Producer.to_millis(timestamp + time_step))
+        self.trains_latency.observe(time.perf_counter() - start)
 
-            # Advance this train to the next station
-            curr_index, b_direction = self._get_next_idx(
-                curr_index, b_direction, step_size=1
-            )
-            if b_direction is True:
-                self.stations[curr_index].arrive_b(curr_train, prev_station, prev_dir)
-            else:
-                self.stations[curr_index].arrive_a(curr_train, prev_station, prev_dir)
+    def advance_turnstiles(self, timestamp, time_step):
+        """Advances the turnstiles in the simulation"""
+        _ = [station.turnstile.run(timestamp, time_step) for station in self.stations]
 
-            # Find the next train to advance
-            move = 1 if b_direction else -1
-            next_train, curr_index, b_direction = self._next_train(
-                curr_index + move, b_direction
-            )
-            if b_direction is True:
-                curr_train = self.stations[curr_index].b_train
+    def advance_turnstile_steps(self, timestamp, time_step, num_steps):
+        """Advances the turnstiles through `num_steps` steps from `timestamp`, all within the same hour"""
+        _ = [station.turnstile.run_steps(timestamp, time_step, num_steps) for station in self.stations]
+
+    def advance_trains(self, until_ms):
+        """Processes the train events due before `until_ms`, each at its own time"""
+        events = self.events
+        num_events = 0
+        while events and events[0][0] < until_ms:
+            due_ms, _, kind, train = heapq.heappop(events)
+            if kind == Line.HOP:
+                self._hop(train, due_ms)
             else:
-                curr_train = self.stations[curr_index].a_train
-
-            curr_train = next_train
-            trains_advanced += 1
-
-        # The last train departs the current station
-        if b_direction is True:
-            self.stations[curr_index].b_train = None
-        else:
-            self.stations[curr_index].a_train = None
-
-        # Advance last train to the next station
-        prev_station = self.stations[curr_index].station_id
-        prev_dir = "b" if b_direction else "a"
-        curr_index, b_direction = self._get_next_idx(
-            curr_index, b_direction, step_size=1
-        )
-        if b_direction is True:
-            self.stations[curr_index].arrive_b(curr_train, prev_station, prev_dir)
+                self._dispatch(due_ms)
+            num_events += 1
+        self.train_events.mark(num_events)
+
+    def next_event_ms(self):
+        """Time of the next train event, or None"""
+        return self.events[0][0] if self.events else None
+
+    def _schedule(self, due_ms, kind, train=None):
+        heapq.heappush(self.events, (due_ms, next(self.sequence), kind, train))
+
+    def _dispatch(self, timestamp_ms):
+        """Sends the next train of the yard from the first station, schedules the next dispatch"""
+        if self.yard and self.occupants[0] is None:
+            train = self.yard.popleft()
+            train.status = Train.states.in_service
+            self._arrive(train, 0, None, timestamp_ms)
+            self._schedule(timestamp_ms + self.hop_ms, Line.HOP, train)
         else:
-            self.stations[curr_index].arrive_a(curr_train, prev_station, prev_dir)
-
-    def _next_train(self, start_index=0, b_direction=True, step_size=1):
-        """Given a starting index, finds the next train in either direction"""
-        if b_direction is True:
-            curr_index = self._next_train_b(start_index, step_size)
-
-            if curr_index == -1:
-                curr_index = self._next_train_a(len(self.stations) - 1, step_size)
-                b_direction = False
+            self.missed_dispatches.inc()
+        self._schedule(timestamp_ms + self.schedule.headway_ms(self.color.name, timestamp_ms), Line.DISPATCH)
+
+    def _hop(self, train, timestamp_ms):
+        """Moves a train to the next station of its round trip, unless it has to wait or is withdrawn"""
+        if train.broken():
+            if self.train_rng.random() < self.withdraw_probability:
+                self._withdraw(train, timestamp_ms)
+                return
+            train.status = Train.states.in_service
+
+        position = train.position + 1
+        last = self.num_positions - 1
+        if position < last and self.occupants[position] is not None:
+            # The train ahead has not left the next station yet
+            self.waiting[position] = train
+            self.holds.inc()
+            return
+
+        if position < last and self.train_rng.random() < self.breakdown_probability:
+            train.status = Train.states.broken_down
+            self.breakdowns.inc()
+        self._arrive(train, position, train.position, timestamp_ms)
+        if position == last:
+            # Back at the first station: the train leaves service until it is dispatched again
+            self._leave(train, timestamp_ms)
+            train.status = Train.states.out_of_service
+            self.yard.append(train)
+        elif train.broken():
+            repair_ms = int(self.train_rng.expovariate(1.0) * self.mean_repair_time.total_seconds() * 1000)
+            self._schedule(timestamp_ms + repair_ms, Line.HOP, train)
         else:
-            curr_index = self._next_train_a(start_index, step_size)
-
-            if curr_index == -1:
-                curr_index = self._next_train_b(0, step_size)
-                b_direction = True
-
-        if b_direction is True:
-            return self.stations[curr_index].b_train, curr_index, True
-        return self.stations[curr_index].a_train, curr_index, False
-
-    def _next_train_b(self, start_index, step_size):
-        """Finds the next train in the b direction, if any"""
-        for i in range(start_index, len(self.stations), step_size):
-            if self.stations[i].b_train is not None:
-                return i
-        return -1
-
-    def _next_train_a(self, start_index, step_size):
-        """Finds the next train in the a direction, if any"""
-        for i in range(start_index, 0, -step_size):
-            if self.stations[i].a_train is not None:
-                return i
-        return -1
-
-    def _get_next_idx(self, curr_index, b_direction, step_size=None):
-        """Calculates the next station index. Returns next index and if it is b direction"""
-        if step_size is None:
-            step_size = int((self.num_stations * Line.num_directions) / self.num_trains)
-        if b_direction is True:
-            next_index = curr_index + step_size
-            if next_index < self.num_stations:
-                return next_index, True
-            else:
-                return self.num_stations - (next_index % self.num_stations), False
+            self._schedule(timestamp_ms + self.hop_ms, Line.HOP, train)
+
+    def _withdraw(self, train, timestamp_ms):
+        """Takes a broken-down train off the line, back to the yard"""
+        self.withdrawals.inc()
+        self._leave(train, timestamp_ms)
+        train.status = Train.states.out_of_service
+        self.yard.append(train)
+
+    def _leave(self, train, timestamp_ms):
+        """Removes a train from its position; the train held behind it (if any) moves up next"""
+        position = train.position
+        index, direction = self._location(position)
+        station = self.stations[index]
+        if direction == "b":
+            if station.b_train is train:
+                station.b_train = None
+        elif station.a_train is train:
+            station.a_train = None
+        if self.occupants[position] is train:
+            self.occupants[position] = None
+        train.position = None
+
+        follower = self.waiting.pop(position, None)
+        if follower is not None:
+            self._schedule(timestamp_ms + self.hop_ms, Line.HOP, follower)
+
+    def _location(self, position):
+        """Station index and direction of a position in the round trip"""
+        if position < self.num_stations:
+            return position, "b"
+        return 2 * self.num_stations - position, "a"
+
+    def _arrive(self, train, position, prev_position, timestamp_ms):
+        """Moves a train from its previous position (if any), reports its arrival"""
+        prev_station_id = prev_direction = None
+        if prev_position is not None:
+            prev_index, prev_direction = self._location(prev_position)
+            prev_station_id = self.stations[prev_index].station_id
+            # The train departs its previous station
+            self._leave(train, timestamp_ms)
+
+        train.position = position
+        self.occupants[position] = train
+        index, direction = self._location(position)
+        if direction == "b":
+            self.stations[index].arrive_b(train, prev_station_id, prev_direction, timestamp_ms)
         else:
-            next_index = curr_index - step_size
-            if next_index > 0:
-                return next_index, False
-            else:
-                return abs(next_index), True
+            self.stations[index].arrive_a(train, prev_station_id, prev_direction, timestamp_ms)
 
     def __str__(self):
         return "\n".join(str(station) for station in self.stations)
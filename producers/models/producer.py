@@ -1,21 +1,40 @@
 """Producer base-class providing common utilities and functionality"""
+import datetime
+import functools
 import logging
+from pathlib import Path
 import socket
+import threading
 import time
 
 import config
-from confluent_kafka import avro
-from confluent_kafka.admin import AdminClient, NewTopic
-from confluent_kafka.avro import AvroProducer
+from metrics import registry
 
 logger = logging.getLogger(__name__)
 
 
+@functools.lru_cache(maxsize=None)
+def load_schema(name):
+    """Parses a schema of `producers/models/schemas` on first use, then returns the cached schema"""
+    from confluent_kafka import avro
+
+    return avro.load(f"{Path(__file__).parents[0]}/schemas/{name}")
+
+
 class Producer:
     """Defines and provides common functionality amongst Producers"""
 
     # Tracks existing topics across all Producer instances
     existing_topics = set([])
+    # When disabled, events only go to the event sinks (e.g. an event log) and never to Kafka
+    kafka_enabled = True
+    # Objects with a `write(topic, timestamp_ms, key_schema, value_schema, value)` method receiving every event
+    event_sinks = []
+    # time.monotonic() of the first event produced by any producer, for startup measurements
+    first_event_time = None
+    _first_event_lock = threading.Lock()
+    # The Kafka client shared by all producers (see `shared_client`)
+    client_instance = None
 
     def __init__(
         self,
@@ -32,40 +51,144 @@ class Producer:
         self.num_partitions = num_partitions
         self.num_replicas = num_replicas
 
-        self.client = AdminClient({'bootstrap.servers': config.BROKER_URL})
+        # Instruments are shared by all producers of the same topic
+        self.produced = registry.meter(f"producer.{self.topic_name}.messages")
+        self.produce_latency = registry.histogram(f"producer.{self.topic_name}.produce_latency")
+        self.delivery_latency = registry.histogram(f"producer.{self.topic_name}.delivery_latency")
+        self.delivery_errors = registry.counter(f"producer.{self.topic_name}.delivery_errors")
+        self.buffer_full = registry.counter(f"producer.{self.topic_name}.buffer_full")
+        self.backpressure_wait = registry.histogram(f"producer.{self.topic_name}.backpressure_wait")
+
+        self.client = None
+        self.producer = None
+        if not Producer.kafka_enabled:
+            return
 
-        self.broker_properties = {
-            'bootstrap.servers': config.BROKER_URL,
-            'group.id': 'producer-group-' + socket.gethostname(),
-            'client.id': 'producer-' + self.topic_name,
-            'compression.type': "none",
-            'enable.idempotence': "true",
-            'schema.registry.url': config.SCHEMA_REGISTRY_URL
-        }
+        # The admin client is only imported when producing to Kafka
+        from confluent_kafka.admin import NewTopic
 
         # If the topic does not already exist, try to create it
         self.topic = NewTopic(self.topic_name, num_partitions=self.num_partitions, replication_factor=self.num_replicas)
         if self.topic_name not in Producer.existing_topics:
+            from confluent_kafka.admin import AdminClient
+
+            self.client = AdminClient({'bootstrap.servers': config.BROKER_URL})
             self.create_topic()
             Producer.existing_topics.add(self.topic_name)
 
-        self.producer = AvroProducer(self.broker_properties,
-                                     default_key_schema=self.key_schema,
-                                     default_value_schema=self.value_schema
-                                     )
+        self.producer = Producer.shared_client()
+
+    @staticmethod
+    def shared_client():
+        """Returns the Kafka client of all producers of the process, created on first use
+
+        Every station, turnstile and network produces through this one connection: the schemas
+        are given with each message, and the delivery queue (and its back-pressure) is shared.
+        """
+        if Producer.client_instance is None:
+            # The Kafka clients (and the Avro stack) are only imported when producing to Kafka
+            from confluent_kafka.avro import AvroProducer
+
+            broker_properties = {
+                'bootstrap.servers': config.BROKER_URL,
+                'group.id': 'producer-group-' + socket.gethostname(),
+                'client.id': 'producer-simulation',
+                'compression.type': "none",
+                'enable.idempotence': "true",
+                'schema.registry.url': config.SCHEMA_REGISTRY_URL
+            }
+            if config.PRODUCER_STATISTICS_INTERVAL_MS > 0:
+                broker_properties['statistics.interval.ms'] = config.PRODUCER_STATISTICS_INTERVAL_MS
+                broker_properties['stats_cb'] = registry.stats_callback
+            Producer.client_instance = AvroProducer(broker_properties)
+        return Producer.client_instance
 
     def create_topic(self):
         """Creates the producer topic if it does not already exist"""
         self.client.create_topics([self.topic])
         logger.info(f"Topic creation complete: {self.topic_name}")
 
+    def produce(self, key, value):
+        """Serializes and enqueues a single event, recording produce-call latency"""
+        start = time.perf_counter()
+        if Producer.first_event_time is None:
+            with Producer._first_event_lock:
+                if Producer.first_event_time is None:
+                    Producer.first_event_time = time.monotonic()
+        for sink in Producer.event_sinks:
+            sink.write(self.topic_name, key["timestamp"], self.key_schema, self.value_schema, value)
+        if self.producer is not None:
+            if len(self.producer) >= config.PRODUCER_MAX_QUEUED:
+                self._wait_for_queue(config.PRODUCER_MAX_QUEUED)
+            while True:
+                try:
+                    self.producer.produce(
+                        topic=self.topic_name,
+                        key=key,
+                        key_schema=self.key_schema,
+                        value=value,
+                        value_schema=self.value_schema,
+                        on_delivery=self._on_delivery,
+                    )
+                    break
+                except BufferError:
+                    # The local queue is full: wait for deliveries instead of failing the tick
+                    self.buffer_full.inc()
+                    self._wait_for_queue(len(self.producer))
+            # Serve delivery reports of earlier messages without blocking
+            self.producer.poll(0)
+        self.produce_latency.observe(time.perf_counter() - start)
+        self.produced.mark()
+
+    def _wait_for_queue(self, limit):
+        """Serves delivery reports until fewer than `limit` messages are queued (back-pressure)
+
+        Warns every `PRODUCER_BACKPRESSURE_WARN_SECS` and raises BufferError once the queue has
+        not drained for `PRODUCER_BACKPRESSURE_TIMEOUT_SECS`, rather than hanging when nothing
+        gets delivered.
+        """
+        start = time.perf_counter()
+        next_warning = start + config.PRODUCER_BACKPRESSURE_WARN_SECS
+        limit = max(limit, 1)
+        try:
+            while len(self.producer) >= limit:
+                self.producer.poll(0.05)
+                now = time.perf_counter()
+                if now - start >= config.PRODUCER_BACKPRESSURE_TIMEOUT_SECS:
+                    raise BufferError(
+                        f"{len(self.producer)} messages still queued for delivery after {now - start:.1f}s "
+                        f"(producing to {self.topic_name}), are the brokers reachable?"
+                    )
+                if now >= next_warning:
+                    logger.warning("Waiting for %.1fs for deliveries before producing to %s, %s messages queued",
+                                   now - start, self.topic_name, len(self.producer))
+                    next_warning = now + config.PRODUCER_BACKPRESSURE_WARN_SECS
+        finally:
+            self.backpressure_wait.observe(time.perf_counter() - start)
+
+    def _on_delivery(self, err, msg):
+        """Delivery report callback, measures enqueue-to-ack latency"""
+        if err is not None:
+            self.delivery_errors.inc()
+            logger.debug("Delivery failed for %s: %s", self.topic_name, err)
+            return
+        _, created_ms = msg.timestamp()
+        self.delivery_latency.observe(max(time.time() * 1000 - created_ms, 0) / 1000)
+
     @staticmethod
     def time_millis():
         """Use this function to get the key for Kafka Events"""
         return int(round(time.time() * 1000))
 
+    @staticmethod
+    def to_millis(timestamp):
+        """Converts a (naive, UTC) simulation datetime into a key for Kafka Events"""
+        return int(timestamp.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
     def close(self):
         """Prepares the producer for exit by cleaning up the producer"""
         # self.client.delete_topics(list(Producer.existing_topics))  # (optional) delete the created topics on shutdown
-        self.producer.flush(timeout=1)
+        # Flushing the shared client is cheap once its queue is empty
+        if self.producer is not None:
+            self.producer.flush(timeout=1)
         logger.info("Producer close complete")
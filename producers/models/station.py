@@ -1,12 +1,10 @@
 """Methods pertaining to loading and configuring CTA "L" station data."""
 import logging
-from pathlib import Path
-
-from confluent_kafka import avro
+import sys
 
 import config
 from producers.models import Turnstile
-from producers.models.producer import Producer
+from producers.models.producer import Producer, load_schema
 
 
 logger = logging.getLogger(__name__)
@@ -15,11 +13,13 @@ logger = logging.getLogger(__name__)
 class Station(Producer):
     """Defines a single station"""
 
-    key_schema = avro.load(f"{Path(__file__).parents[0]}/schemas/arrival_key.json")
-    value_schema = avro.load(f"{Path(__file__).parents[0]}/schemas/arrival_value.json")
-
-    def __init__(self, station_id, name, color, direction_a=None, direction_b=None):
-        self.name = name
+    def __init__(
+        self, station_id, name, color, direction_a=None, direction_b=None, rng=None, topics=None,
+        ridership_seed=None,
+    ):
+        """Creates the station, producing to the `topics` of its network (default: `config.DEFAULT_TOPICS`)"""
+        self.name = sys.intern(name)
+        self.topics = topics if topics is not None else config.DEFAULT_TOPICS
         station_name = (
             self.name.lower()
             .replace("/", "_and_")
@@ -28,39 +28,40 @@ class Station(Producer):
             .replace("'", "")
         )
 
-        topic_name = config.TOPIC_NAME_ARRIVAL
+        topic_name = self.topics.arrival
         super().__init__(
             topic_name,
-            key_schema=Station.key_schema,
-            value_schema=Station.value_schema,
+            key_schema=load_schema("arrival_key.json"),
+            value_schema=load_schema("arrival_value.json"),
             num_partitions=1,  # todo
             num_replicas=1,  # todo
         )
 
         self.station_id = int(station_id)
         self.color = color
+        # Constant fields of every arrival event, resolved once
+        self.line_name = color.name
         self.dir_a = direction_a
         self.dir_b = direction_b
         self.a_train = None
         self.b_train = None
-        self.turnstile = Turnstile(self)
+        self.turnstile = Turnstile(self, rng=rng, ridership_seed=ridership_seed)
 
-    def run(self, train, direction, prev_station_id, prev_direction):
+    def run(self, train, direction, prev_station_id, prev_direction, timestamp_ms=None):
         """Simulates train arrivals at this station"""
-        self.producer.produce(
-            topic=self.topic_name,
-            key={"timestamp": self.time_millis()},
-            key_schema=self.key_schema,
+        if timestamp_ms is None:
+            timestamp_ms = self.time_millis()
+        self.produce(
+            key={"timestamp": timestamp_ms},
             value={
                 'station_id': self.station_id,
                 'train_id': train.train_id,
                 'direction': direction,
-                'line': self.color.name,
+                'line': self.line_name,
                 'train_status': train.status.name,
                 'prev_station_id': prev_station_id,
                 'prev_direction': prev_direction
             },
-            value_schema=self.value_schema
         )
 
     def __str__(self):
@@ -76,15 +77,15 @@ class Station(Producer):
     def __repr__(self):
         return str(self)
 
-    def arrive_a(self, train, prev_station_id, prev_direction):
+    def arrive_a(self, train, prev_station_id, prev_direction, timestamp_ms=None):
         """Denotes a train arrival at this station in the 'a' direction"""
         self.a_train = train
-        self.run(train, "a", prev_station_id, prev_direction)
+        self.run(train, "a", prev_station_id, prev_direction, timestamp_ms)
 
-    def arrive_b(self, train, prev_station_id, prev_direction):
+    def arrive_b(self, train, prev_station_id, prev_direction, timestamp_ms=None):
         """Denotes a train arrival at this station in the 'b' direction"""
         self.b_train = train
-        self.run(train, "b", prev_station_id, prev_direction)
+        self.run(train, "b", prev_station_id, prev_direction, timestamp_ms)
 
     def close(self):
         """Prepares the producer for exit by cleaning up the producer"""
@@ -11,9 +11,13 @@ class Train:
 
     states = IntEnum("status", "out_of_service in_service broken_down", start=0)
 
+    __slots__ = ("train_id", "status", "position")
+
     def __init__(self, train_id, status):
         self.train_id = train_id
         self.status = status
+        # Index in the round trip of the line while in service
+        self.position = None
         if self.status is None:
             self.status = Train.states.out_of_service
 
@@ -1,11 +1,7 @@
 """Creates a turnstile data producer"""
 import logging
-from pathlib import Path
 
-from confluent_kafka import avro
-
-import config
-from producers.models.producer import Producer
+from producers.models.producer import Producer, load_schema
 from producers.models.turnstile_hardware import TurnstileHardware
 
 
@@ -15,11 +11,8 @@ logger = logging.getLogger(__name__)
 class Turnstile(Producer):
     """Defines turnstile for a single station"""
 
-    key_schema = avro.load(f"{Path(__file__).parents[0]}/schemas/turnstile_key.json")
-    value_schema = avro.load(f"{Path(__file__).parents[0]}/schemas/turnstile_value.json")
-
-    def __init__(self, station):
-        """Create the Turnstile"""
+    def __init__(self, station, rng=None, ridership_seed=None):
+        """Create the Turnstile, on the turnstile topic of its station's network"""
         station_name = (
             station.name.lower()
             .replace("/", "_and_")
@@ -28,29 +21,54 @@ class Turnstile(Producer):
             .replace("'", "")
         )
 
-        topic_name = config.TOPIC_NAME_TURNSTILE
+        topic_name = station.topics.turnstile
         super().__init__(
             topic_name,
-            key_schema=Turnstile.key_schema,
-            value_schema=Turnstile.value_schema,
+            key_schema=load_schema("turnstile_key.json"),
+            value_schema=load_schema("turnstile_value.json"),
             num_partitions=1,  # todo
             num_replicas=1,  # todo
         )
         self.station = station
-        self.turnstile_hardware = TurnstileHardware(station)
+        # The value is the same for every entry of this station, so it is built once
+        self.value = {
+            'station_id': station.station_id,
+            'station_name': station.name,
+            'line': station.color
+        }
+        self.turnstile_hardware = TurnstileHardware(station, rng=rng, ridership_seed=ridership_seed)
+
+    def entries(self, timestamp, time_step):
+        """Draws the entries of a time step, returns their (timestamp_ms, turnstile) pairs in time order
+
+        The number of entries is drawn right away, the pairs are generated as they are consumed.
+        """
+        num_entries = self.turnstile_hardware.get_entries(timestamp, time_step)
+        # Event times are spread evenly over the simulated time step
+        start_ms = self.to_millis(timestamp)
+        step_ms = int(time_step.total_seconds() * 1000)
+        return ((start_ms + i * step_ms // num_entries, self) for i in range(num_entries))
+
+    def emit(self, timestamp_ms):
+        """Produces a single entry"""
+        self.produce(key={"timestamp": timestamp_ms}, value=self.value)
 
     def run(self, timestamp, time_step):
         """Simulates riders entering through the turnstile."""
-        num_entries = self.turnstile_hardware.get_entries(timestamp, time_step)
-        for _ in range(num_entries):
-            self.producer.produce(
-                topic=self.topic_name,
-                key={"timestamp": self.time_millis()},
-                key_schema=self.key_schema,
-                value={
-                    'station_id': self.station.station_id,
-                    'station_name': self.station.name,
-                    'line': self.station.color
-                },
-                value_schema=self.value_schema
-            )
+        for timestamp_ms, _ in self.entries(timestamp, time_step):
+            self.emit(timestamp_ms)
+
+    def run_steps(self, timestamp, time_step, num_steps):
+        """Simulates `num_steps` steps from `timestamp` at once, all of them within the same hour
+
+        The entries are those of `run` step by step; the steps without any are skipped.
+        """
+        hour_start = timestamp.replace(minute=0, second=0, microsecond=0)
+        first = (timestamp - hour_start) // time_step
+        counts = self.turnstile_hardware.hour_entries(hour_start, time_step)[first:first + num_steps]
+        start_ms = self.to_millis(timestamp)
+        step_ms = int(time_step.total_seconds() * 1000)
+        for num_entries in counts:
+            for i in range(num_entries):
+                self.emit(start_ms + i * step_ms // num_entries)
+            start_ms += step_ms
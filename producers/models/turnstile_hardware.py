@@ -1,66 +1,182 @@
+import csv
+import datetime
 import logging
 import math
+import os
 from pathlib import Path
 import random
 
-import pandas as pd
-
 # from producers.models.producer import Producer
 
 
 logger = logging.getLogger(__name__)
 
 
+class RidershipTables:
+    """Lookup tables built from the ridership CSVs, never modified once built
+
+    `hour_ratios` maps the hour to its ridership ratio, `station_rides` maps every ridership seed
+    file to its station_id -> (weekday, saturday, sunday/holiday) average rides, and `mtimes` holds
+    the modification times of the files they were read from.
+    """
+
+    __slots__ = ("hour_ratios", "station_rides", "mtimes")
+
+    def __init__(self, hour_ratios, station_rides, mtimes):
+        self.hour_ratios = hour_ratios
+        self.station_rides = station_rides
+        self.mtimes = mtimes
+
+
+def read_hour_ratios(path):
+    """Returns the ridership ratio of every hour of the day"""
+    with open(path, newline="") as f:
+        ratios = {int(row["hour"]): float(row["ridership_ratio"]) for row in csv.DictReader(f)}
+    missing = [hour for hour in range(24) if ratios.get(hour) is None]
+    if missing:
+        raise ValueError(f"{path} has no ridership ratio for the hours {missing}")
+    return [ratios[hour] for hour in range(24)]
+
+
+def read_station_rides(path):
+    """Returns station_id -> (weekday, saturday, sunday/holiday) average rides"""
+    station_rides = {}
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            # The first row of a station is the one used
+            station_rides.setdefault(int(row["station_id"]), (
+                int(round(float(row["avg_weekday_rides"]))),
+                int(round(float(row["avg_saturday_rides"]))),
+                int(round(float(row["avg_sunday-holiday_rides"]))),
+            ))
+    return station_rides
+
+
 class TurnstileHardware:
-    curve_df = None
-    seed_df = None
+    # The current lookup tables, read from the ridership CSVs on first use. Reloading builds new
+    # tables and swaps them in with a single assignment (see `reload`), and every hardware reads
+    # the current ones when it draws an hour, so a swap takes effect at the next hour of every station.
+    tables = None
+    ridership_curve = str(Path(__file__).parents[1] / "data" / "ridership_curve.csv")
+    ridership_seed = str(Path(__file__).parents[1] / "data" / "ridership_seed.csv")
+    # ridership seed file -> ids of the stations reading it, which a reloaded file must still have
+    stations_in_use = {}
+
+    # Random offset added to every step's entries
+    noise = range(-5, 5)
+    # The entries of every simulated hour are drawn at once, see `hour_entries`
+    hour = datetime.timedelta(hours=1)
+    epoch = datetime.datetime(1970, 1, 1)
 
-    def __init__(self, station):
-        """Create the Turnstile"""
+    def __init__(self, station, rng=None, ridership_seed=None):
+        """Create the Turnstile, with the rides of its station in `ridership_seed` (default: the CTA's)"""
         self.station = station
-        TurnstileHardware._load_data()
-        self.metrics_df = TurnstileHardware.seed_df[
-            TurnstileHardware.seed_df["station_id"] == station.station_id
-        ]
-        self.weekday_ridership = int(
-            round(self.metrics_df.iloc[0]["avg_weekday_rides"])
-        )
-        self.saturday_ridership = int(
-            round(self.metrics_df.iloc[0]["avg_saturday_rides"])
-        )
-        self.sunday_ridership = int(
-            round(self.metrics_df.iloc[0]["avg_sunday-holiday_rides"])
-        )
+        self.station_id = station.station_id
+        # Any `random.Random`-like generator, defaults to the shared global one. It only seeds the
+        # generators of this station's hours, so that each hour can be drawn on its own.
+        rng = rng if rng is not None else random
+        self.seed = rng.getrandbits(64)
+        # (start, time step) of the hour last drawn, and the entries of its steps
+        self.drawn_hour = None
+        self.hour_counts = None
+        self.ridership_seed = str(ridership_seed or TurnstileHardware.ridership_seed)
+        TurnstileHardware._load_data(self.ridership_seed)
+        if self.station_id not in TurnstileHardware.tables.station_rides[self.ridership_seed]:
+            raise KeyError(f"No ridership for station {self.station_id} in {self.ridership_seed}")
+        TurnstileHardware.stations_in_use.setdefault(self.ridership_seed, set()).add(self.station_id)
+
+    @classmethod
+    def _load_data(cls, ridership_seed):
+        """Reads the hourly curve and the rides of a seed file, unless they are already loaded"""
+        tables = cls.tables
+        if tables is not None and ridership_seed in tables.station_rides:
+            return
+        if tables is None:
+            curve = cls.ridership_curve
+            tables = RidershipTables(read_hour_ratios(curve), {}, {curve: os.stat(curve).st_mtime_ns})
+        # Added as new tables as well, so that the current ones never change
+        station_rides = dict(tables.station_rides)
+        station_rides[ridership_seed] = read_station_rides(ridership_seed)
+        mtimes = dict(tables.mtimes)
+        mtimes[ridership_seed] = os.stat(ridership_seed).st_mtime_ns
+        cls.tables = RidershipTables(tables.hour_ratios, station_rides, mtimes)
+
+    @classmethod
+    def changed_files(cls):
+        """The ridership files modified since the current tables were built"""
+        if cls.tables is None:
+            return []
+        changed = []
+        for path, mtime in cls.tables.mtimes.items():
+            try:
+                if os.stat(path).st_mtime_ns != mtime:
+                    changed.append(path)
+            except OSError:
+                # Being replaced: checked again next time
+                pass
+        return changed
 
     @classmethod
-    def _load_data(cls):
-        if cls.curve_df is None:
-            cls.curve_df = pd.read_csv(
-                f"{Path(__file__).parents[1]}/data/ridership_curve.csv"
-            )
-        if cls.seed_df is None:
-            cls.seed_df = pd.read_csv(
-                f"{Path(__file__).parents[1]}/data/ridership_seed.csv"
-            )
+    def reload(cls):
+        """Re-reads all ridership files and swaps the new tables in, returns them
+
+        The new tables are complete and validated before they replace the current ones: a file
+        that cannot be read, or a seed file without the rides of a station in use, raises and
+        leaves the current tables in place.
+        """
+        current = cls.tables
+        paths = list(current.station_rides) if current is not None else [cls.ridership_seed]
+        mtimes = {path: os.stat(path).st_mtime_ns for path in [cls.ridership_curve] + paths}
+        hour_ratios = read_hour_ratios(cls.ridership_curve)
+        station_rides = {path: read_station_rides(path) for path in paths}
+        for path, rides in station_rides.items():
+            missing = cls.stations_in_use.get(path, set()).difference(rides)
+            if missing:
+                raise ValueError(f"{path} has no ridership for the stations {sorted(missing)[:10]}")
+        cls.tables = RidershipTables(hour_ratios, station_rides, mtimes)
+        return cls.tables
 
     def get_entries(self, timestamp, time_step):
         """Returns the number of turnstile entries for the given timeframe"""
-        hour_curve = TurnstileHardware.curve_df[
-            TurnstileHardware.curve_df["hour"] == timestamp.hour
-        ]
-        ratio = hour_curve.iloc[0]["ridership_ratio"]
+        hour_start = timestamp.replace(minute=0, second=0, microsecond=0)
+        return self.hour_entries(hour_start, time_step)[(timestamp - hour_start) // time_step]
+
+    def hour_entries(self, hour_start, time_step):
+        """Returns the entries of the steps of an hour, the step starting at `t` at `(t - hour_start) // time_step`
+
+        The hour is drawn at once, from a generator seeded with the station's seed and the hour:
+        its entries do not depend on the steps drawn before, so that the steps of an hour can be
+        drawn together, or skipped, in any mode (see `producers.discrete`) with the same result.
+        """
+        if self.drawn_hour != (hour_start, time_step):
+            num_entries = self._expected_entries(hour_start, time_step)
+            hour_number = (hour_start - TurnstileHardware.epoch) // TurnstileHardware.hour
+            rng = random.Random((self.seed << 32) + hour_number)
+            num_steps = -(-TurnstileHardware.hour // time_step)
+            # Introduce some randomness in the data
+            self.hour_counts = [
+                max(num_entries + noise, 0) for noise in rng.choices(TurnstileHardware.noise, k=num_steps)
+            ]
+            self.drawn_hour = (hour_start, time_step)
+        return self.hour_counts
+
+    def _expected_entries(self, timestamp, time_step):
+        """Returns the number of entries of a step of the given hour, before noise"""
+        tables = TurnstileHardware.tables
+        ratio = tables.hour_ratios[timestamp.hour]
+        weekday_ridership, saturday_ridership, sunday_ridership = (
+            tables.station_rides[self.ridership_seed][self.station_id]
+        )
         total_steps = int(60 / (60 / time_step.total_seconds()))
 
         num_riders = 0
         dow = timestamp.weekday()
         if dow >= 0 or dow < 5:
-            num_riders = self.weekday_ridership
+            num_riders = weekday_ridership
         elif dow == 6:
-            num_riders = self.saturday_ridership
+            num_riders = saturday_ridership
         else:
-            num_riders = self.sunday_ridership
+            num_riders = sunday_ridership
 
         # Calculate approximation of number of entries for this simulation step
-        num_entries = int(math.floor(num_riders * ratio / total_steps))
-        # Introduce some randomness in the data
-        return max(num_entries + random.choice(range(-5, 5)), 0)
+        return int(math.floor(num_riders * ratio / total_steps))
@@ -2,15 +2,11 @@
 from enum import IntEnum
 import json
 import logging
-from pathlib import Path
 import random
 import urllib.parse
 
-import requests
-from confluent_kafka import avro
-
 import config
-from producers.models.producer import Producer
+from producers.models.producer import Producer, load_schema
 
 
 logger = logging.getLogger(__name__)
@@ -25,22 +21,21 @@ class Weather(Producer):
 
     rest_proxy_url = config.REST_PROXY_URL
 
-    key_schema = avro.load(f"{Path(__file__).parents[0]}/schemas/weather_key.json")
-    value_schema = avro.load(f"{Path(__file__).parents[0]}/schemas/weather_value.json")
-
     winter_months = set((0, 1, 2, 3, 10, 11))
     summer_months = set((6, 7, 8))
 
-    def __init__(self, month):
-        topic_name = config.TOPIC_NAME_WEATHER
+    def __init__(self, month, rng=None, topics=None):
+        topic_name = (topics if topics is not None else config.DEFAULT_TOPICS).weather
         super().__init__(
             topic_name,
-            key_schema=Weather.key_schema,
-            value_schema=Weather.value_schema,
+            key_schema=load_schema("weather_key.json"),
+            value_schema=load_schema("weather_value.json"),
             num_partitions=1,  # todo
             num_replicas=1,  # todo
         )
 
+        # Any `random.Random`-like generator, defaults to the shared global one
+        self.rng = rng if rng is not None else random
         self.status = Weather.status.sunny
         self.temp = 70.0
         if month in Weather.winter_months:
@@ -55,20 +50,36 @@ class Weather(Producer):
             mode = -1.0
         elif month in Weather.summer_months:
             mode = 1.0
-        self.temp += min(max(-20.0, random.triangular(-10.0, 10.0, mode)), 100.0)
-        self.status = random.choice(list(Weather.status))
+        self.temp += min(max(-20.0, self.rng.triangular(-10.0, 10.0, mode)), 100.0)
+        self.status = self.rng.choice(list(Weather.status))
 
-    def run(self, month):
+    def run(self, month, timestamp_ms=None):
         self._set_weather(month)
+        if timestamp_ms is None:
+            timestamp_ms = self.time_millis()
+        for sink in Producer.event_sinks:
+            sink.write(
+                self.topic_name,
+                timestamp_ms,
+                self.key_schema,
+                self.value_schema,
+                {'temperature': int(self.temp), 'status': self.status.name},
+            )
+        if not Producer.kafka_enabled:
+            return
+
+        # Only needed when producing to Kafka
+        import requests
+
         resp = requests.post(
             url=f"{Weather.rest_proxy_url}/topics/{self.topic_name}",
             headers={"Content-Type": "application/vnd.kafka.avro.v2+json"},
             data=json.dumps(
                 {
-                    'key_schema': str(Weather.key_schema),
-                    'value_schema': str(Weather.value_schema),
+                    'key_schema': str(self.key_schema),
+                    'value_schema': str(self.value_schema),
                     'records': [
-                        {'key': {'timestamp': self.time_millis()},
+                        {'key': {'timestamp': timestamp_ms},
                          'value': {'temperature': self.temp, 'status': self.status.name}}
                     ]
                 }
@@ -0,0 +1,72 @@
+"""Independent transit networks simulated side by side in one process
+
+A network is a station table, the ridership of its stations and a topic namespace. Every network
+gets its own lines, trains and weather, producing to its own topics, while all of them share the
+producer connection (see `Producer.shared_client`), the ridership tables and the simulation loop.
+Networks are described in a JSON file, a list of objects such as:
+
+    [
+        {"name": "cta"},
+        {"name": "cta-replica", "topic_prefix": "org.replica", "seed": 7},
+        {"name": "metro", "topic_prefix": "org.metro", "stations": "metro_stations.csv",
+         "ridership_seed": "metro_ridership.csv"}
+    ]
+
+Relative paths are relative to the JSON file. Station tables have the columns of
+`cta_stations.csv` (lines are still red, blue and green), and every station_id needs a row in the
+ridership seed file.
+"""
+import json
+import logging
+from pathlib import Path
+
+import config
+from producers.stations import STATIONS_CSV, line_stations
+
+
+logger = logging.getLogger(__name__)
+
+
+class Network:
+    """The station table, ridership and topics of one simulated network"""
+
+    def __init__(self, name, topic_prefix=None, stations=STATIONS_CSV, ridership_seed=None, seed=None):
+        """`seed` gives the network random draws of its own, otherwise they derive from the simulation seed"""
+        self.name = name
+        self.topics = config.Topics(topic_prefix) if topic_prefix is not None else config.DEFAULT_TOPICS
+        self.stations = str(stations)
+        # None: the CTA ridership (see `TurnstileHardware`)
+        self.ridership_seed = str(ridership_seed) if ridership_seed is not None else None
+        self.seed = seed
+
+    @property
+    def has_default_stations(self):
+        """Whether the station table is the one loaded into Postgres (and read by Kafka Connect)"""
+        return Path(self.stations).resolve() == Path(STATIONS_CSV).resolve()
+
+    def line_stations(self):
+        return line_stations(self.stations)
+
+    def __repr__(self):
+        return f"Network({self.name!r}, {self.topics.prefix!r})"
+
+
+def load_networks(path):
+    """Reads the networks of a JSON file (see the module documentation)"""
+    base = Path(path).parent
+    with open(path) as f:
+        definitions = json.load(f)
+
+    networks = []
+    for definition in definitions:
+        definition = dict(definition)
+        for key in ("stations", "ridership_seed"):
+            if definition.get(key) is not None:
+                definition[key] = base / definition[key]
+        networks.append(Network(**definition))
+
+    prefixes = [network.topics.prefix for network in networks]
+    if len(set(prefixes)) != len(prefixes):
+        raise ValueError(f"Networks need distinct topic prefixes, got {prefixes}")
+    logger.info("Loaded %s networks: %s", len(networks), ", ".join(map(repr, networks)))
+    return networks
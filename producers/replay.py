@@ -0,0 +1,345 @@
+"""Replays a recorded event log into Kafka, or directly into the dashboard models
+
+Kafka mode publishes the recorded Avro payloads as they are (only the Confluent wire-format
+header is prepended), from several producer threads. All events of one partition are handled by
+the same thread, so per-partition ordering is kept. Direct mode bypasses Kafka and feeds the
+consumer models, which isolates their throughput from the rest of the pipeline.
+"""
+import argparse
+import collections
+import json
+import logging
+from logging import config as logging_config
+from pathlib import Path
+import queue
+import struct
+import threading
+import time
+
+# Import logging before models to ensure configuration is picked up
+logging_config.fileConfig(f"{Path(__file__).parents[0]}/logging.ini")
+
+from confluent_kafka import Producer as KafkaProducer
+from confluent_kafka.avro import CachedSchemaRegistryClient
+
+import config
+from metrics import registry
+from producers.event_log import EventLogReader
+from producers.stations import STATIONS_CSV, transformed_stations
+
+
+logger = logging.getLogger(__name__)
+
+
+# Confluent wire format: magic byte followed by the schema registry id
+WIRE_HEADER = struct.Struct(">bI")
+
+
+def encode_long(value):
+    """Encodes an Avro long (zig-zag varint)"""
+    value = (value << 1) ^ (value >> 63)
+    out = bytearray()
+    while value & ~0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def decode_leading_int(payload):
+    """Decodes the Avro int/long the payload starts with (i.e. the first field of a record)"""
+    result = 0
+    shift = 0
+    for byte in payload:
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            break
+        shift += 7
+    return (result >> 1) ^ -(result & 1)
+
+
+def is_timestamp_key(schema):
+    """Checks that the key schema is the `{"timestamp": long}` record used by all producers"""
+    fields = getattr(schema, "fields", None) or []
+    return len(fields) == 1 and fields[0].name == "timestamp" and str(fields[0].type) == '"long"'
+
+
+class Pacer:
+    """Sleeps as needed to hold a target event rate (0 = unthrottled)"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.start = time.monotonic()
+        self.sent = 0
+
+    def wait(self, num_events):
+        self.sent += num_events
+        if not self.rate:
+            return
+        delay = self.start + self.sent / self.rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class KafkaReplayer:
+    """Publishes an event log to Kafka from multiple producer threads"""
+
+    def __init__(self, reader, num_threads=4, rate=0, batch_size=1000):
+        self.reader = reader
+        self.num_threads = num_threads
+        self.rate = rate
+        # Small batches for low target rates keep the pacing smooth
+        self.batch_size = max(1, min(batch_size, int(rate / 100))) if rate else batch_size
+        self.schema_registry = CachedSchemaRegistryClient({"url": config.SCHEMA_REGISTRY_URL})
+        self.metadata_producer = KafkaProducer({"bootstrap.servers": config.BROKER_URL})
+        self.published = registry.meter("replay.kafka.messages")
+        # Exceptions of the producer threads, re-raised by `run`
+        self.errors = []
+        # stream id -> (topic, num partitions, key header, value header, partition by station)
+        self.routes = {}
+
+    def _route(self, stream_id):
+        stream = self.reader.streams[stream_id]
+        if not is_timestamp_key(stream.key_schema):
+            raise ValueError(f"Unsupported key schema for {stream.topic}: {stream.key_schema}")
+        key_id = self.schema_registry.register(f"{stream.topic}-key", stream.key_schema)
+        value_id = self.schema_registry.register(f"{stream.topic}-value", stream.value_schema)
+
+        metadata = self.metadata_producer.list_topics(stream.topic, timeout=10)
+        num_partitions = max(len(metadata.topics[stream.topic].partitions), 1)
+        by_station = stream.value_schema.fields[0].name == "station_id"
+        route = (
+            stream.topic,
+            num_partitions,
+            WIRE_HEADER.pack(0, key_id),
+            WIRE_HEADER.pack(0, value_id),
+            by_station,
+        )
+        self.routes[stream_id] = route
+        logger.info("Replaying %s into %s partition(s)", stream.topic, num_partitions)
+        return route
+
+    def _worker(self, index, batches):
+        """Produces the batches of its queue; a failure is kept for `run` and ends the thread"""
+        try:
+            self._produce_batches(index, batches)
+        except Exception as e:
+            logger.exception("Replay thread %s failed", index)
+            self.errors.append(e)
+
+    def _produce_batches(self, index, batches):
+        producer = KafkaProducer({
+            "bootstrap.servers": config.BROKER_URL,
+            "client.id": f"replay-{index}",
+            "enable.idempotence": True,
+            "linger.ms": 20,
+        })
+        while True:
+            batch = batches.get()
+            if batch is None:
+                break
+            for topic, partition, key, value in batch:
+                while True:
+                    try:
+                        producer.produce(topic, value, key, partition=partition)
+                        break
+                    except BufferError:
+                        producer.poll(0.1)
+            producer.poll(0)
+            self.published.mark(len(batch))
+        remaining = producer.flush(30)
+        if remaining > 0:
+            raise RuntimeError(f"{remaining} messages of replay thread {index} were not delivered")
+
+    def _put(self, batches, item):
+        """Queues a batch for a producer thread, unless a thread has failed (then nothing drains the queue)"""
+        while True:
+            if self.errors:
+                raise RuntimeError("Replay aborted, a producer thread failed") from self.errors[0]
+            try:
+                batches.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def run(self):
+        """Publishes the whole log, returns the number of events"""
+        queues = [queue.Queue(maxsize=8) for _ in range(self.num_threads)]
+        threads = [
+            threading.Thread(target=self._worker, args=(i, q), name=f"replay-{i}", daemon=True)
+            for i, q in enumerate(queues)
+        ]
+        _ = [thread.start() for thread in threads]
+
+        pacer = Pacer(self.rate)
+        batches = [[] for _ in range(self.num_threads)]
+        num_events = 0
+        for stream_id, timestamp_ms, payload in self.reader.frames():
+            route = self.routes.get(stream_id)
+            if route is None:
+                route = self._route(stream_id)
+            topic, num_partitions, key_header, value_header, by_station = route
+
+            partition = decode_leading_int(payload) % num_partitions if by_station else 0
+            worker = (stream_id * 31 + partition) % self.num_threads
+            batch = batches[worker]
+            batch.append((topic, partition, key_header + encode_long(timestamp_ms), value_header + payload))
+            num_events += 1
+            if len(batch) >= self.batch_size:
+                self._put(queues[worker], batch)
+                batches[worker] = []
+                pacer.wait(len(batch))
+
+        for worker, batch in enumerate(batches):
+            if batch:
+                self._put(queues[worker], batch)
+            self._put(queues[worker], None)
+        _ = [thread.join() for thread in threads]
+        if self.errors:
+            raise RuntimeError("Replay incomplete, a producer thread failed") from self.errors[0]
+        return num_events
+
+
+class DirectReplayer:
+    """Feeds the events of one network of an event log straight into the consumer models, without Kafka"""
+
+    def __init__(self, reader, rate=0, topics=config.DEFAULT_TOPICS, stations=STATIONS_CSV):
+        # The consumer side is only needed in this mode
+        from consumers.consumer import LocalMessage
+        from consumers.models import Lines, TurnstileIndex, Weather
+
+        self.message_class = LocalMessage
+        self.reader = reader
+        self.rate = rate
+        self.topics = topics
+        # Events of the other networks of the log are skipped
+        self.topic_names = {topics.arrival, topics.turnstile, topics.weather}
+        self.stations = stations
+        self.lines = Lines(topics)
+        self.weather = Weather()
+        self.turnstiles = TurnstileIndex()
+        # Stands in for the KSQL turnstile summary table
+        self.turnstile_counts = collections.Counter()
+        self.handle_secs = collections.Counter()
+        self.handled = collections.Counter()
+
+    def _to_message(self, topic, timestamp_ms, value):
+        """Returns the topic's handler and the message the consumer would have received"""
+        if topic == self.topics.turnstile:
+            station_id = value["station_id"]
+            self.turnstile_counts[station_id] += 1
+            summary = json.dumps({"STATION_ID": station_id, "COUNT": self.turnstile_counts[station_id]})
+            return self._handle_turnstile, (
+                self.message_class(topic, value, key={"timestamp": timestamp_ms}, timestamp_ms=timestamp_ms),
+                self.message_class(self.topics.turnstile_summary, summary, timestamp_ms=timestamp_ms),
+            )
+        message = self.message_class(topic, value, key={"timestamp": timestamp_ms}, timestamp_ms=timestamp_ms)
+        if topic == self.topics.weather:
+            return self.weather.process_message, message
+        return self.lines.process_message, message
+
+    def _handle_turnstile(self, messages):
+        """Feeds a raw turnstile event to the windowed index, and its summary to the lines"""
+        raw, summary = messages
+        self.turnstiles.process_message(raw)
+        self.lines.process_message(summary)
+
+    def handle(self, topic, timestamp_ms, value):
+        """Applies one event to the models"""
+        if topic not in self.topic_names:
+            return
+        handler, message = self._to_message(topic, timestamp_ms, value)
+        start = time.perf_counter()
+        handler(message)
+        self.handle_secs[topic] += time.perf_counter() - start
+        self.handled[topic] += 1
+
+    def load_stations(self):
+        """Loads the station catalogue, as the server does before consuming"""
+        for station_id, station in transformed_stations(self.stations).items():
+            self.lines.process_message(
+                self.message_class(self.topics.trans_stations, json.dumps(station), key=str(station_id))
+            )
+
+    def run(self):
+        """Replays the whole log, returns the number of events"""
+        self.load_stations()
+        pacer = Pacer(self.rate)
+        num_events = 0
+        for topic, timestamp_ms, value in self.reader.events():
+            self.handle(topic, timestamp_ms, value)
+            num_events += 1
+            if self.rate:
+                pacer.wait(1)
+
+        for topic, count in sorted(self.handled.items()):
+            logger.info(
+                "%s: %s messages, %.2f us per message in the models",
+                topic, count, self.handle_secs[topic] / count * 1e6,
+            )
+        return num_events
+
+
+class ParquetReplayer:
+    """Exports an event log to Parquet files, partitioned by date and line"""
+
+    def __init__(self, reader, root):
+        from producers.columnar import ParquetSink
+
+        self.reader = reader
+        self.sink = ParquetSink(root)
+
+    def run(self):
+        """Exports the whole log, returns the number of events"""
+        # topic -> Stream, filled as the stream definitions are read
+        streams = {}
+        num_events = 0
+        try:
+            for topic, timestamp_ms, value in self.reader.events():
+                stream = streams.get(topic)
+                if stream is None:
+                    streams.update((s.topic, s) for s in self.reader.streams.values())
+                    stream = streams[topic]
+                self.sink.write(topic, timestamp_ms, stream.key_schema, stream.value_schema, value)
+                num_events += 1
+        finally:
+            self.sink.close()
+        return num_events
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replays a recorded event log")
+    parser.add_argument("event_log", help="event log recorded with `producers.simulation --record`")
+    parser.add_argument("--target", choices=("kafka", "direct", "parquet"), default="kafka",
+                        help="publish to Kafka, feed the consumer models directly or export to Parquet "
+                             "(default: kafka)")
+    parser.add_argument("--output", default="events_parquet",
+                        help="root directory of the Parquet export (default: events_parquet)")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="target events per second (default: 0 = unthrottled)")
+    parser.add_argument("--threads", type=int, default=4,
+                        help="producer threads in kafka mode (default: 4)")
+    parser.add_argument("--topic-prefix", default=config.DEFAULT_TOPICS.prefix,
+                        help="in direct mode, the network to feed into the models (default: %(default)s)")
+    parser.add_argument("--stations", default=STATIONS_CSV,
+                        help="in direct mode, the station table of that network (default: the CTA stations)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    reader = EventLogReader(args.event_log)
+    if args.target == "kafka":
+        replayer = KafkaReplayer(reader, num_threads=args.threads, rate=args.rate)
+    elif args.target == "direct":
+        replayer = DirectReplayer(reader, rate=args.rate, topics=config.Topics(args.topic_prefix), stations=args.stations)
+    else:
+        replayer = ParquetReplayer(reader, args.output)
+
+    started = time.monotonic()
+    try:
+        num_events = replayer.run()
+    finally:
+        reader.close()
+    elapsed = time.monotonic() - started
+    logger.info("Replayed %s events in %.2fs (%.0f events/s)", num_events, elapsed, num_events / max(elapsed, 1e-9))
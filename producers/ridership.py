@@ -0,0 +1,80 @@
+"""Reloads the ridership curve and seed files of a running simulation
+
+A `RidershipWatcher` is checked by the simulation between ticks. Every
+`config.RIDERSHIP_CHECK_INTERVAL_SECS` it compares the modification times of the ridership files
+with those of the tables in use and, if any changed, rebuilds all tables and swaps them in (see
+`TurnstileHardware.reload`); a SIGHUP asks for a reload at the next check regardless. A file that
+cannot be read, or lacks stations in use, is logged and the current tables stay in place until
+it changes again, so demand scenarios can be edited during a long run without a restart.
+"""
+import logging
+import os
+import signal
+import time
+
+import config
+from metrics import registry
+from producers.models.turnstile_hardware import TurnstileHardware
+
+
+logger = logging.getLogger(__name__)
+
+
+class RidershipWatcher:
+    """Swaps in new ridership tables between ticks when their files change, or on SIGHUP"""
+
+    def __init__(self, interval=config.RIDERSHIP_CHECK_INTERVAL_SECS):
+        self.interval = interval
+        self.last_check = time.monotonic()
+        self.requested = False
+        # Modification times of the last failed reload, not retried until the files change again
+        self.failed_mtimes = None
+        self.reloads = registry.counter("simulation.ridership.reloads")
+        self.reload_errors = registry.counter("simulation.ridership.reload_errors")
+
+    def install_signal_handler(self):
+        """Reloads on SIGHUP (where available); the handler only flags the request"""
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, lambda signum, frame: self.request_reload())
+
+    def request_reload(self):
+        self.requested = True
+
+    def check(self):
+        """Reloads the tables if asked to or if their files changed; returns whether they were swapped"""
+        now = time.monotonic()
+        if not self.requested and now - self.last_check < self.interval:
+            return False
+        self.last_check = now
+        requested, self.requested = self.requested, False
+        changed = TurnstileHardware.changed_files()
+        if not changed and not requested:
+            return False
+
+        mtimes = self._mtimes(changed)
+        if not requested and mtimes == self.failed_mtimes:
+            return False
+        start = time.perf_counter()
+        try:
+            TurnstileHardware.reload()
+        except (OSError, ValueError, KeyError) as e:
+            self.failed_mtimes = mtimes
+            self.reload_errors.inc()
+            logger.error("Keeping the current ridership tables, unable to reload %s: %s",
+                         ", ".join(changed) or "the ridership files", e)
+            return False
+        self.failed_mtimes = None
+        self.reloads.inc()
+        logger.info("Reloaded the ridership tables (%s) in %.1fms",
+                    ", ".join(changed) or "on request", (time.perf_counter() - start) * 1000)
+        return True
+
+    @staticmethod
+    def _mtimes(paths):
+        mtimes = {}
+        for path in paths:
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[path] = None
+        return mtimes
@@ -0,0 +1,58 @@
+"""Train schedules: the headway between train departures per line, weekday and hour"""
+import datetime
+
+
+MS_PER_HOUR = 60 * 60 * 1000
+MS_PER_DAY = 24 * MS_PER_HOUR
+# 1970-01-01, the epoch, was a Thursday
+EPOCH_WEEKDAY = 3
+
+
+class Schedule:
+    """Looks up headways in tables precomputed per line, weekday and hour
+
+    `frequencies` maps weekdays (0 = Monday) to {hour: headway}, each headway applying from its
+    hour until the next listed one (hours before the first one take the day's last headway).
+    It is either shared by all lines or given per line, as {line name: {weekday: {hour: headway}}}.
+    Days without an entry run at `default`.
+    """
+
+    def __init__(self, frequencies=None, default=datetime.timedelta(minutes=10)):
+        frequencies = frequencies or {}
+        self.default_ms = Schedule._to_ms(default)
+        if any(isinstance(key, str) for key in frequencies):
+            self.tables = {line: self._build_table(days) for line, days in frequencies.items()}
+            self.shared = self._build_table({})
+        else:
+            self.tables = {}
+            self.shared = self._build_table(frequencies)
+
+    @staticmethod
+    def _to_ms(headway):
+        return int(headway.total_seconds() * 1000)
+
+    def _build_table(self, days):
+        """Returns 7 lists of 24 headways in ms"""
+        table = []
+        for weekday in range(7):
+            hours = {int(hour): Schedule._to_ms(headway) for hour, headway in days.get(weekday, {}).items()}
+            if not hours:
+                table.append([self.default_ms] * 24)
+                continue
+            current = hours[max(hours)]
+            day = []
+            for hour in range(24):
+                current = hours.get(hour, current)
+                day.append(current)
+            table.append(day)
+        return table
+
+    def headway_ms(self, line_name, timestamp_ms):
+        """Headway in ms of a line at a (UTC) time in ms"""
+        table = self.tables.get(line_name, self.shared)
+        weekday = (timestamp_ms // MS_PER_DAY + EPOCH_WEEKDAY) % 7
+        return table[weekday][(timestamp_ms // MS_PER_HOUR) % 24]
+
+    def min_headway_ms(self, line_name):
+        """Shortest headway of a line over the week"""
+        return min(min(day) for day in self.tables.get(line_name, self.shared))
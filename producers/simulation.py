@@ -1,83 +1,368 @@
 """Defines a time simulation responsible for executing any registered
 producers
 """
+import argparse
+import asyncio
 import datetime
+import random
 import time
 from enum import IntEnum
 import logging
 from logging import config as logging_config
 from pathlib import Path
 
-import pandas as pd
+# Reference point of the startup measurements, taken before the heavier imports
+STARTED = time.monotonic()
 
 # Import logging before models to ensure configuration is picked up
 logging_config.fileConfig(f"{Path(__file__).parents[0]}/logging.ini")
 
-from producers.connector import configure_connector
+import config
+from metrics import registry
+from profiling import profiler_from_env
 from producers.models import Line, Weather
+from producers.models.producer import Producer
+from producers.network import Network, load_networks
+from producers.pacing import PacedEmitter
+from producers.schedule import Schedule
 
 
 logger = logging.getLogger(__name__)
 
 
+# Functions whose cost is reported after a profiling window
+PROFILED_FUNCTIONS = (
+    ("producers/models/turnstile_hardware.py", "get_entries"),
+    ("producers/models/turnstile.py", "run"),
+    ("producers/models/turnstile.py", "run_steps"),
+    ("producers/models/line.py", "advance_trains"),
+    ("producers/models/station.py", "run"),
+    ("producers/models/producer.py", "produce"),
+    ("producers/event_log.py", "write"),
+    ("avro/io.py", "write"),
+    ("confluent_kafka/avro/__init__.py", "produce"),
+)
+
+
 class TimeSimulation:
     weekdays = IntEnum("weekdays", "mon tue wed thu fri sat sun", start=0)
     ten_min_frequency = datetime.timedelta(minutes=10)
+    rush_hour_frequency = datetime.timedelta(minutes=5)
+    late_night_frequency = datetime.timedelta(minutes=20)
 
-    def __init__(self, sleep_seconds=5, time_step=None, schedule=None):
-        """Initializes the time simulation"""
+    def __init__(
+        self,
+        sleep_seconds=5,
+        time_step=None,
+        schedule=None,
+        metrics_file=None,
+        metrics_interval=60.0,
+        seed=None,
+        start_time=None,
+        event_log=None,
+        kafka_enabled=True,
+        stations_target=None,
+        breakdown_probability=None,
+        parquet_dir=None,
+        profiler=None,
+        networks=None,
+        watch_ridership=False,
+    ):
+        """Initializes the time simulation
+
+        With a `seed` (and a fixed `start_time`) every run produces the same events; `event_log`
+        records all of them to a local file, optionally without producing to Kafka at all.
+        With a `stations_target` ("stations" or "trans_stations") the station table is bulk-loaded
+        into that topic instead of configuring the Kafka Connect connector. `breakdown_probability`
+        overrides the chance of a train breaking down at a station (see `Line`). `parquet_dir`
+        exports all events as Parquet files (see `producers.columnar`). A `profiler` (see
+        `profiling.py`) gets a step per tick. `networks` (see `producers.network`) are simulated
+        side by side, by default the CTA network alone. With `watch_ridership` the ridership files
+        are reloaded between ticks when they change (see `producers.ridership`).
+        """
         self.sleep_seconds = sleep_seconds
+        self.metrics_file = metrics_file
+        self.metrics_interval = metrics_interval
         self.time_step = time_step
         if self.time_step is None:
             self.time_step = datetime.timedelta(minutes=self.sleep_seconds)
+        if self.time_step <= datetime.timedelta(0):
+            raise ValueError(f"The time step must be positive, got {self.time_step} (set it when sleep_seconds is 0)")
+        self.start_time = start_time
+        self.stations_target = stations_target
+        self.profiler = profiler
+        self.ridership_watcher = None
+        if watch_ridership:
+            from producers.ridership import RidershipWatcher
+
+            self.ridership_watcher = RidershipWatcher()
+            self.ridership_watcher.install_signal_handler()
+        if self.start_time is None:
+            self.start_time = datetime.datetime.utcnow().replace(
+                hour=0, minute=0, second=0, microsecond=0
+            )
 
-        # Read data from disk
-        self.raw_df = pd.read_csv(
-            f"{Path(__file__).parents[0]}/data/cta_stations.csv"
-        ).sort_values("order")
+        # Every random source gets its own generator derived from the seed, so that the
+        # sequence of draws does not depend on the order the lines are run in
+        self.rng = random.Random(seed)
 
-        # Define the train schedule (same for all trains)
+        self.event_log = None
+        if event_log is not None:
+            from producers.event_log import EventLogWriter
+
+            self.event_log = EventLogWriter(event_log)
+            Producer.event_sinks.append(self.event_log)
+        self.parquet_sink = None
+        if parquet_dir is not None:
+            from producers.columnar import ParquetSink
+
+            self.parquet_sink = ParquetSink(parquet_dir)
+            Producer.event_sinks.append(self.parquet_sink)
+        Producer.kafka_enabled = kafka_enabled
+
+        # Define the train schedule: {weekday: {hour: headway}} for all lines, or per line name
         self.schedule = schedule
         if schedule is None:
+            weekday = {
+                0: TimeSimulation.late_night_frequency,
+                5: TimeSimulation.ten_min_frequency,
+                6: TimeSimulation.rush_hour_frequency,
+                9: TimeSimulation.ten_min_frequency,
+                15: TimeSimulation.rush_hour_frequency,
+                19: TimeSimulation.ten_min_frequency,
+                22: TimeSimulation.late_night_frequency,
+            }
+            weekend = {
+                0: TimeSimulation.late_night_frequency,
+                7: TimeSimulation.ten_min_frequency,
+                22: TimeSimulation.late_night_frequency,
+            }
             self.schedule = {
-                TimeSimulation.weekdays.mon: {0: TimeSimulation.ten_min_frequency},
-                TimeSimulation.weekdays.tue: {0: TimeSimulation.ten_min_frequency},
-                TimeSimulation.weekdays.wed: {0: TimeSimulation.ten_min_frequency},
-                TimeSimulation.weekdays.thu: {0: TimeSimulation.ten_min_frequency},
-                TimeSimulation.weekdays.fri: {0: TimeSimulation.ten_min_frequency},
-                TimeSimulation.weekdays.sat: {0: TimeSimulation.ten_min_frequency},
-                TimeSimulation.weekdays.sun: {0: TimeSimulation.ten_min_frequency},
+                TimeSimulation.weekdays.mon: weekday,
+                TimeSimulation.weekdays.tue: weekday,
+                TimeSimulation.weekdays.wed: weekday,
+                TimeSimulation.weekdays.thu: weekday,
+                TimeSimulation.weekdays.fri: weekday,
+                TimeSimulation.weekdays.sat: weekend,
+                TimeSimulation.weekdays.sun: weekend,
             }
+        schedule = Schedule(self.schedule, default=TimeSimulation.ten_min_frequency)
+
+        # Every network gets its lines and its weather source; all lines run in the same loop
+        self.networks = networks if networks is not None else [Network("cta")]
+        self.train_lines = []
+        self.weathers = []
+        for network in self.networks:
+            rng = random.Random(network.seed) if network.seed is not None else self.rng
+            # Read data from disk: the ordered stations of every line, parsed once and cached
+            stations = network.line_stations()
+            self.train_lines += [
+                Line(
+                    color, stations[color.name],
+                    rng=random.Random(rng.getrandbits(64)), timestamp=self.start_time, schedule=schedule,
+                    breakdown_probability=breakdown_probability, topics=network.topics,
+                    ridership_seed=network.ridership_seed,
+                )
+                for color in (Line.colors.blue, Line.colors.red, Line.colors.green)
+                # Station tables of other networks may leave out lines
+                if stations[color.name]
+            ]
+            self.weathers.append(
+                Weather(self.start_time.month, rng=random.Random(rng.getrandbits(64)), topics=network.topics)
+            )
+
+    def _log_startup(self):
+        """Records the time from process start to the first event and to the end of the first tick"""
+        first_tick = time.monotonic() - STARTED
+        registry.gauge("simulation.startup.first_tick_secs").set(first_tick)
+        if Producer.first_event_time is not None:
+            first_event = Producer.first_event_time - STARTED
+            registry.gauge("simulation.startup.first_event_secs").set(first_event)
+            logger.info("Startup: first event after %.3fs, first tick done after %.3fs", first_event, first_tick)
+
+    def setup_stations(self):
+        """Gets the station table of every network into Kafka, by bulk-loading it or through Kafka Connect
+
+        Kafka Connect reads the CTA table of Postgres, networks of other station files are always bulk-loaded.
+        """
+        if not Producer.kafka_enabled:
+            return
+        for network in self.networks:
+            if self.stations_target is not None or not network.has_default_stations:
+                from producers.bootstrap import bootstrap_stations
+
+                target = getattr(network.topics, self.stations_target or "stations")
+                logger.info("Bulk-loading stations of %s into %s", network.name, target)
+                bootstrap_stations(target, topics=network.topics, path=network.stations)
+            else:
+                from producers.connector import configure_connector
+
+                logger.info("Loading kafka connect jdbc source connector of %s", network.name)
+                configure_connector(network.topics)
 
-        self.train_lines = [
-            Line(Line.colors.blue, self.raw_df[self.raw_df["blue"]]),
-            Line(Line.colors.red, self.raw_df[self.raw_df["red"]]),
-            Line(Line.colors.green, self.raw_df[self.raw_df["green"]]),
-        ]
+    def close(self):
+        """Flushes and closes all producers, the event log and the metrics file"""
+        if self.profiler is not None:
+            self.profiler.stop()
+        _ = [line.close() for line in self.train_lines]
+        if self.event_log is not None:
+            self.event_log.close()
+            Producer.event_sinks.remove(self.event_log)
+        if self.parquet_sink is not None:
+            self.parquet_sink.close()
+            Producer.event_sinks.remove(self.parquet_sink)
+        if self.metrics_file is not None:
+            registry.dump(self.metrics_file)
 
-    def run(self):
-        curr_time = datetime.datetime.utcnow().replace(
-            hour=0, minute=0, second=0, microsecond=0
-        )
+    def run(self, num_ticks=None):
+        """Runs the simulation until interrupted, or for `num_ticks` time steps"""
+        curr_time = self.start_time
         logger.info("Beginning simulation, press Ctrl+C to exit at any time")
-        logger.info("Loading kafka connect jdbc source connector")
-        configure_connector()
+        self.setup_stations()
 
         logger.info("Beginning cta train simulation")
-        weather = Weather(curr_time.month)
+        emitter = PacedEmitter()
+        step_ms = int(self.time_step.total_seconds() * 1000)
+        started = last_dump = time.monotonic()
+        tick = 0
         try:
-            while True:
+            while num_ticks is None or tick < num_ticks:
                 logger.debug("Simulation running: %s", curr_time.isoformat())
+                if self.profiler is not None:
+                    self.profiler.step()
                 # Send weather on the top of the hour
                 if curr_time.minute == 0:
-                    weather.run(curr_time.month)
-                _ = [line.run(curr_time, self.time_step) for line in self.train_lines]
+                    _ = [weather.run(curr_time.month, Producer.to_millis(curr_time)) for weather in self.weathers]
+                # The turnstile entries of all stations stream out over most of the tick's interval
+                emitter.emit(
+                    [entries for line in self.train_lines for entries in line.turnstile_entries(curr_time, self.time_step)],
+                    Producer.to_millis(curr_time),
+                    step_ms,
+                    self.sleep_seconds * config.TURNSTILE_PACING_FRACTION,
+                )
+                _ = [line.run_trains(curr_time, self.time_step) for line in self.train_lines]
+                if self.ridership_watcher is not None:
+                    self.ridership_watcher.check()
                 curr_time = curr_time + self.time_step
-                time.sleep(self.sleep_seconds)
+                tick += 1
+                if tick == 1:
+                    self._log_startup()
+
+                if self.metrics_file is not None and time.monotonic() - last_dump >= self.metrics_interval:
+                    registry.dump(self.metrics_file)
+                    last_dump = time.monotonic()
+                # Ticks are due at fixed intervals, the time spent emitting included
+                time.sleep(max(started + tick * self.sleep_seconds - time.monotonic(), 0))
         except KeyboardInterrupt as e:
             logger.info("Shutting down")
-            _ = [line.close() for line in self.train_lines]
+        finally:
+            self.close()
+
+    def run_async(self, num_ticks=None):
+        """Like `run`, but on the asyncio engine: lines, weather and station setup run concurrently"""
+        from producers.engine import AsyncEngine
+
+        if self.profiler is not None:
+            # cProfile and the stack sampler only see the calling thread, not the executor threads
+            raise ValueError("Profiling is not supported on the asyncio engine")
+
+        logger.info("Beginning simulation, press Ctrl+C to exit at any time")
+        try:
+            asyncio.run(AsyncEngine(self, num_ticks).run())
+        except KeyboardInterrupt:
+            logger.info("Shutting down")
+        finally:
+            self.close()
+
+    def run_discrete(self, num_ticks=None, accelerated=False):
+        """Like `run`, but event by event on the discrete-event engine, optionally without pacing"""
+        from producers.discrete import DiscreteEventEngine
+
+        logger.info("Beginning simulation, press Ctrl+C to exit at any time")
+        try:
+            DiscreteEventEngine(self, num_ticks, accelerated=accelerated).run()
+        except KeyboardInterrupt:
+            logger.info("Shutting down")
+        finally:
+            self.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Runs the CTA train simulation")
+    parser.add_argument("--metrics-file", default=None,
+                        help="periodically dump producer and simulation metrics as JSON to this file")
+    parser.add_argument("--metrics-interval", type=float, default=60.0,
+                        help="seconds between metrics dumps (default: 60)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed for all random sources, makes the generated events reproducible")
+    parser.add_argument("--start-date", type=datetime.date.fromisoformat, default=None,
+                        help="simulated start date (YYYY-MM-DD, default: today)")
+    parser.add_argument("--record", default=None,
+                        help="record every produced event to this event log file")
+    parser.add_argument("--parquet", default=None,
+                        help="export every produced event as Parquet files below this directory")
+    parser.add_argument("--no-kafka", action="store_true",
+                        help="do not produce to Kafka (only useful together with --record or --parquet)")
+    parser.add_argument("--bootstrap-stations", choices=("stations", "trans_stations"), default=None,
+                        help="bulk-load the stations into this topic instead of using Kafka Connect")
+    parser.add_argument("--sleep-seconds", type=float, default=5,
+                        help="wall-clock seconds between time steps (default: 5)")
+    parser.add_argument("--time-step-minutes", type=float, default=None,
+                        help="simulated minutes per time step (default: same as --sleep-seconds)")
+    parser.add_argument("--ticks", type=int, default=None,
+                        help="stop after this many time steps (default: run until interrupted)")
+    parser.add_argument("--breakdown-probability", type=float, default=None,
+                        help="chance of a train breaking down at a station (default: %s)" % Line.breakdown_probability)
+    parser.add_argument("--networks", default=None,
+                        help="simulate the networks of this JSON file side by side (default: the CTA network)")
+    parser.add_argument("--watch-ridership", action="store_true",
+                        help="reload the ridership curve and seed files between ticks when they change, or on SIGHUP")
+    parser.add_argument("--profile", default=None,
+                        help="profile a window of ticks, writing <PROFILE>.pstats and <PROFILE>.folded "
+                             "(also enabled by the PROFILE environment variable)")
+    parser.add_argument("--profile-skip", type=int, default=None,
+                        help="ticks to run before profiling (default: $PROFILE_SKIP or 0)")
+    parser.add_argument("--profile-window", type=int, default=None,
+                        help="ticks to profile (default: $PROFILE_WINDOW or 100)")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="run lines, weather and station setup as concurrent asyncio tasks")
+    parser.add_argument("--discrete", action="store_true",
+                        help="run event by event on the discrete-event engine")
+    parser.add_argument("--accelerated", action="store_true",
+                        help="with --discrete: run events as fast as possible instead of pacing them")
+    args = parser.parse_args()
+    if args.time_step_minutes is not None and args.time_step_minutes <= 0:
+        parser.error("--time-step-minutes must be positive")
+    if args.time_step_minutes is None and args.sleep_seconds <= 0:
+        parser.error("--sleep-seconds 0 needs an explicit --time-step-minutes")
+    return args
 
 
 if __name__ == "__main__":
-    TimeSimulation().run()
+    args = parse_args()
+    profiler = profiler_from_env(args.profile, args.profile_skip, args.profile_window, PROFILED_FUNCTIONS)
+    if profiler is not None and args.use_async:
+        logger.fatal("Profiling (--profile or PROFILE) only covers the calling thread, run it without --async")
+        exit(1)
+    simulation = TimeSimulation(
+        sleep_seconds=args.sleep_seconds,
+        time_step=datetime.timedelta(minutes=args.time_step_minutes) if args.time_step_minutes else None,
+        metrics_file=args.metrics_file,
+        metrics_interval=args.metrics_interval,
+        seed=args.seed,
+        start_time=datetime.datetime.combine(args.start_date, datetime.time()) if args.start_date else None,
+        event_log=args.record,
+        kafka_enabled=not args.no_kafka,
+        stations_target=args.bootstrap_stations,
+        breakdown_probability=args.breakdown_probability,
+        parquet_dir=args.parquet,
+        profiler=profiler,
+        networks=load_networks(args.networks) if args.networks else None,
+        watch_ridership=args.watch_ridership,
+    )
+    if args.use_async:
+        simulation.run_async(num_ticks=args.ticks)
+    elif args.discrete:
+        simulation.run_discrete(num_ticks=args.ticks, accelerated=args.accelerated)
+    else:
+        simulation.run(num_ticks=args.ticks)
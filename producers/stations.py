@@ -0,0 +1,95 @@
+"""Reads the CTA station table shipped with the simulation"""
+import csv
+import hashlib
+import logging
+from pathlib import Path
+import pickle
+
+
+logger = logging.getLogger(__name__)
+
+
+STATIONS_CSV = f"{Path(__file__).parents[0]}/data/cta_stations.csv"
+# Parsed station tables, named after the hash of the CSV they were built from
+CACHE_DIR = f"{Path(__file__).parents[0]}/data/cache"
+LINE_COLORS = ("red", "blue", "green")
+
+
+def read_station_rows(path=STATIONS_CSV):
+    """Returns the rows of the station table, typed like the `stations` table in Postgres"""
+    with open(path, newline="") as f:
+        return [
+            {
+                "stop_id": int(row["stop_id"]),
+                "direction_id": row["direction_id"],
+                "stop_name": row["stop_name"],
+                "station_name": row["station_name"],
+                "station_descriptive_name": row["station_descriptive_name"],
+                "station_id": int(row["station_id"]),
+                "order": int(row["order"]) if row["order"] else None,
+                "red": row["red"] == "TRUE",
+                "blue": row["blue"] == "TRUE",
+                "green": row["green"] == "TRUE",
+            }
+            for row in csv.DictReader(f)
+        ]
+
+
+def transform_station(row):
+    """Mirrors the Faust `TransformedStation` transformation of a raw station row"""
+    return {
+        "station_id": row["station_id"],
+        "station_name": row["station_name"],
+        "order": row["order"],
+        "line": next((color for color in LINE_COLORS if row[color]), None),
+    }
+
+
+def transformed_stations(path=STATIONS_CSV):
+    """Returns one transformed station per station_id, as the Faust table would hold them"""
+    stations = {}
+    # Kafka Connect loads rows in `stop_id` order and the table keeps the last one per station
+    for row in sorted(read_station_rows(path), key=lambda r: r["stop_id"]):
+        stations[row["station_id"]] = transform_station(row)
+    return stations
+
+
+def build_lines(rows):
+    """Returns color -> [(station_id, station_name)] in line order, in a single pass over the rows
+
+    Each line lists every station name once, with the station_id of its first row in order.
+    """
+    lines = {color: {} for color in LINE_COLORS}
+    # Stable sort: rows of equal order keep their file order
+    for row in sorted(rows, key=lambda r: (r["order"] is None, r["order"] or 0)):
+        for color in LINE_COLORS:
+            if row[color]:
+                lines[color].setdefault(row["station_name"], row["station_id"])
+    return {
+        color: [(station_id, name) for name, station_id in stations.items()]
+        for color, stations in lines.items()
+    }
+
+
+def line_stations(path=STATIONS_CSV, cache_dir=CACHE_DIR):
+    """Returns the stations of every line (see `build_lines`), cached on disk by CSV content hash"""
+    with open(path, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    cache_path = Path(cache_dir) / f"lines-{digest}.pickle"
+    try:
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+
+    lines = build_lines(read_station_rows(path))
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # Written under a temporary name first, so that concurrent readers never see a partial file
+        tmp_path = cache_path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(lines, f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_path.replace(cache_path)
+    except OSError as e:
+        logger.warning("Unable to cache the station table in %s: %s", cache_dir, e)
+    return lines
@@ -0,0 +1,151 @@
+"""Opt-in profiling of a window of simulation ticks or consumed messages
+
+A `WindowProfiler` counts units of work (ticks, messages) through `step()`. It skips the first
+`skip` units (warm-up), profiles the next `window` ones, then writes:
+
+- `<output>.pstats`: cProfile statistics, for `python -m pstats` or snakeviz;
+- `<output>.folded`: stacks of the main thread sampled every `interval` seconds of CPU time in
+  folded format (`function (file:line);... count`), for flamegraph.pl or speedscope;
+
+and logs the cost of the functions it was asked to watch. It is enabled with a command-line flag
+or the `PROFILE` environment variable (`PROFILE_SKIP`, `PROFILE_WINDOW`); when disabled none of
+this is installed and callers only test for `None`.
+"""
+import collections
+import cProfile
+import logging
+import os
+import pstats
+import signal
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+def profiler_from_env(output=None, skip=None, window=None, watch=(), default_window=100):
+    """Returns a `WindowProfiler` if profiling is asked for (arguments first, then environment), else None"""
+    output = output or os.environ.get("PROFILE")
+    if not output:
+        return None
+    if skip is None:
+        skip = int(os.environ.get("PROFILE_SKIP", 0))
+    if window is None:
+        window = int(os.environ.get("PROFILE_WINDOW", default_window))
+    return WindowProfiler(output, skip, window, watch)
+
+
+class StackSampler:
+    """Samples the main thread's stack every `interval` seconds of CPU time, counting folded stacks
+
+    A profiling timer (`ITIMER_PROF`) interrupts the main thread wherever it is, including in
+    code that never releases the GIL, and the handler walks the interrupted frame. Signals are
+    only delivered to the main thread (and `setitimer` is POSIX only), so elsewhere nothing is
+    sampled.
+    """
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.previous_handler = None
+
+    @staticmethod
+    def available():
+        return hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+
+    def start(self):
+        if not self.available():
+            logger.warning("Stack sampling needs setitimer and the main thread, no stacks will be written")
+            return
+        self.previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        if self.previous_handler is None:
+            return
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self.previous_handler)
+        self.previous_handler = None
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        if stack:
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class WindowProfiler:
+    """Profiles units `skip` to `skip + window` of the calling thread's work"""
+
+    def __init__(self, output, skip=0, window=100, watch=(), interval=0.001):
+        self.output = output
+        self.skip = skip
+        self.window = window
+        # (file name suffix, function name) pairs reported after the window
+        self.watch = watch
+        self.interval = interval
+        self.units = 0
+        self.profile = None
+        self.sampler = None
+        self.started = None
+        self.done = False
+
+    def step(self):
+        """Marks the start of a unit of work"""
+        if self.done:
+            return
+        if self.units == self.skip:
+            self._start()
+        elif self.units == self.skip + self.window:
+            self.stop()
+        self.units += 1
+
+    def wrap(self, handler):
+        """Returns a message handler that counts every message as a unit"""
+        def handle(message):
+            self.step()
+            return handler(message)
+        return handle
+
+    def _start(self):
+        logger.info("Profiling %s units to %s.*", self.window, self.output)
+        self.sampler = StackSampler(self.interval)
+        self.sampler.start()
+        self.started = time.perf_counter()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self):
+        """Ends the window early (e.g. at shutdown) and writes the results"""
+        if self.done or self.profile is None:
+            return
+        self.profile.disable()
+        elapsed = time.perf_counter() - self.started
+        self.sampler.stop()
+        self.done = True
+
+        self.profile.dump_stats(f"{self.output}.pstats")
+        self.sampler.write(f"{self.output}.folded")
+        num_units = self.units - self.skip
+        logger.info("Profiled %s units in %.3fs, wrote %s.pstats and %s.folded",
+                    num_units, elapsed, self.output, self.output)
+        self._log_watched(pstats.Stats(self.profile), num_units)
+
+    def _log_watched(self, stats, num_units):
+        """Logs calls, own and cumulative time per unit of the watched functions"""
+        for (filename, line, function), (_, num_calls, own, cumulative, _) in sorted(stats.stats.items()):
+            for suffix, name in self.watch:
+                if function == name and filename.replace(os.sep, "/").endswith(suffix):
+                    logger.info(
+                        "%-50s %8d calls %10.1f us own %10.1f us total per unit",
+                        f"{suffix}:{line}({name})", num_calls, own / num_units * 1e6, cumulative / num_units * 1e6,
+                    )
@@ -0,0 +1,19 @@
+"""Tests of the station bulk-load records"""
+import json
+
+from producers import bootstrap
+
+
+def test_keys_are_json_integers_as_faust_writes_them():
+    assert bootstrap.station_key(40380) == b"40380"
+    assert bootstrap.station_key("40380") == b"40380"
+    for key, value in bootstrap._trans_station_records(bootstrap.STATIONS_CSV):
+        assert json.loads(key) == value["station_id"]
+        assert value["__faust"] == {"ns": bootstrap.FAUST_NAMESPACE}
+
+
+def test_raw_records_are_keyed_like_the_connector():
+    records = list(bootstrap._station_records(bootstrap.STATIONS_CSV))
+    assert records
+    for key, row in records:
+        assert key == json.dumps(row["station_id"]).encode("utf-8")
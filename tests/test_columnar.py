@@ -0,0 +1,50 @@
+"""Tests of the Parquet export"""
+import pytest
+
+from producers.models.producer import load_schema
+
+
+pytest.importorskip("pyarrow")
+from producers.columnar import ParquetSink  # noqa: E402
+
+
+DAY_MS = 24 * 60 * 60 * 1000
+# 2020-01-06T23:00Z
+LATE_MONDAY_MS = 1578351600000
+
+
+def test_events_are_partitioned_by_date_and_line(tmp_path):
+    import pyarrow.dataset
+
+    sink = ParquetSink(str(tmp_path), rows_per_file=3, max_buffered_rows=100)
+    turnstile = load_schema("turnstile_value.json")
+    weather = load_schema("weather_value.json")
+    for i in range(4):
+        sink.write("turnstile", LATE_MONDAY_MS + i, None, turnstile, {"station_id": i, "station_name": "A", "line": 0})
+    # Past midnight: the next day's partition
+    sink.write("turnstile", LATE_MONDAY_MS + DAY_MS // 24, None, turnstile, {"station_id": 9, "station_name": "B", "line": 2})
+    sink.write("weather", LATE_MONDAY_MS, None, weather, {"temperature": 20, "status": "sunny"})
+    # The first three rows of the blue line make a file of their own
+    assert sink.num_files == 1
+    sink.close()
+
+    files = sorted(path.relative_to(tmp_path).parent.as_posix() for path in tmp_path.rglob("*.parquet"))
+    assert files == [
+        "turnstile/date=2020-01-06/line=blue",
+        "turnstile/date=2020-01-06/line=blue",
+        "turnstile/date=2020-01-07/line=red",
+        "weather/date=2020-01-06",
+    ]
+    table = pyarrow.dataset.dataset(str(tmp_path / "turnstile"), partitioning="hive").to_table()
+    rows = sorted(zip(table["station_id"].to_pylist(), table["line"].to_pylist(), map(str, table["date"].to_pylist())))
+    assert rows == [(0, "blue", "2020-01-06"), (1, "blue", "2020-01-06"), (2, "blue", "2020-01-06"),
+                    (3, "blue", "2020-01-06"), (9, "red", "2020-01-07")]
+
+
+def test_the_largest_buffer_is_written_when_memory_runs_out(tmp_path):
+    sink = ParquetSink(str(tmp_path), rows_per_file=100, max_buffered_rows=4)
+    turnstile = load_schema("turnstile_value.json")
+    for i, line in enumerate((0, 0, 0, 1, 2)):
+        sink.write("turnstile", LATE_MONDAY_MS + i, None, turnstile, {"station_id": i, "station_name": "A", "line": line})
+    assert [path.parent.name for path in tmp_path.rglob("*.parquet")] == ["line=blue"]
+    assert sink.num_buffered == 2
@@ -0,0 +1,57 @@
+"""Tests of the catalogue loading, with a stand-in for the Kafka consumer"""
+from consumers import consumer as consumer_module
+from consumers.consumer import LocalMessage, read_to_end
+
+
+class Message(LocalMessage):
+    __slots__ = ()
+
+    def error(self):
+        return None
+
+
+class FakeConsumer:
+    """Partitions 0 and 1 hold 5 messages, 2 is empty; only `readable` messages of partition 1 ever arrive"""
+
+    watermarks = {0: (0, 5), 1: (0, 5), 2: (3, 3)}
+    readable = 2
+
+    def __init__(self, config):
+        self.delivered = False
+
+    def list_topics(self, topic, timeout=None):
+        partitions = {partition: None for partition in FakeConsumer.watermarks}
+        return type("Metadata", (), {"topics": {topic: type("Topic", (), {"partitions": partitions})()}})()
+
+    def get_watermark_offsets(self, tp, timeout=None):
+        return FakeConsumer.watermarks[tp.partition]
+
+    def assign(self, assignment):
+        self.assignment = assignment
+
+    def consume(self, num_messages=1, timeout=None):
+        if self.delivered:
+            return []
+        self.delivered = True
+        return (
+            [Message("t", i, partition=0, offset=i) for i in range(5)]
+            + [Message("t", i, partition=1, offset=i) for i in range(FakeConsumer.readable)]
+        )
+
+    def close(self):
+        pass
+
+
+def test_timed_out_partitions_continue_after_the_last_handled_message(monkeypatch):
+    monkeypatch.setattr(consumer_module, "Consumer", FakeConsumer)
+    handled = []
+    offsets = read_to_end("t", lambda msg: handled.append((msg.partition(), msg.offset())), timeout=0.6)
+    # Partition 0 was read to its end, partition 1 stopped after offset 1, partition 2 is empty
+    assert offsets == {0: 5, 1: 2, 2: 3}
+    assert len(handled) == 7
+
+
+def test_partitions_read_to_the_end_return_their_watermarks(monkeypatch):
+    monkeypatch.setattr(consumer_module, "Consumer", FakeConsumer)
+    monkeypatch.setattr(FakeConsumer, "readable", 5)
+    assert read_to_end("t", lambda msg: None, timeout=5) == {0: 5, 1: 5, 2: 3}
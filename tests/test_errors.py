@@ -0,0 +1,120 @@
+"""Tests of the dead-letter queue and of the commits waiting for it"""
+from consumers import consumer as consumer_module, errors
+from consumers.consumer import KafkaConsumer, LocalMessage
+from consumers.errors import DeadLetterQueue
+
+
+class Message(LocalMessage):
+    __slots__ = ()
+
+    def error(self):
+        return None
+
+
+class FakeProducer:
+    """Acknowledges messages at the poll after the one following their production, or on flush
+
+    The first `failures` deliveries fail.
+    """
+
+    failures = 0
+
+    def __init__(self, config):
+        self.queued = []
+        self.sent = []
+        self.delivered = []
+        self.failures = FakeProducer.failures
+
+    def produce(self, topic, value, key, headers=None, on_delivery=None):
+        self.queued.append((value, on_delivery))
+
+    def poll(self, timeout):
+        sent, self.sent, self.queued = self.sent, self.queued, []
+        self._deliver(sent)
+
+    def flush(self, timeout):
+        queued, self.sent, self.queued = self.sent + self.queued, [], []
+        self._deliver(queued)
+        return 0
+
+    def _deliver(self, messages):
+        for value, on_delivery in messages:
+            if self.failures:
+                self.failures -= 1
+                on_delivery("broker unavailable", None)
+            else:
+                self.delivered.append(value)
+                on_delivery(None, None)
+
+
+class FakeConsumer:
+    def __init__(self, config):
+        self.committed = []
+
+    def subscribe(self, topics, on_assign=None, on_revoke=None):
+        pass
+
+    def commit(self, offsets=None, asynchronous=True):
+        self.committed.append({tp.partition: tp.offset for tp in offsets})
+
+
+def dead_letter_queue(monkeypatch):
+    monkeypatch.setattr("confluent_kafka.Producer", FakeProducer)
+    monkeypatch.setattr(errors, "ensure_topic", lambda topic_name: None)
+    queue = DeadLetterQueue(topic_name="dead_letter", batch_size=10)
+    monkeypatch.setattr(errors, "_dead_letter_queue", queue)
+    return queue
+
+
+def test_dead_letters_count_as_written_once_delivered(monkeypatch):
+    monkeypatch.setattr(FakeProducer, "failures", 1)
+    queue = dead_letter_queue(monkeypatch)
+    for offset in range(3):
+        queue.add(Message("t", b"bad %d" % offset, partition=0, offset=offset), "decode", ValueError())
+    mark = queue.mark()
+
+    # Produced without waiting, nothing is delivered yet
+    assert not queue.flush()
+    assert queue.written.value == 0 and len(queue.in_flight) == 3
+    # The first delivery failed and is queued again, the others went through
+    assert not queue.written_through(mark)
+    assert queue.written.value == 2 and [record["offset"] for record in queue.pending] == [0]
+    queue.add(Message("t", b"bad 3", partition=0, offset=3), "decode", ValueError())
+    assert not queue.written_through(mark)
+    assert queue.written_through(queue.mark())
+    assert queue.producer.delivered == [b"bad 1", b"bad 2", b"bad 0", b"bad 3"]
+    assert queue.errors.value == 1
+
+
+def test_offsets_wait_for_their_dead_letters(monkeypatch):
+    queue = dead_letter_queue(monkeypatch)
+    monkeypatch.setattr(consumer_module, "Consumer", FakeConsumer)
+    consumer = KafkaConsumer("t", lambda msg: None, is_avro=False)
+
+    consumer._failed(Message("t", b"bad", partition=0, offset=4), "handler", ValueError(), None, b"bad")
+    assert consumer.commit() is False
+    assert consumer.consumer.committed == []
+    # Handled meanwhile: committed once the waiting offsets are
+    consumer._handled(Message("t", b"good", partition=1, offset=7))
+    assert consumer.commit() is True
+    assert consumer.consumer.committed == [{0: 5}]
+    consumer.commit_all()
+    assert consumer.consumer.committed == [{0: 5}, {1: 8}]
+    assert queue.producer.delivered == [b"bad"]
+
+
+def test_snapshots_wait_for_the_dead_letters_in_flight(monkeypatch, tmp_path):
+    from consumers.snapshot import Snapshotter, load_snapshot
+
+    queue = dead_letter_queue(monkeypatch)
+    monkeypatch.setattr(consumer_module, "Consumer", FakeConsumer)
+    consumer = KafkaConsumer("t", lambda msg: None, is_avro=False)
+    consumer._failed(Message("t", b"bad", partition=0, offset=4), "handler", ValueError(), None, b"bad")
+    snapshotter = Snapshotter(str(tmp_path / "snapshot"), {}, [consumer])
+
+    # Saving would record position 5, past a dead letter that could still be lost
+    assert snapshotter.save() is False
+    assert load_snapshot(snapshotter.path) is None
+    assert snapshotter.save() is True
+    assert load_snapshot(snapshotter.path)[1] == {"t": {0: 5}}
+    assert queue.producer.delivered == [b"bad"]
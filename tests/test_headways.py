@@ -0,0 +1,82 @@
+"""Tests of the streaming statistics and the arrival analytics"""
+import random
+import statistics
+
+from consumers.models.headways import ArrivalAnalytics, P2Quantile, StreamingStats
+
+
+def test_p2_quantile_tracks_the_exact_quantiles():
+    rng = random.Random(3)
+    values = [rng.expovariate(1 / 300) for _ in range(20000)]
+    for p in (0.5, 0.9):
+        estimate = P2Quantile(p)
+        for value in values:
+            estimate.add(value)
+        exact = sorted(values)[int(p * len(values))]
+        assert abs(estimate.value() - exact) / exact < 0.03
+
+
+def test_p2_quantile_before_five_observations():
+    estimate = P2Quantile(0.5)
+    assert estimate.value() is None
+    for value in (7, 1, 4):
+        estimate.add(value)
+    assert estimate.value() == 4
+
+
+def test_streaming_stats():
+    stats = StreamingStats()
+    assert stats.to_dict() == {"count": 0}
+    values = [2.0, 4.0, 4.0, 5.0, 9.0]
+    for value in values:
+        stats.add(value)
+    summary = stats.to_dict(scale=0.5)
+    assert summary["count"] == 5
+    assert summary["mean"] == round(statistics.mean(values) / 2, 3)
+    assert summary["stddev"] == round(statistics.stdev(values) / 2, 3)
+    assert (summary["min"], summary["max"]) == (1.0, 4.5)
+
+
+def arrival(train_id, station_id, prev_station_id=None):
+    return {
+        "line": "blue", "station_id": station_id, "direction": "a", "train_id": train_id,
+        "train_status": "in_service", "prev_station_id": prev_station_id,
+        "prev_direction": "a" if prev_station_id is not None else None,
+    }
+
+
+def test_travel_times_headways_and_etas():
+    analytics = ArrivalAnalytics()
+    # Two trains run 1 -> 2 -> 3, 60s apart, taking 100s per segment
+    for train_id, start in (("BL1", 0), ("BL2", 60000)):
+        for hop, (station_id, prev_station_id) in enumerate(((1, None), (2, 1), (3, 2))):
+            analytics.handle_arrival(arrival(train_id, station_id, prev_station_id), start + hop * 100000)
+    # A third train has just left station 1
+    analytics.handle_arrival(arrival("BL3", 1), 250000)
+
+    segments = {(s["from"][1], s["to"][1]): s["travel_secs"] for s in analytics.segment_stats()}
+    assert segments == {
+        (1, 2): {"count": 2, "mean": 100.0, "stddev": 0.0, "min": 100.0, "max": 100.0, "median": 100.0, "p90": 100.0},
+        (2, 3): {"count": 2, "mean": 100.0, "stddev": 0.0, "min": 100.0, "max": 100.0, "median": 100.0, "p90": 100.0},
+    }
+    assert analytics.headways[analytics.nodes[("blue", 2, "a")]].mean == 60000
+
+    etas = analytics.etas()
+    assert etas["clock_ms"] == 260000
+    by_station = {entry["station_id"]: entry for entry in etas["etas"]}
+    # Projected from BL3, 100s per segment
+    assert (by_station[2]["source"], by_station[2]["train_id"], by_station[2]["eta_ms"]) == ("train", "BL3", 350000)
+    assert by_station[3]["eta_ms"] == 450000
+    assert by_station[3]["eta_secs"] == 190.0
+    # Station 1 only has its headways to go by
+    assert by_station[1]["source"] == "headway"
+    assert [entry["station_id"] for entry in analytics.etas(station_id=3)["etas"]] == [3]
+
+
+def test_out_of_order_arrivals_do_not_count_negative_times():
+    analytics = ArrivalAnalytics()
+    analytics.handle_arrival(arrival("BL1", 1), 10000)
+    analytics.handle_arrival(arrival("BL1", 2, 1), 5000)
+    analytics.handle_arrival(arrival("BL2", 2, 1), 1000)
+    assert analytics.segments == {}
+    assert analytics.headways == {}
@@ -0,0 +1,112 @@
+"""Tests of the train movements of a line, with frequent breakdowns, and of its turnstiles"""
+import datetime
+import random
+
+import pytest
+
+from producers.models import Line
+from producers.models.producer import Producer
+from producers.schedule import Schedule
+from producers.stations import line_stations
+
+
+START = datetime.datetime(2020, 1, 6, 6, 0)
+
+
+@pytest.fixture
+def line(monkeypatch):
+    monkeypatch.setattr(Producer, "kafka_enabled", False)
+    monkeypatch.setattr(Producer, "event_sinks", [])
+    return Line(
+        Line.colors.blue, line_stations()["blue"][:8], num_trains=12, rng=random.Random(5),
+        timestamp=START, schedule=Schedule(default=datetime.timedelta(minutes=2)), breakdown_probability=0.3,
+    )
+
+
+def check_invariants(line):
+    on_line = [train for train in line.occupants if train is not None]
+    # Every train is either in the yard or at exactly one position of the line
+    assert sorted(id(train) for train in line.trains) == sorted(id(train) for train in list(line.yard) + on_line)
+    for position, train in enumerate(line.occupants):
+        if train is not None:
+            assert train.position == position
+    assert all(train.position is None for train in line.yard)
+
+    # Every train on the line either has its next move scheduled or waits for the position ahead,
+    # which is occupied by a train that will move on (and then reschedule it)
+    hops = [train for _, _, kind, train in line.events if kind == Line.HOP]
+    for train in on_line:
+        waits = line.waiting.get(train.position + 1) is train
+        assert waits != (train in hops)
+        if waits:
+            assert line.occupants[train.position + 1] is not None
+    assert len(hops) == len(set(map(id, hops)))
+
+
+def test_breakdowns_hold_and_withdraw_trains_without_losing_any(line):
+    until_ms = Producer.to_millis(START)
+    for _ in range(2 * 24 * 60):
+        until_ms += 60 * 1000
+        line.advance_trains(until_ms)
+        check_invariants(line)
+    assert line.breakdowns.value > 0
+    assert line.holds.value > 0
+    assert line.withdrawals.value > 0
+
+
+class Recorder:
+    """Event sink keeping the (station_id, timestamp) of every event"""
+
+    def __init__(self):
+        self.events = []
+
+    def write(self, topic, timestamp_ms, key_schema, value_schema, value):
+        self.events.append((value.get("station_id"), timestamp_ms))
+
+
+def make_line(seed):
+    return Line(Line.colors.blue, line_stations()["blue"][:8], num_trains=12, rng=random.Random(seed), timestamp=START)
+
+
+def test_turnstile_draws_do_not_depend_on_the_steps_drawn_before(monkeypatch):
+    monkeypatch.setattr(Producer, "kafka_enabled", False)
+    monkeypatch.setattr(Producer, "event_sinks", [])
+    time_step = datetime.timedelta(minutes=5)
+    steps = [START + i * time_step for i in range(36)]
+    in_order = make_line(7).stations[0].turnstile.turnstile_hardware
+    backwards = make_line(7).stations[0].turnstile.turnstile_hardware
+
+    expected = [in_order.get_entries(step, time_step) for step in steps]
+    assert [backwards.get_entries(step, time_step) for step in reversed(steps)] == expected[::-1]
+    # The noise differs between the steps of an hour, between stations and between seeds
+    assert len(set(expected)) > 1
+    assert [make_line(8).stations[0].turnstile.turnstile_hardware.get_entries(step, time_step) for step in steps] != expected
+    assert [make_line(7).stations[1].turnstile.turnstile_hardware.get_entries(step, time_step) for step in steps] != expected
+
+
+@pytest.mark.parametrize("minutes", [5, 7, 90])
+def test_turnstile_steps_drawn_by_hour_are_those_drawn_step_by_step(monkeypatch, minutes):
+    monkeypatch.setattr(Producer, "kafka_enabled", False)
+    recorder = Recorder()
+    monkeypatch.setattr(Producer, "event_sinks", [recorder])
+    time_step = datetime.timedelta(minutes=minutes)
+    start = START + datetime.timedelta(minutes=17)
+    num_steps = 40
+
+    line = make_line(11)
+    for i in range(num_steps):
+        line.advance_turnstiles(start + i * time_step, time_step)
+    step_by_step = sorted(recorder.events)
+    recorder.events.clear()
+
+    line = make_line(11)
+    step = 0
+    while step < num_steps:
+        curr_time = start + step * time_step
+        hour_end = curr_time.replace(minute=0) + datetime.timedelta(hours=1)
+        batch = min(-(-(hour_end - curr_time) // time_step), num_steps - step)
+        line.advance_turnstile_steps(curr_time, time_step, batch)
+        step += batch
+
+    assert step_by_step
+    assert sorted(recorder.events) == step_by_step
@@ -0,0 +1,96 @@
+"""Tests of the metrics instruments and registry"""
+import json
+import pickle
+import sys
+import threading
+
+from metrics import Counter, Histogram, Meter, Registry
+
+
+def test_counter_and_meter_count():
+    counter = Counter()
+    counter.inc()
+    counter.inc(4)
+    assert counter.snapshot() == 5
+
+    meter = Meter()
+    meter.mark(3)
+    meter.mark()
+    assert meter.snapshot()["count"] == 4
+
+
+def test_instruments_shared_by_threads_lose_no_updates():
+    # Switch threads as often as possible to expose unguarded read-modify-writes
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    counter, meter, histogram = Counter(), Meter(), Histogram()
+
+    def update():
+        for _ in range(20000):
+            counter.inc()
+            meter.mark()
+            histogram.observe(0.001)
+
+    threads = [threading.Thread(target=update) for _ in range(4)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert counter.snapshot() == 80000
+    assert meter.snapshot()["count"] == 80000
+    assert histogram.count == sum(histogram.counts) == 80000
+
+
+def test_histogram_quantiles_are_bucket_bounds():
+    histogram = Histogram(bounds=(1, 2, 4, 8))
+    for value in (0.5, 1.5, 1.5, 3, 7):
+        histogram.observe(value)
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 5
+    assert snapshot["mean"] == (0.5 + 1.5 + 1.5 + 3 + 7) / 5
+    assert snapshot["p50"] == 2
+    assert snapshot["p99"] == 8
+    assert snapshot["max"] == 7
+
+
+def test_histogram_beyond_last_bound_reports_max():
+    histogram = Histogram(bounds=(1,))
+    histogram.observe(5.0)
+    assert histogram.quantile(0.5) == 5.0
+    assert Histogram().quantile(0.5) is None
+
+
+def test_registry_returns_one_instrument_per_name(tmp_path):
+    registry = Registry()
+    assert registry.counter("a") is registry.counter("a")
+    registry.counter("a").inc(2)
+    registry.gauge("g").set(1.5)
+    path = tmp_path / "metrics.json"
+    registry.dump(path)
+    metrics = json.loads(path.read_text())["metrics"]
+    assert metrics == {"a": 2, "g": 1.5}
+
+
+def test_stats_callback_keeps_consumer_lag():
+    registry = Registry()
+    summary = registry.stats_callback(json.dumps({
+        "name": "client-1",
+        "type": "consumer",
+        "topics": {"t": {"partitions": {"0": {"consumer_lag": 7}, "-1": {"consumer_lag": 3}}}},
+    }))
+    assert summary["consumer_lag"] == {"t[0]": 7}
+    assert registry.snapshot()["librdkafka"]["client-1"]["type"] == "consumer"
+
+
+def test_instruments_survive_pickling():
+    histogram = Histogram(bounds=(1, 2))
+    histogram.observe(1.5)
+    meter = Meter()
+    meter.mark(2)
+    restored_histogram, restored_meter = pickle.loads(pickle.dumps((histogram, meter)))
+    assert restored_histogram.snapshot() == histogram.snapshot()
+    restored_meter.mark()
+    assert restored_meter.count == 3
@@ -0,0 +1,63 @@
+"""Tests of the paced emission of turnstile entries"""
+from producers import pacing
+from producers.pacing import PacedEmitter
+
+
+class FakeTurnstile:
+    def __init__(self, name, emitted):
+        self.name = name
+        self.emitted = emitted
+
+    def emit(self, timestamp_ms):
+        self.emitted.append((timestamp_ms, self.name))
+
+
+class FakeClock:
+    """Stands in for `time`: sleeping moves the clock forward, emitting takes no time"""
+
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 6))
+        self.now += seconds
+
+
+def streams(emitted):
+    a, b = FakeTurnstile("a", emitted), FakeTurnstile("b", emitted)
+    return [((t, a) for t in (0, 400, 800)), ((t, b) for t in (200, 600))]
+
+
+def test_entries_are_merged_in_event_time_order():
+    emitted = []
+    assert PacedEmitter(chunk_size=2).emit(streams(emitted), 0, 1000) == 5
+    assert emitted == [(0, "a"), (200, "b"), (400, "a"), (600, "b"), (800, "a")]
+
+
+def test_chunks_wait_for_their_share_of_the_budget(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(pacing, "time", clock)
+    emitted = []
+    PacedEmitter(chunk_size=2).emit(streams(emitted), 0, 1000, budget_secs=10.0)
+    # Chunks start with the entries at 0, 400 and 800ms of the 1000ms step
+    assert clock.sleeps == [4.0, 4.0]
+    assert len(emitted) == 5
+
+
+def test_late_chunks_do_not_wait(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(pacing, "time", clock)
+
+    class SlowTurnstile(FakeTurnstile):
+        def emit(self, timestamp_ms):
+            clock.now += 5.0
+
+    slow = SlowTurnstile("slow", [])
+    emitter = PacedEmitter(chunk_size=1)
+    emitter.emit([((t, slow) for t in (0, 500))], 0, 1000, budget_secs=2.0)
+    assert clock.sleeps == []
+    assert emitter.behind.max == 4.0
@@ -0,0 +1,91 @@
+import logging
+
+import pytest
+
+import config
+from producers.models import producer as producer_module
+from producers.models.producer import Producer
+
+
+class FakeClock:
+    """Stands in for `time`, moved forward by the fake client's polls"""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def perf_counter(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeClient:
+    """A Kafka client whose queue drains by `delivered` messages per poll (none: brokers down)"""
+
+    def __init__(self, clock, queued, delivered=0):
+        self.clock = clock
+        self.queued = queued
+        self.delivered = delivered
+        self.polls = 0
+
+    def __len__(self):
+        return self.queued
+
+    def poll(self, timeout):
+        self.polls += 1
+        self.clock.now += timeout
+        self.queued = max(self.queued - self.delivered, 0)
+        return 0
+
+    def produce(self, **kwargs):
+        self.queued += 1
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(producer_module, "time", clock)
+    monkeypatch.setattr(config, "PRODUCER_MAX_QUEUED", 10)
+    monkeypatch.setattr(config, "PRODUCER_BACKPRESSURE_WARN_SECS", 1.0)
+    monkeypatch.setattr(config, "PRODUCER_BACKPRESSURE_TIMEOUT_SECS", 5.0)
+    return clock
+
+
+def make_producer(monkeypatch, client):
+    monkeypatch.setattr(Producer, "kafka_enabled", False)
+    monkeypatch.setattr(Producer, "event_sinks", [])
+    producer = Producer("test.backpressure", key_schema=None)
+    producer.producer = client
+    return producer
+
+
+def test_a_full_queue_waits_for_deliveries(monkeypatch, clock):
+    client = FakeClient(clock, queued=10, delivered=1)
+    producer = make_producer(monkeypatch, client)
+
+    producer.produce({"timestamp": 0}, {})
+
+    # One delivery brings the queue under the limit, then the message is enqueued
+    assert client.polls == 2  # the wait, then the non-blocking poll after produce
+    assert client.queued == 9
+    assert producer.backpressure_wait.count >= 1
+
+
+def test_an_undrained_queue_warns_then_gives_up(monkeypatch, clock, caplog):
+    client = FakeClient(clock, queued=10)
+    producer = make_producer(monkeypatch, client)
+    start = clock.now
+    # Loading a module's logging.ini (e.g. producers.simulation) disables the loggers created before
+    monkeypatch.setattr(producer_module.logger, "disabled", False)
+
+    with caplog.at_level(logging.WARNING, logger=producer_module.__name__):
+        with pytest.raises(BufferError, match="10 messages still queued"):
+            producer.produce({"timestamp": 0}, {})
+
+    assert clock.now - start == pytest.approx(5.0, abs=0.1)
+    warnings = [r for r in caplog.records if "Waiting for" in r.getMessage()]
+    # Rate-limited: one warning per second of waiting, not one per poll
+    assert 4 <= len(warnings) <= 5
+    assert client.polls > 50
+    assert "test.backpressure" in warnings[0].getMessage()
@@ -0,0 +1,47 @@
+import time
+
+import pytest
+
+from profiling import StackSampler, WindowProfiler
+
+
+def spin(seconds):
+    deadline = time.process_time() + seconds
+    total = 0
+    while time.process_time() < deadline:
+        total += sum(range(100))
+    return total
+
+
+@pytest.mark.skipif(not StackSampler.available(), reason="needs setitimer on the main thread")
+def test_samples_land_in_the_busy_function_at_its_current_line():
+    sampler = StackSampler(interval=0.001)
+    sampler.start()
+    try:
+        spin(0.2)
+    finally:
+        sampler.stop()
+
+    total = sum(sampler.stacks.values())
+    in_spin = {stack: count for stack, count in sampler.stacks.items() if ";spin (test_profiling.py:" in stack}
+    assert total > 20
+    assert sum(in_spin.values()) > total * 0.9
+    # The line being executed, not the one of the `def`
+    first_line = spin.__code__.co_firstlineno
+    assert not any(f"spin (test_profiling.py:{first_line})" in stack for stack in in_spin)
+
+
+@pytest.mark.skipif(not StackSampler.available(), reason="needs setitimer on the main thread")
+def test_window_writes_the_sampled_stacks(tmp_path):
+    output = str(tmp_path / "window")
+    profiler = WindowProfiler(output, skip=1, window=2)
+    for _ in range(4):
+        profiler.step()
+        spin(0.05)
+
+    assert profiler.done
+    with open(f"{output}.folded") as f:
+        lines = f.read().splitlines()
+    assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert any("spin (test_profiling.py:" in line for line in lines)
+    assert (tmp_path / "window.pstats").exists()
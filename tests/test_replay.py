@@ -0,0 +1,64 @@
+"""Tests of the event log replayers, without Kafka"""
+import pytest
+
+from producers import replay
+from producers.event_log import EventLogReader, EventLogWriter
+from producers.models.producer import load_schema
+
+
+class FakeSchemaRegistry:
+    def __init__(self, config):
+        pass
+
+    def register(self, subject, schema):
+        return 1
+
+
+class FakeMetadata:
+    def __init__(self, topic):
+        self.topics = {topic: type("Topic", (), {"partitions": {0: None}})()}
+
+
+class FailingProducer:
+    """Stands in for the Kafka producer; the replay threads' instances fail on their first message"""
+
+    def __init__(self, config):
+        self.config = config
+
+    def list_topics(self, topic, timeout=None):
+        return FakeMetadata(topic)
+
+    def produce(self, *args, **kwargs):
+        raise RuntimeError("broker unavailable")
+
+
+@pytest.fixture
+def event_log(tmp_path):
+    path = str(tmp_path / "events.log")
+    writer = EventLogWriter(path)
+    for i in range(2000):
+        writer.write(
+            "com.udacity.weather", i, load_schema("weather_key.json"), load_schema("weather_value.json"),
+            {"temperature": 70, "status": "sunny"},
+        )
+    writer.close()
+    return path
+
+
+def test_failing_producer_thread_aborts_the_replay(event_log, monkeypatch):
+    monkeypatch.setattr(replay, "KafkaProducer", FailingProducer)
+    monkeypatch.setattr(replay, "CachedSchemaRegistryClient", FakeSchemaRegistry)
+    reader = EventLogReader(event_log)
+    try:
+        replayer = replay.KafkaReplayer(reader, num_threads=1, batch_size=10)
+        # More batches than the queue holds: the feeder must notice the dead thread instead of blocking
+        with pytest.raises(RuntimeError, match="producer thread failed"):
+            replayer.run()
+        assert len(replayer.errors) == 1
+    finally:
+        reader.close()
+
+
+def test_encode_long_round_trips_through_decode_leading_int():
+    for value in (0, 1, -1, 63, -64, 1578283800000, -(2 ** 40)):
+        assert replay.decode_leading_int(replay.encode_long(value)) == value
@@ -0,0 +1,88 @@
+"""Tests of the ridership reloading between ticks"""
+import datetime
+import os
+import shutil
+
+import pytest
+
+from producers.models.turnstile_hardware import TurnstileHardware
+from producers.ridership import RidershipWatcher
+
+
+class FakeStation:
+    station_id = 40380
+
+
+@pytest.fixture
+def curve(tmp_path, monkeypatch):
+    """Copies the ridership files, returns the path of the curve; hardware reads the copies"""
+    curve_path = tmp_path / "ridership_curve.csv"
+    seed_path = tmp_path / "ridership_seed.csv"
+    shutil.copy(TurnstileHardware.ridership_curve, curve_path)
+    shutil.copy(TurnstileHardware.ridership_seed, seed_path)
+    monkeypatch.setattr(TurnstileHardware, "tables", None)
+    monkeypatch.setattr(TurnstileHardware, "stations_in_use", {})
+    monkeypatch.setattr(TurnstileHardware, "ridership_curve", str(curve_path))
+    monkeypatch.setattr(TurnstileHardware, "ridership_seed", str(seed_path))
+    TurnstileHardware(FakeStation())
+    return curve_path
+
+
+def edit(path, text):
+    """Rewrites a file with a modification time that differs from the previous one"""
+    mtime = os.stat(path).st_mtime_ns
+    path.write_text(text)
+    os.utime(path, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+
+
+def flat_curve(ratio):
+    return "hour,ridership_ratio\n" + "".join(f"{hour},{ratio}\n" for hour in range(24))
+
+
+def test_changed_files_are_swapped_in(curve):
+    watcher = RidershipWatcher(interval=0)
+    assert watcher.check() is False
+    tables = TurnstileHardware.tables
+
+    edit(curve, flat_curve(0.5))
+    reloads = watcher.reloads.value
+    assert watcher.check() is True
+    assert watcher.reloads.value == reloads + 1
+    assert TurnstileHardware.tables is not tables
+    assert TurnstileHardware.tables.hour_ratios == [0.5] * 24
+    # The previous tables are left as they were, for readers still holding them
+    assert tables.hour_ratios != [0.5] * 24
+    hardware = TurnstileHardware(FakeStation())
+    assert hardware.get_entries(datetime.datetime(2020, 1, 6, 3), datetime.timedelta(minutes=5)) >= 0
+
+
+def test_broken_files_keep_the_current_tables_until_changed_again(curve):
+    watcher = RidershipWatcher(interval=0)
+    tables = TurnstileHardware.tables
+    errors = watcher.reload_errors.value
+
+    edit(curve, "hour,ridership_ratio\n0,0.5\n")
+    assert watcher.check() is False
+    assert TurnstileHardware.tables is tables
+    assert watcher.reload_errors.value == errors + 1
+    # Not retried while the file stays the same
+    assert watcher.check() is False
+    assert watcher.reload_errors.value == errors + 1
+
+    edit(curve, flat_curve(0.2))
+    assert watcher.check() is True
+    assert TurnstileHardware.tables.hour_ratios == [0.2] * 24
+
+
+def test_checks_wait_for_the_interval_unless_requested(curve):
+    watcher = RidershipWatcher(interval=3600)
+    edit(curve, flat_curve(0.3))
+    assert watcher.check() is False
+    watcher.request_reload()
+    assert watcher.check() is True
+    assert TurnstileHardware.tables.hour_ratios == [0.3] * 24
+    # A request reloads even unchanged files
+    tables = TurnstileHardware.tables
+    watcher.request_reload()
+    assert watcher.check() is True
+    assert TurnstileHardware.tables is not tables
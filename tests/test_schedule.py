@@ -0,0 +1,37 @@
+"""Tests of the train schedules"""
+import datetime
+
+from producers.schedule import Schedule
+
+
+def timestamp_ms(*args):
+    return int(datetime.datetime(*args, tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+
+def minutes(n):
+    return datetime.timedelta(minutes=n)
+
+
+# 2020-01-06 was a Monday
+MONDAY = (2020, 1, 6)
+
+
+def test_headways_apply_from_their_hour_until_the_next_one():
+    schedule = Schedule({0: {6: minutes(4), 9: minutes(8), 22: minutes(15)}})
+    assert schedule.headway_ms("blue", timestamp_ms(*MONDAY, 5, 59)) == 15 * 60000
+    assert schedule.headway_ms("blue", timestamp_ms(*MONDAY, 6)) == 4 * 60000
+    assert schedule.headway_ms("blue", timestamp_ms(*MONDAY, 8, 30)) == 4 * 60000
+    assert schedule.headway_ms("blue", timestamp_ms(*MONDAY, 21, 59)) == 8 * 60000
+    assert schedule.headway_ms("blue", timestamp_ms(*MONDAY, 23)) == 15 * 60000
+    # Tuesday has no entry
+    assert schedule.headway_ms("blue", timestamp_ms(2020, 1, 7, 8)) == 10 * 60000
+    assert schedule.min_headway_ms("blue") == 4 * 60000
+
+
+def test_schedules_per_line():
+    schedule = Schedule({"red": {6: {0: minutes(3)}}}, default=minutes(12))
+    sunday = timestamp_ms(2020, 1, 12, 12)
+    assert schedule.headway_ms("red", sunday) == 3 * 60000
+    assert schedule.headway_ms("red", timestamp_ms(*MONDAY, 12)) == 12 * 60000
+    assert schedule.headway_ms("green", sunday) == 12 * 60000
+    assert schedule.min_headway_ms("green") == 12 * 60000
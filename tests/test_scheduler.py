@@ -0,0 +1,92 @@
+"""Tests of the adaptive poll scheduling"""
+import json
+
+import pytest
+
+import config
+from consumers import consumer as consumer_module, scheduler
+from consumers.consumer import KafkaConsumer
+from consumers.scheduler import PollScheduler
+
+
+class FakeClock:
+    """Stands in for `time`, moved forward by the test"""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler, "time", clock)
+    return clock
+
+
+def steady(poll_scheduler, clock, messages_per_sec, interval=0.1, fetches=50):
+    """Feeds fetches at a steady rate, returns the last delay"""
+    for _ in range(fetches):
+        clock.now += interval
+        delay = poll_scheduler.next_delay(int(messages_per_sec * interval))
+    return delay
+
+
+def test_full_batches_and_lag_poll_again_at_once(clock):
+    poll_scheduler = PollScheduler(latency_target=1.0, batch_size=100)
+    clock.now += 1
+    assert poll_scheduler.next_delay(100) == 0.0
+    poll_scheduler.set_lag(150)
+    clock.now += 1
+    assert poll_scheduler.next_delay(75) == 0.0
+    # Caught up with the reported lag
+    clock.now += 1
+    assert poll_scheduler.next_delay(75) > 0
+    assert poll_scheduler.lag == 0
+
+
+def test_idle_and_slow_topics_wait_for_the_latency_target(clock):
+    poll_scheduler = PollScheduler(latency_target=1.0, batch_size=100)
+    assert steady(poll_scheduler, clock, 0) == 1.0
+    # 40 messages a second fill less than half a batch within the target
+    assert steady(poll_scheduler, clock, 40) == 1.0
+
+
+def test_busy_topics_wake_up_before_half_a_batch_is_in(clock):
+    poll_scheduler = PollScheduler(latency_target=1.0, batch_size=100)
+    assert steady(poll_scheduler, clock, 200, interval=0.2) == pytest.approx(0.25, rel=0.01)
+
+
+def test_delays_never_drop_below_the_floor(clock):
+    poll_scheduler = PollScheduler(latency_target=1.0, batch_size=100, min_delay=0.01)
+    assert steady(poll_scheduler, clock, 90000, interval=0.001) == 0.01
+
+
+def test_priorities_shorten_the_target_and_grow_the_batches():
+    arrival = PollScheduler.for_topic(config.DEFAULT_TOPICS.arrival)
+    weather = PollScheduler.for_topic(config.DEFAULT_TOPICS.weather)
+    assert arrival.latency_target < weather.latency_target
+    assert arrival.batch_size > weather.batch_size
+
+
+class FakeConsumer:
+    def __init__(self, properties):
+        pass
+
+    def subscribe(self, topics, on_assign=None, on_revoke=None):
+        pass
+
+
+def test_lag_reported_by_the_statistics_reaches_the_scheduler(monkeypatch):
+    monkeypatch.setattr(consumer_module, "Consumer", FakeConsumer)
+    consumer = KafkaConsumer("t", lambda msg: None, is_avro=False)
+    stats = {
+        "name": "consumer-1",
+        "topics": {"t": {"partitions": {
+            "0": {"consumer_lag": 30}, "1": {"consumer_lag": 12}, "2": {"consumer_lag": -1}, "-1": {},
+        }}},
+    }
+    consumer._on_stats(json.dumps(stats))
+    assert consumer.scheduler.lag == 42
@@ -0,0 +1,78 @@
+"""Tests of the dashboard's JSON endpoints, served from models fed without Kafka"""
+import json
+
+import pytest
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.testing import bind_unused_port
+
+import config
+from consumers.consumer import LocalMessage
+from consumers.models import Lines, TurnstileIndex, Weather
+from consumers.server import make_app
+
+
+STATION = {"station_id": 40380, "station_name": "Clark/Lake", "order": 1, "line": "blue"}
+
+
+@pytest.fixture
+def lines():
+    lines = Lines()
+    topics = config.DEFAULT_TOPICS
+    lines.process_message(LocalMessage(topics.trans_stations, json.dumps(STATION)))
+    for minute, count in ((0, 3), (10, 8)):
+        summary = json.dumps({"STATION_ID": STATION["station_id"], "COUNT": count})
+        lines.process_message(LocalMessage(topics.turnstile_summary, summary, timestamp_ms=minute * 60000))
+    return lines
+
+
+@pytest.fixture
+def turnstiles():
+    return TurnstileIndex()
+
+
+@pytest.fixture
+def fetch(lines, turnstiles):
+    """Returns (status code, decoded JSON body or None) of a GET on the app serving the models"""
+    io_loop = IOLoop()
+    sock, port = bind_unused_port()
+    server = HTTPServer(make_app("all", Weather(), lines, turnstiles))
+    server.add_sockets([sock])
+
+    def fetch(path):
+        async def get():
+            return await AsyncHTTPClient().fetch(f"http://127.0.0.1:{port}{path}", raise_error=False)
+
+        response = io_loop.run_sync(get)
+        return response.code, json.loads(response.body) if response.code == 200 else None
+
+    yield fetch
+    server.stop()
+    io_loop.close(all_fds=True)
+
+
+def test_station_history(fetch):
+    code, history = fetch("/api/stations/40380/history?resolution=10m&points=2")
+    assert code == 200
+    assert history["turnstile_entries"] == [[0, 3], [600000, 5]]
+    assert fetch("/api/stations/1/history")[0] == 404
+
+
+def test_station_history_rejects_bad_arguments(fetch):
+    for query in ("resolution=2m", "points=ten", "points=0", "points=-3"):
+        assert fetch("/api/stations/40380/history?" + query)[0] == 400
+
+
+def test_turnstile_summary(fetch, turnstiles):
+    turnstiles.station_lines[40380] = "blue"
+    turnstiles.add(40380, 60000, entries=4)
+    code, summary = fetch("/api/turnstiles?top=1")
+    assert code == 200
+    assert (summary["entries"], summary["top"]) == (4, [[40380, None, "blue", 4]])
+    assert fetch("/api/turnstiles?top=0")[1]["top"] == []
+
+
+def test_turnstile_summary_rejects_bad_arguments(fetch):
+    for query in ("window=2h", "top=ten", "top=-1"):
+        assert fetch("/api/turnstiles?" + query)[0] == 400
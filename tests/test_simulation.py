@@ -0,0 +1,12 @@
+"""Tests of the simulation setup"""
+import datetime
+
+import pytest
+
+from producers.simulation import TimeSimulation
+
+
+@pytest.mark.parametrize("kwargs", [{"sleep_seconds": 0}, {"time_step": datetime.timedelta(0)}])
+def test_a_time_step_of_zero_is_rejected(kwargs):
+    with pytest.raises(ValueError):
+        TimeSimulation(kafka_enabled=False, **kwargs)
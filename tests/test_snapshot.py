@@ -0,0 +1,82 @@
+"""Tests of the model snapshots"""
+import json
+import pickle
+
+import config
+from consumers.consumer import LocalMessage
+from consumers.models import Lines, TurnstileIndex, Weather
+from consumers.snapshot import Snapshotter, load_snapshot, save_snapshot
+from consumers.state import StateView
+
+
+TOPICS = config.DEFAULT_TOPICS
+STATION = {"station_id": 40380, "station_name": "Clark/Lake", "order": 1, "line": "blue"}
+
+
+class FakeConsumer:
+    def __init__(self, topic_name, positions):
+        self.topic_name_pattern = topic_name
+        self.positions = positions
+
+
+def models():
+    """The models of a front-end, fed a station, an arrival, a turnstile count and the weather"""
+    lines, weather, turnstiles = Lines(), Weather(), TurnstileIndex()
+    lines.process_message(LocalMessage(TOPICS.trans_stations, json.dumps(STATION)))
+    state_view = StateView(lines, weather)
+    snapshot = {
+        "station_id": 40380, "turnstile": {"count": 12, "timestamp": 60000},
+        "a": {"station_id": 40380, "train_id": "BL001", "direction": "a", "line": "blue",
+              "train_status": "in_service", "prev_station_id": None, "prev_direction": None, "timestamp": 30000},
+        "b": None,
+    }
+    state_view.process_message(LocalMessage(TOPICS.dashboard_state, json.dumps(snapshot), key=b"station:40380"))
+    state_view.process_message(LocalMessage(TOPICS.dashboard_state, json.dumps({"temperature": 41, "status": "windy"}),
+                                            key=b"weather"))
+    turnstiles.station_lines[40380] = "blue"
+    turnstiles.add(40380, 60000, entries=3)
+    return {"weather": weather, "lines": lines, "turnstiles": turnstiles, "state_view": state_view}
+
+
+def test_models_and_offsets_round_trip(tmp_path):
+    path = str(tmp_path / "snapshot")
+    network = models()
+    consumers = [FakeConsumer(TOPICS.arrival, {0: 12, 1: 7}), FakeConsumer(TOPICS.weather, {}),
+                 FakeConsumer(TOPICS.dashboard_state, {0: 3})]
+    Snapshotter(path, {TOPICS.prefix: network}, consumers).save()
+
+    restored, offsets = load_snapshot(path)
+    assert offsets == {TOPICS.arrival: {0: 12, 1: 7}, TOPICS.dashboard_state: {0: 3}}
+    network = restored[TOPICS.prefix]
+    assert (network["weather"].temperature, network["weather"].status) == (41, "windy")
+    station = network["lines"].get_station(40380)
+    assert (station.dir_a_train, station.num_turnstile_entries) == ("BL001", 12)
+    assert network["turnstiles"].entries("1h", station_id=40380) == 3
+    # The restored view keeps applying the state to the restored models
+    state_view = network["state_view"]
+    assert state_view.lines is network["lines"]
+    state_view.process_message(LocalMessage(
+        TOPICS.dashboard_state, json.dumps({"station_id": 40380, "turnstile": {"count": 20, "timestamp": 90000}}),
+        key=b"station:40380",
+    ))
+    assert station.num_turnstile_entries == 20
+
+
+def test_unusable_snapshots_are_ignored(tmp_path):
+    path = tmp_path / "snapshot"
+    assert load_snapshot(str(path)) is None
+    path.write_bytes(b"garbage")
+    assert load_snapshot(str(path)) is None
+    path.write_bytes(pickle.dumps({"version": 0, "models": {}, "offsets": {}}))
+    assert load_snapshot(str(path)) is None
+
+
+def test_a_failed_save_keeps_the_previous_snapshot(tmp_path):
+    path = str(tmp_path / "snapshot")
+    save_snapshot(path, {"weather": Weather()}, {TOPICS.weather: {0: 1}})
+    try:
+        save_snapshot(path, {"unpicklable": lambda: None}, {})
+    except (pickle.PicklingError, AttributeError):
+        pass
+    assert load_snapshot(path)[1] == {TOPICS.weather: {0: 1}}
+    assert [p.name for p in tmp_path.iterdir()] == ["snapshot"]
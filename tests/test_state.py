@@ -0,0 +1,52 @@
+"""Tests of the shared dashboard state, for a network of its own topics"""
+import json
+
+from consumers import state
+from consumers.consumer import LocalMessage
+from consumers.models import Lines, Weather
+from consumers.state import StatePublisher, StateView
+import config
+
+
+TOPICS = config.Topics("org.metro")
+STATION = {"station_id": 40380, "station_name": "Clark/Lake", "order": 1, "line": "blue"}
+
+
+class FakeProducer:
+    def __init__(self, properties):
+        self.records = []
+
+    def produce(self, topic, value, key):
+        self.records.append(LocalMessage(topic, value, key=key.encode("utf-8")))
+
+    def poll(self, timeout):
+        pass
+
+
+def test_snapshots_of_an_ingest_worker_feed_a_front_end(monkeypatch):
+    monkeypatch.setattr(state, "ensure_topic", lambda topic_name, topic_config: None)
+    monkeypatch.setattr(state, "KafkaProducer", FakeProducer)
+    publisher = StatePublisher(TOPICS)
+    handle = publisher.wrap(lambda message: None)
+    arrival = {
+        "station_id": 40380, "train_id": "BL001", "direction": "a", "line": "blue",
+        "train_status": "in_service", "prev_station_id": None, "prev_direction": None,
+    }
+    handle(LocalMessage(TOPICS.arrival, arrival, timestamp_ms=1000))
+    handle(LocalMessage(TOPICS.turnstile_summary, json.dumps({"STATION_ID": 40380, "COUNT": 12}), timestamp_ms=2000))
+    handle(LocalMessage(TOPICS.weather, {"temperature": 40, "status": "windy"}))
+    # Topics of the default network are not this publisher's
+    handle(LocalMessage(config.DEFAULT_TOPICS.arrival, dict(arrival, station_id=1), timestamp_ms=1000))
+    publisher.flush()
+    records = publisher.producer.records
+    assert {record.topic() for record in records} == {TOPICS.dashboard_state}
+    assert sorted(record.key() for record in records) == [b"station:40380", b"weather"]
+
+    lines, weather = Lines(TOPICS), Weather()
+    lines.process_message(LocalMessage(TOPICS.trans_stations, json.dumps(STATION)))
+    view = StateView(lines, weather, TOPICS)
+    for record in records:
+        view.process_message(record)
+    station = lines.get_station(40380)
+    assert (station.dir_a_train, station.num_turnstile_entries) == ("BL001", 12)
+    assert (weather.temperature, weather.status) == (40, "windy")
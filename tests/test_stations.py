@@ -0,0 +1,38 @@
+"""Tests of the station table loading"""
+from producers.stations import build_lines, line_stations, read_station_rows
+
+
+def row(station_id, name, order, *colors):
+    return {
+        "station_id": station_id, "station_name": name, "order": order,
+        "red": "red" in colors, "blue": "blue" in colors, "green": "green" in colors,
+    }
+
+
+def test_build_lines_orders_and_dedupes_stations():
+    rows = [
+        row(3, "Clark/Lake", 2, "blue", "green"),
+        row(1, "Harlem", 0, "green"),
+        # A second row of the same station, in the other direction
+        row(9, "Harlem", 0, "green"),
+        row(4, "Unordered", None, "blue"),
+        row(2, "Oak Park", 1, "blue", "green"),
+        row(5, "Howard", 0, "red"),
+    ]
+    assert build_lines(rows) == {
+        "red": [(5, "Howard")],
+        "blue": [(2, "Oak Park"), (3, "Clark/Lake"), (4, "Unordered")],
+        "green": [(1, "Harlem"), (2, "Oak Park"), (3, "Clark/Lake")],
+    }
+
+
+def test_line_stations_are_cached_by_content(tmp_path):
+    expected = build_lines(read_station_rows())
+    assert line_stations(cache_dir=tmp_path) == expected
+    (cache_file,) = tmp_path.glob("lines-*.pickle")
+    # Read back from the cache
+    assert line_stations(cache_dir=tmp_path) == expected
+    # A corrupt cache file is rebuilt
+    cache_file.write_bytes(b"not a pickle")
+    assert line_stations(cache_dir=tmp_path) == expected
+    assert all(len(stations) > 10 for stations in expected.values())
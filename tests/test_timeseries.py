@@ -0,0 +1,41 @@
+"""Tests of the per-station time series"""
+from consumers.models.timeseries import BucketSeries, MultiResolutionSeries, RingBuffer
+
+
+def test_ring_buffer_keeps_the_last_values_in_order():
+    buffer = RingBuffer(3)
+    assert buffer.to_list() == []
+    for value in range(1, 6):
+        buffer.append(value)
+    assert len(buffer) == 3
+    assert buffer.to_list() == [3, 4, 5]
+
+
+def test_bucket_series_sums_per_bucket_and_expires_old_buckets():
+    series = BucketSeries(width_ms=10, capacity=3)
+    series.add(0, 1)
+    series.add(5, 2)
+    series.add(12, 4)
+    assert series.points() == [[-10, 0], [0, 3], [10, 4]]
+    # Skipping ahead clears the buckets that now hold expired data
+    series.add(45, 1)
+    assert series.points() == [[20, 0], [30, 0], [40, 1]]
+    # Too old to be retained
+    series.add(5, 100)
+    assert series.points(num_points=2) == [[30, 0], [40, 1]]
+
+
+def test_bucket_series_points_until_a_later_time():
+    series = BucketSeries(width_ms=10, capacity=4)
+    series.add(10, 2)
+    assert series.points(num_points=3, until_ms=30) == [[10, 2], [20, 0], [30, 0]]
+    assert BucketSeries(10, 4).points() == []
+
+
+def test_trend_compares_consecutive_windows():
+    series = MultiResolutionSeries()
+    minute = 60 * 1000
+    for i in range(12):
+        series.add(i * 10 * minute, 10 if i < 6 else 15)
+    assert series.trend("10m", window=6) == 0.5
+    assert MultiResolutionSeries().trend() is None
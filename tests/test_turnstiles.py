@@ -0,0 +1,65 @@
+"""Tests of the windowed turnstile index"""
+from consumers.models.turnstiles import TurnstileIndex
+
+
+BUCKET_MS = TurnstileIndex.bucket_ms
+HOUR_MS = 12 * BUCKET_MS
+
+
+def index_of(lines):
+    index = TurnstileIndex()
+    index.station_lines.update(lines)
+    return index
+
+
+def test_window_sums_follow_the_newest_event():
+    index = index_of({1: "blue", 2: "red"})
+    index.add(1, 0, entries=5)
+    index.add(2, BUCKET_MS, entries=3)
+    assert index.entries("1h") == 8
+    assert index.entries("1h", station_id=1) == 5
+    assert index.entries("1h", line="red") == 3
+
+    # An hour after the first bucket, it has left the hour window but not the day one
+    index.add(2, HOUR_MS, entries=1)
+    assert index.entries("1h", station_id=1) == 0
+    assert index.entries("1h") == 4
+    assert index.entries("1d") == 9
+    assert index.summary("1h")["until"] == HOUR_MS + BUCKET_MS
+
+    # A day later, everything but the new entries has expired
+    index.add(1, HOUR_MS + 288 * BUCKET_MS, entries=2)
+    assert index.entries("1d") == 2
+    assert index.station_totals["1d"] == {1: 2}
+    assert len(index.buckets) == 1
+
+
+def test_late_entries_count_within_their_windows_only():
+    index = index_of({1: "blue"})
+    index.add(1, 2 * HOUR_MS, entries=1)
+    # Within the hour
+    index.add(1, 2 * HOUR_MS - BUCKET_MS, entries=2)
+    # Within the day only
+    index.add(1, 0, entries=4)
+    assert index.entries("1h") == 3
+    assert index.entries("1d") == 7
+    # Older than the longest window
+    index.add(1, -24 * HOUR_MS, entries=8)
+    assert index.num_late == 1
+    assert [number for number, _ in index.buckets] == sorted(number for number, _ in index.buckets)
+
+    # The late buckets expire as the head moves on
+    index.add(1, 2 * HOUR_MS + HOUR_MS, entries=1)
+    assert index.entries("1h") == 1
+    assert index.entries("1d") == 8
+
+
+def test_top_stations():
+    index = index_of({1: "blue", 2: "red", 3: "red"})
+    index.station_names.update({1: "A", 2: "B", 3: "C"})
+    for station_id, entries in ((1, 5), (2, 7), (3, 1)):
+        index.add(station_id, 0, entries=entries)
+    assert index.top("1h", 2) == [[2, "B", "red", 7], [1, "A", "blue", 5]]
+    assert index.top("1h", 5, line="red") == [[2, "B", "red", 7], [3, "C", "red", 1]]
+    summary = index.summary("1h", 1, line="blue")
+    assert (summary["entries"], summary["lines"], summary["top"]) == (5, {"blue": 5}, [[1, "A", "blue", 5]])
@@ -0,0 +1,25 @@
+"""Topic administration shared by the producers and the consumers"""
+import logging
+
+from confluent_kafka import KafkaError, KafkaException
+from confluent_kafka.admin import AdminClient, NewTopic
+
+import config
+
+
+logger = logging.getLogger(__name__)
+
+
+def ensure_topic(topic_name, topic_config=None, num_partitions=1, num_replicas=1):
+    """Creates the topic and waits for it, unless it already exists"""
+    client = AdminClient({"bootstrap.servers": config.BROKER_URL})
+    futures = client.create_topics(
+        [NewTopic(topic_name, num_partitions=num_partitions, replication_factor=num_replicas,
+                  config=topic_config or {})]
+    )
+    try:
+        futures[topic_name].result()
+        logger.info("Topic creation complete: %s", topic_name)
+    except KafkaException as e:
+        if e.args[0].code() != KafkaError.TOPIC_ALREADY_EXISTS:
+            raise